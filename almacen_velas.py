@@ -0,0 +1,185 @@
+# --- START OF FILE almacen_velas.py ---
+
+# Almacén local de velas cerradas por par e intervalo: un fichero binario de solo-añadir por columna
+# (open_time.bin, open.bin, ... close_time.bin) en particiones mensuales <raíz>/<SYMBOL>/<intervalo>/<AAAA-MM>/,
+# que se leen con np.memmap sin copiar. El bot añade las velas según se cierran, backfill rellena los huecos
+# desde el endpoint de klines y backtest.py y la web (/bot/chart_history) leen rangos del mismo almacén.
+#
+#   python almacen_velas.py backfill BTCUSDT 15m 2024-01-01 --hasta 2024-07-01 --hilos 4
+#   python almacen_velas.py huecos BTCUSDT 15m 2024-01-01
+#   python almacen_velas.py info BTCUSDT 15m
+#
+# backfill es reanudable: lo que falta se calcula del propio almacén, así que basta con relanzarlo.
+# Las peticiones van en paralelo pero todas pasan por limites_binance, igual que las del bot.
+
+import argparse
+import logging
+import os
+import shutil
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+import numpy as np
+
+COLUMNAS = (('open_time', 'i8'), ('open', 'f8'), ('high', 'f8'), ('low', 'f8'), ('close', 'f8'), ('volume', 'f8'), ('close_time', 'i8'))
+INTERVALOS_MS = {"1m": 60000, "3m": 180000, "5m": 300000, "15m": 900000, "30m": 1800000, "1h": 3600000, "2h": 7200000,
+                 "4h": 14400000, "6h": 21600000, "8h": 28800000, "12h": 43200000, "1d": 86400000, "3d": 259200000, "1w": 604800000}
+BACKFILL_LOTE = 1000 # Velas por petición (máximo de get_klines)
+BACKFILL_HILOS = 4
+
+def _mes(open_time_ms):
+    return np.asarray(open_time_ms, dtype='i8').astype('datetime64[ms]').astype('datetime64[M]').astype(str)
+
+def fecha_a_ms(texto):
+    # "2024-01-01", "2024-01-01T12:00" (UTC) o milisegundos epoch
+    if texto is None: return None
+    if str(texto).isdigit(): return int(texto)
+    fecha = datetime.fromisoformat(str(texto))
+    return int((fecha if fecha.tzinfo else fecha.replace(tzinfo=timezone.utc)).timestamp() * 1000)
+
+class AlmacenVelas:
+    def __init__(self, raiz):
+        self.raiz = raiz; self.lock = threading.Lock()
+        self.ultimos = {} # (symbol, interval) -> open_time de la última vela guardada
+
+    def _ruta(self, symbol, interval, mes=None):
+        ruta = os.path.join(self.raiz, symbol.upper(), interval)
+        return os.path.join(ruta, mes) if mes else ruta
+
+    def particiones(self, symbol, interval):
+        try: return sorted(m for m in os.listdir(self._ruta(symbol, interval)) if len(m) == 7 and m[4] == '-') # AAAA-MM
+        except FileNotFoundError: return []
+
+    def _leer_particion(self, ruta):
+        # Columnas como memmap de solo lectura. Si un añadido se cortó a medias, valen las primeras n filas comunes.
+        tamanos = [os.path.getsize(os.path.join(ruta, f"{c}.bin")) // 8 if os.path.exists(os.path.join(ruta, f"{c}.bin")) else 0 for c, _ in COLUMNAS]
+        n = min(tamanos)
+        if n == 0: return {c: np.empty(0, dtype=t) for c, t in COLUMNAS}
+        return {c: np.memmap(os.path.join(ruta, f"{c}.bin"), dtype=t, mode='r', shape=(n,)) for c, t in COLUMNAS}
+
+    def ultimo_open_time(self, symbol, interval):
+        clave = (symbol.upper(), interval)
+        if clave not in self.ultimos:
+            meses = self.particiones(symbol, interval); t = None
+            if meses:
+                ot = self._leer_particion(self._ruta(symbol, interval, meses[-1]))['open_time']
+                t = int(ot[-1]) if len(ot) else None
+            self.ultimos[clave] = t
+        return self.ultimos[clave]
+
+    def anadir(self, symbol, interval, velas):
+        # velas: cualquier objeto indexable por columna (array estructurado de velas.py, dict de arrays) con velas cerradas.
+        # Lo posterior a la última vela de su partición se añade al final; si rellena un hueco, la partición se reescribe.
+        ot = np.asarray(velas['open_time'], dtype='i8')
+        if not len(ot): return 0
+        meses = _mes(ot); total = 0
+        with self.lock:
+            for mes in np.unique(meses):
+                sel = meses == mes; nuevas = {c: np.ascontiguousarray(np.asarray(velas[c])[sel], dtype=t) for c, t in COLUMNAS}
+                ruta = self._ruta(symbol, interval, mes); os.makedirs(ruta, exist_ok=True)
+                previas = self._leer_particion(ruta); n = len(previas['open_time'])
+                if n == 0 or (nuevas['open_time'][0] > previas['open_time'][-1] and np.all(np.diff(nuevas['open_time']) > 0)):
+                    for c, _ in COLUMNAS:
+                        with open(os.path.join(ruta, f"{c}.bin"), "ab") as f:
+                            f.truncate(n * 8) # Descarta restos de un añadido cortado a medias
+                            f.write(nuevas[c].tobytes())
+                    total += len(nuevas['open_time'])
+                else: total += self._reescribir(ruta, previas, nuevas)
+            clave = (symbol.upper(), interval); ultimo = self.ultimos.get(clave)
+            self.ultimos[clave] = max(int(ot.max()), ultimo) if ultimo is not None else int(ot.max())
+        return total
+
+    def _reescribir(self, ruta, previas, nuevas):
+        # Mezcla ordenada sin duplicados (gana la vela nueva); se escribe aparte y se cambia de directorio
+        n_previas = len(previas['open_time'])
+        juntas = {c: np.concatenate([nuevas[c], previas[c]]) for c, _ in COLUMNAS}
+        _, idx = np.unique(juntas['open_time'], return_index=True) # Primera aparición = la nueva
+        tmp = f"{ruta}.tmp"; viejo = f"{ruta}.old"
+        shutil.rmtree(tmp, ignore_errors=True); os.makedirs(tmp)
+        for c, _ in COLUMNAS: juntas[c][idx].tofile(os.path.join(tmp, f"{c}.bin"))
+        previas.clear() # Suelta los memmap antes de mover el directorio
+        os.replace(ruta, viejo); os.replace(tmp, ruta); shutil.rmtree(viejo, ignore_errors=True)
+        return len(idx) - n_previas
+
+    def guardar_cerradas(self, symbol, interval, velas, ahora_ms=None):
+        # Desde el ciclo del bot: añade las velas cerradas posteriores a la última guardada (O(1) si no hay ninguna)
+        ahora_ms = ahora_ms if ahora_ms is not None else int(time.time() * 1000)
+        ultimo = self.ultimo_open_time(symbol, interval); ot = velas['open_time']; ct = velas['close_time']
+        desde = int(np.searchsorted(ot, ultimo, side='right')) if ultimo is not None else 0
+        hasta = int(np.searchsorted(ct, ahora_ms, side='left')) # close_time < ahora: cerrada
+        if hasta <= desde: return 0
+        return self.anadir(symbol, interval, {c: velas[c][desde:hasta] for c, _ in COLUMNAS})
+
+    def leer(self, symbol, interval, desde=None, hasta=None, limite=None):
+        # Columnas de las velas con desde <= open_time < hasta (ms); con limite, solo las últimas limite.
+        # Dentro de una partición son vistas del memmap (sin copia); si el rango abarca varias, se concatenan.
+        meses = self.particiones(symbol, interval)
+        if desde is not None: meses = [m for m in meses if m >= str(_mes(desde))]
+        if hasta is not None: meses = [m for m in meses if m <= str(_mes(hasta))]
+        trozos = []; cuantas = 0
+        for mes in reversed(meses):
+            cols = self._leer_particion(self._ruta(symbol, interval, mes)); ot = cols['open_time']
+            i = int(np.searchsorted(ot, desde, side='left')) if desde is not None else 0
+            j = int(np.searchsorted(ot, hasta, side='left')) if hasta is not None else len(ot)
+            if limite is not None: i = max(i, j - (limite - cuantas))
+            if j > i: trozos.append({c: v[i:j] for c, v in cols.items()}); cuantas += j - i
+            if limite is not None and cuantas >= limite: break
+        if not trozos: return {c: np.empty(0, dtype=t) for c, t in COLUMNAS}
+        if len(trozos) == 1: return trozos[0]
+        return {c: np.concatenate([t[c] for t in reversed(trozos)]) for c, _ in COLUMNAS}
+
+    def huecos(self, symbol, interval, desde, hasta):
+        # [(inicio, fin)] en ms (ambos open times incluidos) de las velas que faltan entre desde y hasta
+        paso = INTERVALOS_MS[interval]
+        inicio = -(-desde // paso) * paso; fin = (hasta - 1) // paso * paso
+        if fin < inicio: return []
+        ot = np.asarray(self.leer(symbol, interval, inicio, fin + 1)['open_time'])
+        bordes = np.concatenate([[inicio - paso], ot, [fin + paso]])
+        saltos = np.nonzero(np.diff(bordes) > paso)[0]
+        return [(int(bordes[k] + paso), int(bordes[k + 1] - paso)) for k in saltos]
+
+def backfill(almacen, cliente, symbol, interval, desde, hasta=None, hilos=BACKFILL_HILOS):
+    # Pide los huecos en lotes de BACKFILL_LOTE velas en paralelo y los guarda en orden según van llegando
+    from velas import decodificar_klines
+    paso = INTERVALOS_MS[interval]
+    ahora = int(time.time() * 1000); hasta = min(hasta or ahora, ahora - ahora % paso) # Solo velas cerradas
+    lotes = [(i, min(i + (BACKFILL_LOTE - 1) * paso, fin)) for ini, fin in almacen.huecos(symbol, interval, desde, hasta)
+             for i in range(ini, fin + 1, BACKFILL_LOTE * paso)]
+    if not lotes: logging.info(f"{symbol} {interval}: sin huecos entre {desde} y {hasta}."); return 0
+    logging.info(f"{symbol} {interval}: {len(lotes)} lotes por descargar.")
+    pedir = lambda lote: cliente.get_klines(symbol=symbol, interval=interval, startTime=lote[0], endTime=lote[1], limit=BACKFILL_LOTE)
+    guardadas = 0; t0 = time.monotonic()
+    with ThreadPoolExecutor(max_workers=hilos, thread_name_prefix="backfill") as pool:
+        for k, klines in enumerate(pool.map(pedir, lotes), 1): # map conserva el orden: cada partición crece por el final
+            if klines: guardadas += almacen.anadir(symbol, interval, decodificar_klines(klines))
+            if k % 20 == 0 or k == len(lotes): logging.info(f"{symbol} {interval}: {k}/{len(lotes)} lotes, {guardadas} velas ({time.monotonic() - t0:.0f}s).")
+    return guardadas
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - AlmacenVelas - %(message)s')
+    parser = argparse.ArgumentParser(description="Almacén local de velas (memmap por columnas) y backfill desde Binance.")
+    parser.add_argument("--raiz", default=os.environ.get("BOT_KLINE_STORE") or "almacen_velas")
+    sub = parser.add_subparsers(dest="modo", required=True)
+    p_back = sub.add_parser("backfill", help="Rellena los huecos entre desde y hasta (reanudable)")
+    p_back.add_argument("simbolo"); p_back.add_argument("intervalo", choices=INTERVALOS_MS); p_back.add_argument("desde", help="Fecha ISO (UTC) o ms epoch")
+    p_back.add_argument("--hasta", help="Fecha ISO (UTC) o ms epoch; por defecto, la última vela cerrada"); p_back.add_argument("--hilos", type=int, default=BACKFILL_HILOS)
+    p_huecos = sub.add_parser("huecos", help="Lista los rangos que faltan")
+    p_huecos.add_argument("simbolo"); p_huecos.add_argument("intervalo", choices=INTERVALOS_MS); p_huecos.add_argument("desde"); p_huecos.add_argument("--hasta")
+    p_info = sub.add_parser("info", help="Particiones y número de velas guardadas")
+    p_info.add_argument("simbolo"); p_info.add_argument("intervalo", choices=INTERVALOS_MS)
+    args = parser.parse_args()
+    almacen = AlmacenVelas(args.raiz); simbolo = args.simbolo.upper()
+    if args.modo == "backfill":
+        from binance.client import Client
+        from limites_binance import ClienteLimitado, LimitadorBinance
+        cliente = ClienteLimitado(Client(), LimitadorBinance()) # Endpoints públicos, sin claves
+        backfill(almacen, cliente, simbolo, args.intervalo, fecha_a_ms(args.desde), fecha_a_ms(args.hasta), args.hilos)
+    elif args.modo == "huecos":
+        for ini, fin in almacen.huecos(simbolo, args.intervalo, fecha_a_ms(args.desde), fecha_a_ms(args.hasta) or int(time.time() * 1000)):
+            print(f"{_mes(ini)}  {datetime.fromtimestamp(ini / 1000, timezone.utc):%Y-%m-%d %H:%M} -> {datetime.fromtimestamp(fin / 1000, timezone.utc):%Y-%m-%d %H:%M}  ({(fin - ini) // INTERVALOS_MS[args.intervalo] + 1} velas)")
+    else:
+        for mes in almacen.particiones(simbolo, args.intervalo):
+            ot = almacen._leer_particion(almacen._ruta(simbolo, args.intervalo, mes))['open_time']
+            print(f"{mes}: {len(ot)} velas" + (f" ({datetime.fromtimestamp(ot[0] / 1000, timezone.utc):%Y-%m-%d %H:%M} -> {datetime.fromtimestamp(ot[-1] / 1000, timezone.utc):%Y-%m-%d %H:%M})" if len(ot) else ""))
@@ -0,0 +1,216 @@
+# --- START OF FILE backtest.py ---
+
+# Backtest de las reglas del bot (estrategia.py) sobre klines históricas, sin conexión a Binance ni a la BD.
+# Una decisión por vela cerrada: pre-filtro RSI + cruce de SMA (vectorizado sobre toda la serie), confirmación IA
+# enchufable, compra LIMIT a precio * descuento válida ORDER_TIMEOUT_MINUTES y salida por TP/SL sobre el cierre.
+#
+#   python backtest.py descargar BTCUSDT 15m "2 years ago UTC" klines_btc_15m.json
+#   python backtest.py ejecutar klines_btc_15m.json --ia siempre --salida resultados/btc
+#   python backtest.py ejecutar almacen_velas/BTCUSDT/15m --desde 2024-01-01      # directorio del almacén de velas del bot
+#   python backtest.py ejecutar klines_btc_15m.json --ia replay --ia-fichero respuestas_ia.csv --tp 1.5 --sl 0.8
+#
+# El CSV de --ia replay es el que sale de trading_log:  \copy (SELECT timestamp, tipo_orden_ia FROM trading_log) TO 'respuestas_ia.csv' CSV HEADER
+
+import argparse
+import csv
+import json
+import logging
+import math
+import os
+import random
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+
+import estrategia
+from almacen_velas import AlmacenVelas, fecha_a_ms
+from indicadores import RSI_LENGTH, rsi_vectorizado, sma_vectorizada
+
+PARAMETROS_POR_DEFECTO = {
+    "tp_pct": float(estrategia.TARGET_PROFIT_PERCENT), "sl_pct": float(estrategia.STOP_LOSS_PERCENT),
+    "rsi_umbral": estrategia.RSI_UMBRAL_COMPRA, "rsi_length": RSI_LENGTH, "sma_cruce": estrategia.SMA_CRUCE,
+    "descuento_entrada": float(estrategia.DESCUENTO_ENTRADA), "timeout_min": estrategia.ORDER_TIMEOUT_MINUTES,
+    "comision_pct": 0.1, # Por lado (taker/maker de Binance sin BNB)
+    "cantidad_base": 0.0002, "capital_inicial": 1000.0,
+}
+VELAS_CALENTAMIENTO = 100 # Igual que KLINE_LIMIT_FOR_INDICATORS: el bot no decide con menos historial
+BLOQUE_BUSQUEDA_SALIDA = 512 # Velas revisadas de golpe al buscar TP/SL (se dobla si no aparece)
+
+# --- Datos ---
+def cargar_klines(path, desde=None, hasta=None):
+    # JSON con filas de get_klines / get_historical_klines, CSV de data.binance.vision (sin cabecera)
+    # o directorio <raíz>/<SYMBOL>/<intervalo> de almacen_velas (ordenado y sin duplicados; desde/hasta en ms).
+    if os.path.isdir(path):
+        raiz, intervalo = os.path.split(os.path.normpath(path)); raiz, simbolo = os.path.split(raiz)
+        cols = AlmacenVelas(raiz).leer(simbolo, intervalo, desde, hasta)
+        return {c: np.asarray(cols[c]) for c in ("open_time", "open", "high", "low", "close")}
+    if path.endswith(".csv"):
+        filas = np.loadtxt(path, delimiter=",", usecols=(0, 1, 2, 3, 4), ndmin=2)
+    else:
+        with open(path, "r") as f: filas = np.array([[float(v) for v in r[:5]] for r in json.load(f)])
+    _, idx = np.unique(filas[:, 0], return_index=True); filas = filas[idx] # Ordenadas y sin duplicados
+    return {"open_time": filas[:, 0].astype(np.int64), "open": filas[:, 1], "high": filas[:, 2], "low": filas[:, 3], "close": filas[:, 4]}
+
+def descargar_klines(symbol, interval, inicio, path):
+    from binance.client import Client
+    klines = Client().get_historical_klines(symbol, interval, inicio) # Endpoint público, sin claves
+    with open(path, "w") as f: json.dump(klines, f)
+    logging.info(f"{len(klines)} velas de {symbol} {interval} guardadas en {path}")
+
+def intervalo_ms(datos):
+    return int(np.median(np.diff(datos["open_time"][:1000]))) if len(datos["open_time"]) > 1 else 60000
+
+# --- IA enchufable: función(i) -> "BUY"/"SELL"/"HOLD" para la vela i ---
+def ia_siempre_confirma():
+    return lambda i: "BUY"
+
+def ia_stub(prob_buy=0.5, semilla=0):
+    # Confirmación aleatoria reproducible: sirve para medir cuánto aporta el pre-filtro por sí solo
+    rng = random.Random(semilla)
+    return lambda i: "BUY" if rng.random() < prob_buy else "HOLD"
+
+def ia_replay(path, datos, por_defecto="HOLD"):
+    # Respuestas reales registradas (timestamp, tipo_orden_ia) asignadas a la vela que las contiene
+    open_time = datos["open_time"]; respuestas = {}
+    with open(path, "r", newline="") as f:
+        for fila in csv.DictReader(f):
+            señal = (fila.get("tipo_orden_ia") or "").strip().upper()
+            if señal not in ("BUY", "SELL", "HOLD"): continue
+            ts = fila["timestamp"].strip()
+            ms = int(ts) if ts.isdigit() else int(datetime.fromisoformat(ts.replace("Z", "+00:00")).timestamp() * 1000)
+            i = int(np.searchsorted(open_time, ms, side="right")) - 1
+            if i >= 0: respuestas[i] = señal
+    logging.info(f"{len(respuestas)} respuestas IA registradas cargadas de {path}")
+    return lambda i: respuestas.get(i, por_defecto)
+
+# --- Señales e indicadores ---
+def calcular_señales(datos, params, cache=None):
+    # Máscara del pre-filtro de compra por vela. 'cache' (dict) reutiliza RSI/SMA entre combinaciones de parámetros.
+    cache = {} if cache is None else cache; close = datos["close"]
+    rsi_key = ("rsi", params["rsi_length"]); sma_key = ("sma", params["sma_cruce"])
+    if rsi_key not in cache: cache[rsi_key] = rsi_vectorizado(close, params["rsi_length"])
+    if sma_key not in cache: cache[sma_key] = sma_vectorizada(close, params["sma_cruce"])
+    rsi = cache[rsi_key]; sma = cache[sma_key]
+    mascara = np.zeros(len(close), dtype=bool)
+    mascara[1:] = estrategia.prefiltro_compra(rsi[1:], close[:-1], sma[:-1], close[1:], sma[1:], params["rsi_umbral"])
+    mascara[:VELAS_CALENTAMIENTO - 1] = False
+    return mascara
+
+def _primera_salida(close, desde, tp, sl):
+    # Índice de la primera vela >= desde cuyo cierre toca TP o SL, o None
+    n = len(close); bloque = BLOQUE_BUSQUEDA_SALIDA
+    while desde < n:
+        tramo = close[desde:desde + bloque]
+        hit = np.flatnonzero((tramo >= tp) | (tramo <= sl))
+        if hit.size: return desde + int(hit[0])
+        desde += bloque; bloque *= 2
+    return None
+
+# --- Simulador ---
+def ejecutar_backtest(datos, params=None, ia=None, cache=None):
+    p = dict(PARAMETROS_POR_DEFECTO, **(params or {})); ia = ia or ia_siempre_confirma()
+    open_, low, close = datos["open"], datos["low"], datos["close"]; n = len(close)
+    candidatos = np.flatnonzero(calcular_señales(datos, p, cache))
+    ventana = max(1, math.ceil(p["timeout_min"] * 60000 / intervalo_ms(datos))) # Velas en que la orden LIMIT sigue viva
+    com = p["comision_pct"] / 100.0; qty = p["cantidad_base"]
+    operaciones = []; rechazos_ia = 0; expiradas = 0; i = 0
+    while True:
+        pos = int(np.searchsorted(candidatos, i))
+        if pos >= len(candidatos): break
+        s = int(candidatos[pos])
+        if ia(s) != "BUY": rechazos_ia += 1; i = s + 1; continue
+        limite = estrategia.precio_entrada(close[s], p["descuento_entrada"])
+        hit = np.flatnonzero(low[s + 1:s + 1 + ventana] <= limite)
+        if not hit.size:
+            expiradas += 1; i = s + 1 + ventana; continue
+        j = s + 1 + int(hit[0]); entrada = min(limite, open_[j]) # Si abre por debajo del límite se llena a la apertura
+        tp, sl = estrategia.niveles_salida(entrada, p["tp_pct"], p["sl_pct"])
+        k = _primera_salida(close, j + 1, tp, sl)
+        abierta = k is None; k = n - 1 if abierta else k
+        salida = close[k]
+        pnl = qty * (salida * (1 - com) - entrada * (1 + com))
+        motivo = "ABIERTA" if abierta else estrategia.motivo_salida(salida, tp, sl)
+        operaciones.append({"senal": s, "entrada_idx": j, "salida_idx": k, "precio_entrada": float(entrada),
+                            "precio_salida": float(salida), "motivo": motivo, "pnl": float(pnl)})
+        if abierta: break
+        i = k + 1
+    equity = curva_equity(datos, operaciones, p)
+    return {"operaciones": operaciones, "equity": equity, "params": p,
+            "estadisticas": estadisticas(datos, operaciones, equity, p, rechazos_ia=rechazos_ia, ordenes_expiradas=expiradas, señales=len(candidatos))}
+
+def curva_equity(datos, operaciones, p):
+    close = datos["close"]; qty = p["cantidad_base"]; com = p["comision_pct"] / 100.0
+    realizado = np.zeros(len(close)); flotante = np.zeros(len(close))
+    for op in operaciones:
+        j, k = op["entrada_idx"], op["salida_idx"]
+        if op["motivo"] == "ABIERTA": flotante[j:] = qty * (close[j:] - op["precio_entrada"] * (1 + com))
+        else:
+            flotante[j:k] = qty * (close[j:k] - op["precio_entrada"] * (1 + com)); realizado[k] += op["pnl"]
+    return p["capital_inicial"] + np.cumsum(realizado) + flotante
+
+def estadisticas(datos, operaciones, equity, p, **extra):
+    pnls = np.array([op["pnl"] for op in operaciones if op["motivo"] != "ABIERTA"])
+    ganancias = pnls[pnls > 0].sum(); perdidas = -pnls[pnls < 0].sum()
+    pico = np.maximum.accumulate(equity); drawdown = (equity - pico) / pico
+    rend = np.diff(equity) / equity[:-1] if len(equity) > 1 else np.zeros(1)
+    periodos_año = 365 * 24 * 3600 * 1000 / intervalo_ms(datos)
+    en_posicion = sum(op["salida_idx"] - op["entrada_idx"] for op in operaciones)
+    return dict({
+        "velas": len(equity), "operaciones": len(pnls), "ganadoras_pct": float((pnls > 0).mean() * 100) if len(pnls) else 0.0,
+        "take_profit": sum(op["motivo"] == "TAKE_PROFIT" for op in operaciones), "stop_loss": sum(op["motivo"] == "STOP_LOSS" for op in operaciones),
+        "pnl_total": float(equity[-1] - p["capital_inicial"]), "rentabilidad_pct": float((equity[-1] / p["capital_inicial"] - 1) * 100),
+        "max_drawdown_pct": float(drawdown.min() * 100), "profit_factor": float(ganancias / perdidas) if perdidas > 0 else float("inf") if ganancias > 0 else 0.0,
+        "pnl_medio": float(pnls.mean()) if len(pnls) else 0.0, "exposicion_pct": float(en_posicion / len(equity) * 100),
+        "sharpe": float(rend.mean() / rend.std() * math.sqrt(periodos_año)) if rend.std() > 0 else 0.0,
+    }, **extra)
+
+def guardar_resultados(res, datos, prefijo):
+    os.makedirs(os.path.dirname(prefijo) or ".", exist_ok=True)
+    ot = datos["open_time"]; iso = lambda i: datetime.fromtimestamp(ot[i] / 1000, timezone.utc).isoformat()
+    with open(f"{prefijo}_operaciones.csv", "w", newline="") as f:
+        w = csv.writer(f); w.writerow(["senal", "entrada", "salida", "precio_entrada", "precio_salida", "motivo", "pnl"])
+        for op in res["operaciones"]:
+            w.writerow([iso(op["senal"]), iso(op["entrada_idx"]), iso(op["salida_idx"]), op["precio_entrada"], op["precio_salida"], op["motivo"], op["pnl"]])
+    with open(f"{prefijo}_equity.csv", "w", newline="") as f:
+        w = csv.writer(f); w.writerow(["open_time", "equity"]); w.writerows(zip(ot.tolist(), res["equity"].round(6).tolist()))
+    with open(f"{prefijo}_estadisticas.json", "w") as f: json.dump({"params": res["params"], "estadisticas": res["estadisticas"]}, f, indent=2)
+    logging.info(f"Resultados guardados en {prefijo}_operaciones.csv, {prefijo}_equity.csv y {prefijo}_estadisticas.json")
+
+def crear_ia(args, datos):
+    if args.ia == "replay":
+        if not args.ia_fichero: raise SystemExit("--ia replay necesita --ia-fichero")
+        return ia_replay(args.ia_fichero, datos)
+    if args.ia == "stub": return ia_stub(args.ia_prob, args.semilla)
+    return ia_siempre_confirma()
+
+def añadir_argumentos_parametros(parser):
+    d = PARAMETROS_POR_DEFECTO
+    parser.add_argument("--tp", dest="tp_pct", type=float, default=d["tp_pct"]); parser.add_argument("--sl", dest="sl_pct", type=float, default=d["sl_pct"])
+    parser.add_argument("--rsi-umbral", type=float, default=d["rsi_umbral"]); parser.add_argument("--rsi-length", type=int, default=d["rsi_length"])
+    parser.add_argument("--sma-cruce", type=int, default=d["sma_cruce"]); parser.add_argument("--descuento-entrada", type=float, default=d["descuento_entrada"])
+    parser.add_argument("--timeout-min", type=float, default=d["timeout_min"]); parser.add_argument("--comision-pct", type=float, default=d["comision_pct"])
+    parser.add_argument("--cantidad-base", type=float, default=d["cantidad_base"]); parser.add_argument("--capital-inicial", type=float, default=d["capital_inicial"])
+    parser.add_argument("--ia", choices=("siempre", "stub", "replay"), default="siempre", help="Confirmación IA simulada")
+    parser.add_argument("--ia-fichero", help="CSV (timestamp, tipo_orden_ia) para --ia replay")
+    parser.add_argument("--ia-prob", type=float, default=0.5, help="Probabilidad de BUY de --ia stub"); parser.add_argument("--semilla", type=int, default=0)
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - Backtest - %(message)s')
+    parser = argparse.ArgumentParser(description="Backtest de las reglas de gemini_bot sobre klines históricas.")
+    sub = parser.add_subparsers(dest="modo", required=True)
+    p_desc = sub.add_parser("descargar", help="Descarga klines históricas (REST público) a JSON")
+    p_desc.add_argument("simbolo"); p_desc.add_argument("intervalo"); p_desc.add_argument("inicio", help='Ej. "2 years ago UTC"'); p_desc.add_argument("salida")
+    p_ejec = sub.add_parser("ejecutar", help="Ejecuta el backtest sobre un fichero de klines")
+    p_ejec.add_argument("klines"); p_ejec.add_argument("--salida", help="Prefijo de los ficheros de resultados")
+    p_ejec.add_argument("--desde", help="Con un directorio del almacén: fecha ISO (UTC) o ms"); p_ejec.add_argument("--hasta")
+    añadir_argumentos_parametros(p_ejec)
+    args = parser.parse_args()
+    if args.modo == "descargar": descargar_klines(args.simbolo.upper(), args.intervalo, args.inicio, args.salida)
+    else:
+        t0 = time.perf_counter(); datos = cargar_klines(args.klines, fecha_a_ms(args.desde), fecha_a_ms(args.hasta)); t1 = time.perf_counter()
+        params = {k: getattr(args, k) for k in PARAMETROS_POR_DEFECTO}
+        res = ejecutar_backtest(datos, params, crear_ia(args, datos)); t2 = time.perf_counter()
+        logging.info(f"{len(datos['close'])} velas cargadas en {t1 - t0:.2f}s; backtest en {t2 - t1:.3f}s")
+        for k, v in res["estadisticas"].items(): logging.info(f"  {k}: {round(v, 4) if isinstance(v, float) else v}")
+        if args.salida: guardar_resultados(res, datos, args.salida)
@@ -0,0 +1,264 @@
+# --- START OF FILE benchmark.py ---
+
+# Benchmarks de las funciones calientes de gemini_bot sobre fixtures grabadas (klines, exchange info, órdenes),
+# sin red ni claves: el cliente de Binance y Gemini se sustituyen por dobles que sirven las fixtures.
+# Cada benchmark se calibra a ~BENCH_RONDA_SEGUNDOS por ronda y se queda con la mediana de BENCH_RONDAS rondas.
+#
+#   python benchmark.py grabar fixtures_bench --simbolo BTCUSDT     # klines y exchange info reales (endpoints públicos)
+#   python benchmark.py ejecutar --guardar-base bench_base.json      # fixtures sintéticas si no hay grabadas
+#   python benchmark.py ejecutar --base bench_base.json --umbral 1.3 --historial bench_historial.jsonl
+#
+# Con --base, el proceso sale con código 1 si algún benchmark es más lento que base * umbral (para CI).
+# Desde pytest (tests/test_benchmark.py) la misma comparación se activa con BENCH_BASE (y BENCH_UMBRAL):
+#   BENCH_BASE=bench_base.json BENCH_UMBRAL=1.3 python -m pytest -q tests/test_benchmark.py
+
+import argparse
+import decimal
+import json
+import logging
+import os
+import platform
+import queue
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+BENCH_RONDAS = 5
+BENCH_RONDA_SEGUNDOS = 0.2
+UMBRAL_POR_DEFECTO = 1.3 # Mediana más de un 30% peor que la base = regresión
+INTERVALO_MS = 15 * 60 * 1000
+LIMITES_SIN_ESPERAS = [{"rateLimitType": t, "interval": "SECOND", "intervalNum": 1, "limit": 10 ** 12} for t in ("REQUEST_WEIGHT", "ORDERS", "RAW_REQUESTS")]
+
+# --- Fixtures ---
+def generar_fixtures(directorio, simbolo="BTCUSDT", n=1000, semilla=7):
+    # Paseo aleatorio determinista con el formato exacto de get_klines / get_symbol_info / create_order
+    import numpy as np
+    rng = np.random.default_rng(semilla); cierres = 60000 * np.exp(np.cumsum(rng.normal(0, 0.002, n)))
+    t0 = 1700000000000 - 1700000000000 % INTERVALO_MS; klines = []
+    for i, c in enumerate(cierres):
+        o = cierres[i - 1] if i else c; h = max(o, c) * 1.001; l = min(o, c) * 0.999; t = t0 + i * INTERVALO_MS
+        klines.append([t, f"{o:.2f}", f"{h:.2f}", f"{l:.2f}", f"{c:.2f}", f"{rng.uniform(5, 50):.5f}", t + INTERVALO_MS - 1,
+                       f"{c * 20:.2f}", int(rng.integers(100, 1000)), "1.0", "60000.0", "0"])
+    info = {"symbol": simbolo, "status": "TRADING", "baseAsset": simbolo[:-4], "quoteAsset": simbolo[-4:], "filters": [
+        {"filterType": "PRICE_FILTER", "minPrice": "0.01000000", "maxPrice": "1000000.00000000", "tickSize": "0.01000000"},
+        {"filterType": "LOT_SIZE", "minQty": "0.00001000", "maxQty": "9000.00000000", "stepSize": "0.00001000"},
+        {"filterType": "NOTIONAL", "minNotional": "5.00000000", "applyMinToMarket": True, "maxNotional": "9000000.00000000"}]}
+    orden = {"symbol": simbolo, "orderId": 4242, "clientOrderId": "bench", "transactTime": t0, "price": "60000.00000000",
+             "origQty": "0.00020000", "executedQty": "0.00000000", "cummulativeQuoteQty": "0.00000000", "status": "NEW",
+             "timeInForce": "GTC", "type": "LIMIT", "side": "BUY"}
+    guardar_fixtures(directorio, simbolo, klines, info, orden)
+
+def grabar_fixtures(directorio, simbolo, intervalo):
+    from binance.client import Client
+    cliente = Client() # Endpoints públicos, sin claves
+    klines = cliente.get_klines(symbol=simbolo, interval=intervalo, limit=1000)
+    info = cliente.get_symbol_info(simbolo)
+    orden = {"symbol": simbolo, "orderId": 4242, "clientOrderId": "bench", "transactTime": klines[-1][0], "price": klines[-1][4],
+             "origQty": "0.00020000", "executedQty": "0.00000000", "cummulativeQuoteQty": "0.00000000", "status": "NEW",
+             "timeInForce": "GTC", "type": "LIMIT", "side": "BUY"} # Las órdenes no se pueden grabar sin claves
+    guardar_fixtures(directorio, simbolo, klines, info, orden)
+
+def guardar_fixtures(directorio, simbolo, klines, info, orden):
+    os.makedirs(directorio, exist_ok=True)
+    for nombre, datos in (("klines", klines), ("exchange_info", info), ("orden", orden)):
+        with open(os.path.join(directorio, f"{nombre}_{simbolo}.json"), "w") as f: json.dump(datos, f)
+    logging.info(f"Fixtures de {simbolo} ({len(klines)} velas) en {directorio}")
+
+def cargar_fixtures(directorio, simbolo):
+    datos = {}
+    for nombre in ("klines", "exchange_info", "orden"):
+        with open(os.path.join(directorio, f"{nombre}_{simbolo}.json"), "r") as f: datos[nombre] = json.load(f)
+    return datos
+
+# --- Dobles de Binance y Gemini ---
+class BinanceFixture:
+    def __init__(self, fx):
+        self.fx = fx; self.klines = fx["klines"]
+    def get_klines(self, symbol, interval, limit=500, startTime=None, **kwargs):
+        filas = [k for k in self.klines if startTime is None or k[0] >= startTime]
+        return filas[:limit] if startTime is not None else filas[-limit:]
+    def get_symbol_info(self, symbol): return self.fx["exchange_info"]
+    def get_exchange_info(self): return {"symbols": [self.fx["exchange_info"]]}
+    def get_account(self):
+        return {"balances": [{"asset": "BTC", "free": "0.01000000", "locked": "0.00000000"}, {"asset": "USDT", "free": "1000.00000000", "locked": "0.00000000"}]}
+    def get_server_time(self): return {"serverTime": int(time.time() * 1000)}
+    def create_order(self, **params): return dict(self.fx["orden"])
+    def get_order(self, symbol, orderId): return dict(self.fx["orden"], orderId=orderId)
+    def get_open_orders(self, **kwargs): return [self.fx["orden"]]
+    def cancel_order(self, symbol, orderId): return dict(self.fx["orden"], status="CANCELED")
+
+class GeminiFixture:
+    def generate_content(self, prompt, request_options=None):
+        return type("Respuesta", (), {"text": "HOLD"})()
+
+# --- Entorno del bot ---
+def preparar_bot(fx, simbolo, directorio_tmp):
+    import gemini_bot as g
+    from limites_binance import ClienteLimitado, LimitadorBinance
+    # Se mide el coste del envoltorio, no las esperas del cupo: con el limitador real las medidas dependerían de
+    # los tokens que dejó la ejecución anterior y la puerta de regresión fallaría al azar
+    from concurrent.futures import ThreadPoolExecutor
+    from reglas_simbolo import CacheExchangeInfo
+    limitador = LimitadorBinance(LIMITES_SIN_ESPERAS)
+    sustitutos = {
+        "binance_client": ClienteLimitado(BinanceFixture(fx), limitador, al_llamar=g._metrica_peticion_binance),
+        "model_ai": GeminiFixture(), "_ia_inicializada": True,
+        "DATABASE_URL": "bench", "iniciar_db_writer": lambda: None, # log_to_db llega a la cola, sin BD
+        "ipc_server": None, "USE_USER_DATA_STREAM": False, "almacen_velas": None, # Sin escrituras en disco durante la medida
+        "exchange_info_cache": CacheExchangeInfo(), # En memoria, sin fichero
+        "symbol_states": {}, "kline_cache": {}, "kline_cache_locks": {}, "velas_cache": {}, "indicator_states": {},
+        "ai_executor": ThreadPoolExecutor(max_workers=g.AI_MAX_CONCURRENT, thread_name_prefix="ia"),
+    }
+    originales = {nombre: getattr(g, nombre) for nombre in sustitutos}
+    for nombre, valor in sustitutos.items(): setattr(g, nombre, valor)
+
+    def restaurar():
+        # El módulo queda como estaba (otros tests del mismo proceso de pytest lo usan después)
+        g.ai_executor.shutdown(wait=False, cancel_futures=True)
+        for nombre, valor in originales.items(): setattr(g, nombre, valor)
+
+    si = g.get_binance_symbol_info(simbolo)
+    st = g.SymbolState(simbolo, si, decimal.Decimal("0.0002"), principal=True)
+    st.chart_data_file = os.path.join(directorio_tmp, "chart_data.json"); st.bot_status_file = os.path.join(directorio_tmp, "bot_status.json")
+    g.symbol_states[simbolo] = st
+    return g, st, restaurar
+
+def vaciar_cola(g):
+    try:
+        while True: g.db_queue.get_nowait()
+    except queue.Empty: pass
+
+def definir_benchmarks(g, st, fx):
+    velas = g.obtener_velas(st.symbol, g.KLINE_INTERVAL_FOR_INDICATORS, g.KLINE_LIMIT_FOR_CHART)
+    fila_db = {c: None for c in g.DB_COLUMN_ORDER}
+    fila_db.update({"timestamp": datetime.now(), "accion_bot": "CICLO_SIN_ACCION_NOTABLE", "simbolo": st.symbol, "precio_ejecutado": decimal.Decimal("60000.12"),
+                    "tiene_posicion_despues": False, "balance_base_despues": decimal.Decimal("0.01"), "notas_adicionales": "N/A"})
+    precio = decimal.Decimal(fx["klines"][-1][4]); cantidad = decimal.Decimal("0.000234567")
+
+    def indicadores_en_frio():
+        g.indicator_states.clear(); g.calcular_indicadores(velas.copy(), st.symbol)
+
+    def log_db():
+        g.log_to_db(fila_db); vaciar_cola(g)
+
+    def ciclo(con_posicion):
+        def _ciclo():
+            st.has_position = con_posicion; st.last_buy_price = precio * decimal.Decimal("0.995") if con_posicion else decimal.Decimal("0")
+            st.open_order_details = None; st.consulta_ia = None; st.current_forced_action = None
+            st.vela_decidida = None # Cada iteración evalúa la entrada como tras un cierre de vela
+            g.ejecutar_ciclo(st); vaciar_cola(g)
+        return _ciclo
+
+    def tick():
+        def _tick():
+            st.has_position = True; st.last_buy_price = precio * decimal.Decimal("0.995")
+            g.tick_precio(st)
+        return _tick
+
+    return {
+        "obtener_velas": lambda: g.obtener_velas(st.symbol, g.KLINE_INTERVAL_FOR_INDICATORS, g.KLINE_LIMIT_FOR_CHART),
+        "calcular_indicadores_incremental": lambda: g.calcular_indicadores(velas, st.symbol),
+        "calcular_indicadores_en_frio": indicadores_en_frio,
+        "formatear_klines_para_prompt": lambda: g.formatear_klines_para_prompt(velas),
+        "log_to_db_coercion": log_db,
+        "format_price": lambda: g.format_price(st.si_data, precio),
+        "format_quantity": lambda: g.format_quantity(st.si_data, cantidad),
+        "construir_estado_bot": lambda: g.construir_estado_bot(st, velas, decimal.Decimal("0.01"), decimal.Decimal("1000"), "CICLO_SIN_ACCION_NOTABLE"),
+        "ciclo_completo_sin_posicion": ciclo(False),
+        "ciclo_completo_con_posicion": ciclo(True),
+        "tick_precio_con_posicion": tick(),
+    }
+
+# --- Medición ---
+def medir(funcion, rondas=BENCH_RONDAS, segundos_ronda=BENCH_RONDA_SEGUNDOS):
+    funcion() # Calentamiento (cachés, imports diferidos)
+    n = 1
+    while True: # Calibra las iteraciones para que cada ronda dure ~segundos_ronda
+        t0 = time.perf_counter()
+        for _ in range(n): funcion()
+        dt = time.perf_counter() - t0
+        if dt >= segundos_ronda / 4 or n >= 1 << 20: break
+        n *= 4
+    n = max(1, int(n * segundos_ronda / max(dt, 1e-9)))
+    tiempos = []
+    for _ in range(rondas):
+        t0 = time.perf_counter()
+        for _ in range(n): funcion()
+        tiempos.append((time.perf_counter() - t0) / n)
+    return {"mediana_us": statistics.median(tiempos) * 1e6, "min_us": min(tiempos) * 1e6, "iteraciones": n, "rondas": rondas}
+
+def comparar(resultados, base, umbral):
+    regresiones = []
+    for nombre, r in resultados.items():
+        ref = base.get("resultados", {}).get(nombre)
+        if not ref: continue
+        ratio = r["mediana_us"] / ref["mediana_us"] if ref["mediana_us"] else 1.0
+        r["ratio_base"] = round(ratio, 3)
+        if ratio > umbral: regresiones.append((nombre, ratio))
+    return regresiones
+
+def ejecutar(args):
+    if args.base and not os.path.exists(args.base): # Sin base no hay puerta: mejor fallar que aprobar sin comparar
+        print(f"No existe la base {args.base}"); return 2
+    raiz = logging.getLogger(); nivel = raiz.level
+    raiz.setLevel(logging.WARNING) # El log del bot por consola falsearía las medidas
+    try: return _ejecutar(args)
+    finally: raiz.setLevel(nivel)
+
+def _ejecutar(args):
+    directorio = args.fixtures
+    if not os.path.exists(os.path.join(directorio, f"klines_{args.simbolo}.json")):
+        logging.warning(f"Sin fixtures en {directorio}; se generan sintéticas.")
+        generar_fixtures(directorio, args.simbolo)
+    fx = cargar_fixtures(directorio, args.simbolo)
+    with tempfile.TemporaryDirectory() as tmp:
+        g, st, restaurar = preparar_bot(fx, args.simbolo, tmp)
+        try:
+            benchmarks = definir_benchmarks(g, st, fx)
+            seleccion = [b for b in benchmarks if not args.solo or any(s in b for s in args.solo)]
+            resultados = {}
+            for nombre in seleccion:
+                resultados[nombre] = medir(benchmarks[nombre], args.rondas, args.segundos_ronda)
+                print(f"{nombre:<36} {resultados[nombre]['mediana_us']:>12.1f} us  (min {resultados[nombre]['min_us']:.1f}, x{resultados[nombre]['iteraciones']})")
+        finally: restaurar()
+    informe = {"fecha": datetime.now().isoformat(timespec="seconds"), "python": platform.python_version(), "maquina": platform.node(),
+               "fixtures": directorio, "resultados": resultados}
+    codigo = 0
+    if args.base:
+        with open(args.base, "r") as f: base = json.load(f)
+        regresiones = comparar(resultados, base, args.umbral)
+        for nombre, ratio in regresiones: print(f"REGRESIÓN {nombre}: x{ratio:.2f} respecto a {args.base} (umbral x{args.umbral})")
+        if regresiones: codigo = 1
+        else: print(f"Sin regresiones respecto a {args.base} (umbral x{args.umbral}).")
+    if args.guardar_base:
+        with open(args.guardar_base, "w") as f: json.dump(informe, f, indent=2)
+        print(f"Base guardada en {args.guardar_base}")
+    if args.historial:
+        with open(args.historial, "a") as f: f.write(json.dumps(informe) + "\n") # Serie temporal para seguir la evolución
+    return codigo
+
+def crear_parser():
+    parser = argparse.ArgumentParser(description="Benchmarks de gemini_bot sobre fixtures, sin red ni claves.")
+    sub = parser.add_subparsers(dest="modo", required=True)
+    p_grabar = sub.add_parser("grabar", help="Graba klines y exchange info reales como fixtures")
+    p_grabar.add_argument("directorio"); p_grabar.add_argument("--simbolo", default="BTCUSDT"); p_grabar.add_argument("--intervalo", default="15m")
+    p_gen = sub.add_parser("generar", help="Genera fixtures sintéticas deterministas")
+    p_gen.add_argument("directorio"); p_gen.add_argument("--simbolo", default="BTCUSDT"); p_gen.add_argument("--velas", type=int, default=1000)
+    p_ej = sub.add_parser("ejecutar", help="Ejecuta los benchmarks")
+    p_ej.add_argument("--fixtures", default="fixtures_bench"); p_ej.add_argument("--simbolo", default="BTCUSDT")
+    p_ej.add_argument("--solo", nargs="*", help="Solo los benchmarks cuyo nombre contenga alguno de estos textos")
+    p_ej.add_argument("--rondas", type=int, default=BENCH_RONDAS); p_ej.add_argument("--segundos-ronda", type=float, default=BENCH_RONDA_SEGUNDOS)
+    p_ej.add_argument("--base", help="JSON de una ejecución anterior con la que comparar")
+    p_ej.add_argument("--umbral", type=float, default=UMBRAL_POR_DEFECTO, help="Ratio de mediana a partir del cual hay regresión")
+    p_ej.add_argument("--guardar-base", help="Guarda estos resultados como nueva base")
+    p_ej.add_argument("--historial", help="JSONL al que añadir esta ejecución")
+    return parser
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - Benchmark - %(message)s')
+    args = crear_parser().parse_args()
+    if args.modo == "grabar": grabar_fixtures(args.directorio, args.simbolo, args.intervalo)
+    elif args.modo == "generar": generar_fixtures(args.directorio, args.simbolo, args.velas)
+    else: sys.exit(ejecutar(args))
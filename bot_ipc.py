@@ -0,0 +1,207 @@
+# --- START OF FILE bot_ipc.py ---
+
+# Canal local entre gemini_bot (servidor) y web_interface (cliente) sobre un socket Unix.
+# Mensajes JSON delimitados por salto de línea:
+#   bot -> web: {"type": "status", "symbol", "principal", "data"}
+#               {"type": "chart", "symbol", "principal", "mode": "snapshot"|"update"|"append", "candles"|"candle"}
+#               {"type": "ack", "id", "ok", "message"}
+#   web -> bot: {"type": "command", "id", "command", "symbol"}   {"type": "resync"}
+# El servidor numera cada mensaje por conexión ("seq"); si el cliente ve un salto pide "resync" y recibe de nuevo
+# el último estado y gráfico completos. Un cliente que no lee a tiempo se desconecta (nunca bloquea al bot).
+
+import itertools
+import json
+import logging
+import os
+import queue
+import socket
+import threading
+import time
+
+IPC_SOCKET_PATH = os.environ.get("BOT_IPC_SOCKET", "bot_ipc.sock")
+IPC_CLIENT_QUEUE_MAX = 1000 # Mensajes pendientes por cliente antes de desconectarlo
+IPC_RECONNECT_SECONDS = 1.0
+
+def chart_delta_events(prev_chart, new_chart):
+    # Compara la ventana de velas anterior con la nueva. Devuelve eventos candle-update/candle-append,
+    # [] si no cambió nada, o None si la nueva ventana no continúa la anterior (hace falta un snapshot).
+    if not prev_chart or not new_chart: return [] if prev_chart == new_chart else None
+    last_time = prev_chart[-1].get("time")
+    idx = next((i for i in range(len(new_chart) - 1, -1, -1) if new_chart[i].get("time") == last_time), None)
+    if idx is None: return None
+    events = []
+    if new_chart[idx] != prev_chart[-1]: events.append(("candle-update", {"candle": new_chart[idx]}))
+    if idx + 1 < len(new_chart): events.append(("candle-append", {"candles": new_chart[idx + 1:]}))
+    return events
+
+def _send_line(sock, msg):
+    sock.sendall((json.dumps(msg, default=str) + "\n").encode())
+
+def _read_lines(sock):
+    buf = b""
+    while True:
+        data = sock.recv(65536)
+        if not data: return
+        buf += data
+        while b"\n" in buf:
+            linea, buf = buf.split(b"\n", 1)
+            if linea.strip(): yield json.loads(linea)
+
+# --- Lado bot ---
+class IpcServer:
+    def __init__(self, path=IPC_SOCKET_PATH, on_command=None):
+        self.path = path; self.on_command = on_command
+        self.lock = threading.Lock(); self.clients = {} # socket -> cola de salida
+        self.status = {}; self.charts = {}; self.principal = {} # Último estado publicado por símbolo
+
+    def start(self):
+        if os.path.exists(self.path): os.unlink(self.path) # Socket huérfano de una ejecución anterior
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.bind(self.path); os.chmod(self.path, 0o600); self.sock.listen(16)
+        threading.Thread(target=self._accept_loop, name="ipc-accept", daemon=True).start()
+        logging.info(f"Canal IPC escuchando en {self.path}")
+        return self
+
+    def close(self):
+        for conn in list(self.clients): self._drop(conn)
+        try: self.sock.close(); os.unlink(self.path)
+        except OSError: pass
+
+    def _accept_loop(self):
+        while True:
+            try: conn, _ = self.sock.accept()
+            except OSError: return
+            q = queue.Queue(maxsize=IPC_CLIENT_QUEUE_MAX)
+            with self.lock:
+                self.clients[conn] = q
+                for msg in self._snapshot_messages(): q.put_nowait(msg)
+            threading.Thread(target=self._writer_loop, args=(conn, q), name="ipc-writer", daemon=True).start()
+            threading.Thread(target=self._reader_loop, args=(conn, q), name="ipc-reader", daemon=True).start()
+            logging.info("Cliente IPC conectado.")
+
+    def _snapshot_messages(self):
+        msgs = [{"type": "status", "symbol": s, "principal": self.principal.get(s, False), "data": d} for s, d in self.status.items()]
+        msgs += [{"type": "chart", "symbol": s, "principal": self.principal.get(s, False), "mode": "snapshot", "candles": c} for s, c in self.charts.items()]
+        return msgs
+
+    def _drop(self, conn):
+        with self.lock: q = self.clients.pop(conn, None)
+        if q is not None:
+            try: q.put_nowait(None)
+            except queue.Full: pass
+            try: conn.shutdown(socket.SHUT_RDWR)
+            except OSError: pass
+
+    def _writer_loop(self, conn, q):
+        seq = itertools.count(1)
+        try:
+            while True:
+                msg = q.get()
+                if msg is None: break
+                _send_line(conn, dict(msg, seq=next(seq)))
+        except OSError: pass
+        finally: self._drop(conn); conn.close()
+
+    def _reader_loop(self, conn, q):
+        try:
+            for msg in _read_lines(conn):
+                if msg.get("type") == "resync":
+                    with self.lock:
+                        for m in self._snapshot_messages(): q.put_nowait(m)
+                elif msg.get("type") == "command":
+                    ok, message = self.on_command(msg.get("command", ""), msg.get("symbol")) if self.on_command else (False, "Sin manejador")
+                    q.put_nowait({"type": "ack", "id": msg.get("id"), "ok": ok, "message": message})
+        except (OSError, ValueError, queue.Full) as e: logging.debug(f"Cliente IPC desconectado: {e}")
+        finally: self._drop(conn)
+
+    def _publish(self, msg):
+        with self.lock:
+            for conn, q in list(self.clients.items()):
+                try: q.put_nowait(msg)
+                except queue.Full:
+                    logging.warning("Cliente IPC demasiado lento. Desconectando.")
+                    threading.Thread(target=self._drop, args=(conn,), daemon=True).start()
+
+    def publish_status(self, symbol, principal, data):
+        with self.lock: self.status[symbol] = data; self.principal[symbol] = principal
+        self._publish({"type": "status", "symbol": symbol, "principal": principal, "data": data})
+
+    def publish_chart(self, symbol, principal, candles):
+        with self.lock:
+            events = chart_delta_events(self.charts.get(symbol), candles) if symbol in self.charts else None
+            self.charts[symbol] = candles; self.principal[symbol] = principal
+        base = {"type": "chart", "symbol": symbol, "principal": principal}
+        if events is None: self._publish(dict(base, mode="snapshot", candles=candles)); return
+        for event_type, payload in events:
+            self._publish(dict(base, mode="update" if event_type == "candle-update" else "append", **payload))
+
+# --- Lado web ---
+class IpcClient:
+    def __init__(self, path=IPC_SOCKET_PATH, on_update=None):
+        self.path = path; self.on_update = on_update
+        self.lock = threading.Lock(); self.sock = None; self.connected = False; self.seq = 0
+        self.status = {}; self.charts = {}; self.principal_symbol = None
+        self.ids = itertools.count(1); self.pending = {} # id de comando -> [Event, ack]
+
+    def start(self):
+        threading.Thread(target=self._run, name="ipc-client", daemon=True).start()
+        return self
+
+    def _run(self):
+        while True:
+            try:
+                sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM); sock.connect(self.path)
+                with self.lock: self.sock = sock; self.connected = True; self.seq = 0
+                logging.info(f"Conectado al canal IPC del bot ({self.path}).")
+                for msg in _read_lines(sock): self._apply(msg)
+            except (OSError, ValueError) as e: logging.debug(f"Canal IPC no disponible: {e}")
+            with self.lock:
+                was_connected = self.connected; self.connected = False; self.sock = None
+            if was_connected:
+                logging.warning("Canal IPC del bot desconectado. Reintentando...")
+                if self.on_update: self.on_update()
+            time.sleep(IPC_RECONNECT_SECONDS)
+
+    def _apply(self, msg):
+        seq = msg.get("seq", 0)
+        if seq != self.seq + 1: self._send({"type": "resync"})
+        self.seq = seq
+        tipo = msg.get("type")
+        if tipo == "ack":
+            entry = self.pending.get(msg.get("id"))
+            if entry: entry[1] = msg; entry[0].set()
+            return
+        symbol = msg.get("symbol"); pedir_resync = False
+        with self.lock:
+            if msg.get("principal"): self.principal_symbol = symbol
+            if tipo == "status": self.status[symbol] = msg.get("data") or {}
+            elif tipo == "chart":
+                mode = msg.get("mode"); chart = self.charts.get(symbol)
+                if mode == "snapshot" or chart is None: self.charts[symbol] = list(msg.get("candles") or [])
+                elif mode == "update" and chart and chart[-1].get("time") == msg["candle"].get("time"): chart[-1] = msg["candle"]
+                elif mode == "append" and chart: # El servidor nunca añade a una ventana vacía (manda snapshot)
+                    largo = len(chart); chart.extend(msg.get("candles") or [])
+                    del chart[:-largo] # Mantiene el tamaño de la ventana
+                else: pedir_resync = True # Delta que no encaja: pedir de nuevo el estado completo
+        if pedir_resync: self._send({"type": "resync"}) # Fuera del lock: _send lo toma
+        if self.on_update: self.on_update()
+
+    def _send(self, msg):
+        with self.lock: sock = self.sock
+        if sock is None: return False
+        try: _send_line(sock, msg); return True
+        except OSError: return False
+
+    def get_principal(self):
+        # (status, chart) del símbolo principal, o (None, None) si no hay conexión o aún no llegó nada
+        with self.lock:
+            if not self.connected or self.principal_symbol is None: return None, None
+            return dict(self.status.get(self.principal_symbol) or {}), list(self.charts.get(self.principal_symbol) or [])
+
+    def send_command(self, command, symbol=None, timeout=2.0):
+        # Devuelve el ack del bot ({"ok", "message"}) o None si no hay conexión o no respondió a tiempo
+        cmd_id = next(self.ids); entry = [threading.Event(), None]; self.pending[cmd_id] = entry
+        try:
+            if not self._send({"type": "command", "id": cmd_id, "command": command, "symbol": symbol}): return None
+            entry[0].wait(timeout); return entry[1]
+        finally: self.pending.pop(cmd_id, None)
@@ -0,0 +1,66 @@
+# --- START OF FILE cuenta.py ---
+
+# Instantánea de la cuenta de Binance compartida por todos los símbolos: una sola llamada firmada get_account
+# sirve todos los saldos desde memoria mientras sea reciente. Se invalida tras nuestras propias órdenes/fills y
+# puede alimentarse con los eventos outboundAccountPosition del user-data stream (entonces no caduca por edad).
+
+import decimal
+import logging
+import threading
+import time
+
+ACCOUNT_SNAPSHOT_MAX_AGE = 5.0 # Segundos que una instantánea REST se considera fresca
+
+class SnapshotCuenta:
+    def __init__(self, obtener_cuenta, max_edad=ACCOUNT_SNAPSHOT_MAX_AGE):
+        self.obtener_cuenta = obtener_cuenta; self.max_edad = max_edad
+        self.lock = threading.Lock(); self.lock_fetch = threading.Lock()
+        self.saldos_libres = {}; self.saldos_bloqueados = {}
+        self.actualizado = 0.0 # time.time() de la última actualización (REST o stream)
+        self.valido = False; self.por_stream = False
+        self.llamadas_rest = 0
+
+    def edad(self):
+        return time.time() - self.actualizado if self.actualizado else float("inf")
+
+    def _fresca(self):
+        return self.valido and (self.por_stream or self.edad() <= self.max_edad)
+
+    def refrescar(self, forzar=False):
+        # Una sola petición en vuelo: los hilos que llegan mientras tanto reutilizan su resultado
+        with self.lock_fetch:
+            if not forzar and self._fresca(): return True
+            try: cuenta = self.obtener_cuenta(); self.llamadas_rest += 1
+            except Exception as e:
+                logging.error(f"Error obteniendo la cuenta: {e}" + (f" (se usan saldos de hace {self.edad():.0f}s)" if self.actualizado else ""))
+                return False
+            libres = {b['asset']: decimal.Decimal(b['free']) for b in cuenta.get('balances', [])}
+            bloqueados = {b['asset']: decimal.Decimal(b['locked']) for b in cuenta.get('balances', [])}
+            with self.lock:
+                self.saldos_libres = libres; self.saldos_bloqueados = bloqueados
+                self.actualizado = time.time(); self.valido = True
+            return True
+
+    def saldo(self, asset):
+        if not self._fresca(): self.refrescar()
+        with self.lock: return self.saldos_libres.get(asset, decimal.Decimal('0.0'))
+
+    def saldos(self):
+        if not self._fresca(): self.refrescar()
+        with self.lock: return {"libres": dict(self.saldos_libres), "bloqueados": dict(self.saldos_bloqueados), "edad_segundos": round(self.edad(), 3)}
+
+    def invalidar(self):
+        # Tras una orden, cancelación o fill propio: el siguiente saldo() vuelve a preguntar a Binance
+        with self.lock: self.valido = False
+
+    def aplicar_outbound_account_position(self, evento):
+        # {"e": "outboundAccountPosition", "E": ms, "u": ms, "B": [{"a": "BTC", "f": "0.1", "l": "0.0"}, ...]} (solo activos que cambian)
+        with self.lock:
+            for b in evento.get('B', []):
+                self.saldos_libres[b['a']] = decimal.Decimal(b['f']); self.saldos_bloqueados[b['a']] = decimal.Decimal(b['l'])
+            if self.por_stream: self.valido = True; self.actualizado = time.time()
+
+    def marcar_stream(self, activo):
+        # Con el stream conectado (y tras una instantánea REST inicial) los eventos mantienen los saldos al día
+        with self.lock: self.por_stream = activo
+        if activo: self.refrescar(forzar=True)
@@ -0,0 +1,171 @@
+# --- START OF FILE esquema_bd.py ---
+
+# Esquema de trading_log en PostgreSQL: tabla particionada por meses de "timestamp" (PARTITION BY RANGE) con
+# índices B-tree (simbolo, timestamp) y (accion_bot, id) y BRIN en timestamp, creados en la tabla padre para que
+# cada partición los herede. Las particiones se crean con PARTICIONES_ADELANTADAS meses de antelación; lo que
+# caiga fuera (relojes raros, filas sin fecha) va a la partición DEFAULT.
+# Una tabla antigua sin particionar se migra la primera vez: se renombra a <tabla>_sin_particionar, se copian las
+# filas con sus mismos ids (la marca de agua del rollup de G/P sigue valiendo) y la secuencia continúa donde iba.
+# Retención: las particiones de más de N meses se archivan (CSV gzip, opcional) y se sueltan, y las filas de latido
+# (ciclos sin acción) se borran pasados M días. El rollup diario de G/P no se toca: sus totales sobreviven.
+#
+#   python esquema_bd.py estado
+#   python esquema_bd.py migrar [--borrar-antigua]
+#   python esquema_bd.py mantener --retencion-meses 12 --archivo archivo_trading_log --retencion-latidos-dias 30
+
+import argparse
+import gzip
+import logging
+import os
+import re
+from datetime import date, datetime, timedelta, timezone
+
+PARTICIONES_ADELANTADAS = 2 # Meses futuros con partición ya creada
+ACCIONES_LATIDO = ("CICLO_SIN_ACCION_NOTABLE", "PREFILTRO_NO_COMPRA") # Filas de cada ciclo sin operación
+
+def _sumar_meses(d, n):
+    # Primer día del mes n meses después (o antes, con n negativo) del de d
+    anio, mes = divmod(d.year * 12 + d.month - 1 + n, 12)
+    return date(anio, mes + 1, 1)
+
+def _limite(d): return f"{d:%Y-%m-%d} 00:00:00+00" # Límites de partición en UTC, no en la zona de la sesión
+
+def tipo_tabla(cur, tabla):
+    # 'p' particionada, 'r' tabla normal, None si no existe
+    cur.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass(%s)", (tabla,))
+    fila = cur.fetchone()
+    return fila[0] if fila else None
+
+def particiones(cur, tabla):
+    # {mes (date): nombre} de las particiones mensuales (la DEFAULT no cuenta)
+    cur.execute("SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid WHERE i.inhparent = to_regclass(%s)", (tabla,))
+    patron = re.compile(rf"^{re.escape(tabla)}_(\d{{4}})(\d{{2}})$"); meses = {}
+    for (nombre,) in cur.fetchall():
+        m = patron.match(nombre)
+        if m: meses[date(int(m.group(1)), int(m.group(2)), 1)] = nombre
+    return meses
+
+def asegurar_particiones(cur, tabla, desde, hasta):
+    # Una partición por mes entre desde y hasta (ambos incluidos); devuelve las creadas
+    creadas = []; existentes = particiones(cur, tabla); mes = desde.replace(day=1)
+    while mes <= hasta:
+        if mes not in existentes:
+            nombre = f"{tabla}_{mes:%Y%m}"
+            cur.execute(f"CREATE TABLE {nombre} PARTITION OF {tabla} FOR VALUES FROM ('{_limite(mes)}') TO ('{_limite(_sumar_meses(mes, 1))}')")
+            creadas.append(nombre)
+        mes = _sumar_meses(mes, 1)
+    return creadas
+
+def _crear_tabla_particionada(cur, tabla, columnas_tipos):
+    # Misma columna id de siempre (ahora BIGINT), pero la PK incluye timestamp: en PostgreSQL toda clave única
+    # de una tabla particionada debe contener la clave de partición. Los ids los sigue dando la secuencia.
+    cols = ", ".join(f'"{c}" {t}' + (" NOT NULL" if c == "timestamp" else "") for c, t in columnas_tipos.items())
+    cur.execute(f"CREATE SEQUENCE IF NOT EXISTS {tabla}_id_seq AS BIGINT")
+    cur.execute(f"ALTER SEQUENCE {tabla}_id_seq AS BIGINT") # La de SERIAL es integer
+    cur.execute(f"""CREATE TABLE {tabla} (id BIGINT NOT NULL DEFAULT nextval('{tabla}_id_seq'), {cols},
+                    PRIMARY KEY (id, "timestamp")) PARTITION BY RANGE ("timestamp")""")
+    cur.execute(f"ALTER SEQUENCE {tabla}_id_seq OWNED BY {tabla}.id")
+    cur.execute(f"CREATE TABLE {tabla}_default PARTITION OF {tabla} DEFAULT")
+    cur.execute(f'CREATE INDEX {tabla}_simbolo_ts_idx ON {tabla} (simbolo, "timestamp")') # Historial/gráficos de un par por rango de fechas
+    cur.execute(f"CREATE INDEX {tabla}_accion_idx ON {tabla} (accion_bot, id)") # Filtro por acción con el cursor por id de /bot/history
+    cur.execute(f'CREATE INDEX {tabla}_ts_brin ON {tabla} USING BRIN ("timestamp")') # Rangos de fechas sin filtro: unos KB por partición
+
+def preparar_tabla(conn, tabla, columnas_tipos, borrar_antigua=False):
+    # Crea la tabla particionada o migra la antigua; no hace nada si ya está particionada. Una sola transacción:
+    # si algo falla la tabla original queda como estaba.
+    hoy = datetime.now(timezone.utc).date()
+    with conn.cursor() as cur:
+        tipo = tipo_tabla(cur, tabla)
+        if tipo == 'p':
+            asegurar_particiones(cur, tabla, hoy, _sumar_meses(hoy, PARTICIONES_ADELANTADAS)); conn.commit(); return False
+        if tipo is None:
+            _crear_tabla_particionada(cur, tabla, columnas_tipos)
+            asegurar_particiones(cur, tabla, hoy, _sumar_meses(hoy, PARTICIONES_ADELANTADAS)); conn.commit()
+            logging.info(f"Tabla particionada '{tabla}' creada."); return True
+        antigua = f"{tabla}_sin_particionar"
+        logging.info(f"Migrando '{tabla}' a tabla particionada por meses (la original queda como '{antigua}')...")
+        cur.execute(f"LOCK TABLE {tabla} IN ACCESS EXCLUSIVE MODE")
+        cur.execute(f"ALTER TABLE {tabla} RENAME TO {antigua}")
+        cur.execute("SELECT conname FROM pg_constraint WHERE conrelid = to_regclass(%s) AND contype = 'p'", (antigua,))
+        for (pk,) in cur.fetchall(): cur.execute(f"ALTER TABLE {antigua} RENAME CONSTRAINT {pk} TO {antigua}_pkey") # Libera el nombre <tabla>_pkey
+        cur.execute(f'SELECT min("timestamp"), max("timestamp") FROM {antigua}')
+        primero, ultimo = cur.fetchone()
+        _crear_tabla_particionada(cur, tabla, columnas_tipos)
+        desde = primero.astimezone(timezone.utc).date() if primero else hoy
+        hasta = max(ultimo.astimezone(timezone.utc).date() if ultimo else hoy, _sumar_meses(hoy, PARTICIONES_ADELANTADAS))
+        asegurar_particiones(cur, tabla, desde, hasta)
+        cols = ", ".join(f'"{c}"' for c in columnas_tipos)
+        origen = ", ".join(f"COALESCE(\"{c}\", 'epoch')" if c == "timestamp" else f'"{c}"' for c in columnas_tipos) # Sin fecha -> DEFAULT
+        cur.execute(f"INSERT INTO {tabla} (id, {cols}) SELECT id, {origen} FROM {antigua}")
+        copiadas = cur.rowcount
+        cur.execute(f"SELECT setval('{tabla}_id_seq', GREATEST((SELECT max(id) FROM {tabla}), 1))")
+        if borrar_antigua: cur.execute(f"DROP TABLE {antigua}")
+        cur.execute(f"ANALYZE {tabla}")
+    conn.commit()
+    logging.info(f"{copiadas} filas migradas a '{tabla}' ({desde:%Y-%m} -> {hasta:%Y-%m})." +
+                 ("" if borrar_antigua else f" '{antigua}' se puede borrar cuando se haya comprobado."))
+    return True
+
+def _archivar(cur, particion, directorio):
+    # COPY de la partición a <directorio>/<particion>.csv.gz; se escribe aparte y se renombra al terminar
+    os.makedirs(directorio, exist_ok=True)
+    ruta = os.path.join(directorio, f"{particion}.csv.gz"); tmp = f"{ruta}.tmp"
+    with gzip.open(tmp, "wt", encoding="utf-8") as f: cur.copy_expert(f"COPY {particion} TO STDOUT WITH (FORMAT csv, HEADER)", f)
+    os.replace(tmp, ruta)
+    return ruta
+
+def mantener(conn, tabla, retencion_meses=0, directorio_archivo=None, retencion_latidos_dias=0):
+    # Crea las particiones de los próximos meses y aplica la retención (0 = sin límite). Cada partición soltada
+    # se confirma por separado: un fallo a mitad deja hecho lo anterior y no toca lo siguiente.
+    hoy = datetime.now(timezone.utc).date(); resumen = {"creadas": [], "soltadas": [], "latidos_borrados": 0}
+    with conn.cursor() as cur:
+        if tipo_tabla(cur, tabla) != 'p': logging.warning(f"'{tabla}' no está particionada; ejecuta primero la migración."); return resumen
+        resumen["creadas"] = asegurar_particiones(cur, tabla, hoy, _sumar_meses(hoy, PARTICIONES_ADELANTADAS)); conn.commit()
+        if retencion_latidos_dias > 0:
+            cur.execute(f'DELETE FROM {tabla} WHERE accion_bot = ANY(%s) AND "timestamp" < %s',
+                        (list(ACCIONES_LATIDO), datetime.now(timezone.utc) - timedelta(days=retencion_latidos_dias)))
+            resumen["latidos_borrados"] = cur.rowcount; conn.commit()
+        if retencion_meses > 0:
+            corte = _sumar_meses(hoy, -retencion_meses) # Se conservan los N meses completos anteriores y el actual
+            for mes, particion in sorted(particiones(cur, tabla).items()):
+                if mes >= corte: break
+                try:
+                    ruta = _archivar(cur, particion, directorio_archivo) if directorio_archivo else None
+                    cur.execute(f"ALTER TABLE {tabla} DETACH PARTITION {particion}"); cur.execute(f"DROP TABLE {particion}")
+                    conn.commit(); resumen["soltadas"].append(particion)
+                    logging.info(f"Partición '{particion}' eliminada por retención" + (f" (archivada en {ruta})." if ruta else "."))
+                except Exception as e: # OSError del archivo o error de la BD
+                    conn.rollback(); logging.error(f"No se pudo retirar la partición '{particion}': {e}"); break
+    return resumen
+
+def estado(conn, tabla):
+    # [(particion, filas estimadas, tamaño)] para el CLI
+    with conn.cursor() as cur:
+        cur.execute("""SELECT c.relname, c.reltuples::bigint, pg_size_pretty(pg_total_relation_size(c.oid))
+                       FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid WHERE i.inhparent = to_regclass(%s) ORDER BY c.relname""", (tabla,))
+        return tipo_tabla(cur, tabla), cur.fetchall()
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - EsquemaBD - %(message)s')
+    import psycopg2
+    from gemini_bot import DATABASE_URL, DB_TABLE_NAME, DB_COLUMNS_TYPES, DB_RETENTION_MONTHS, DB_ARCHIVE_DIR, DB_HEARTBEAT_RETENTION_DAYS
+    parser = argparse.ArgumentParser(description="Particionado, índices y retención de la tabla de log del bot.")
+    sub = parser.add_subparsers(dest="modo", required=True)
+    sub.add_parser("estado", help="Particiones con filas estimadas y tamaño")
+    p_migrar = sub.add_parser("migrar", help="Crea la tabla particionada o migra la antigua")
+    p_migrar.add_argument("--borrar-antigua", action="store_true", help="Borra la tabla sin particionar tras copiarla")
+    p_mant = sub.add_parser("mantener", help="Crea particiones futuras y aplica la retención")
+    p_mant.add_argument("--retencion-meses", type=int, default=DB_RETENTION_MONTHS)
+    p_mant.add_argument("--archivo", default=DB_ARCHIVE_DIR, help="Directorio para los CSV gzip de las particiones retiradas")
+    p_mant.add_argument("--retencion-latidos-dias", type=int, default=DB_HEARTBEAT_RETENTION_DAYS)
+    args = parser.parse_args()
+    if not DATABASE_URL: parser.error("DATABASE_URL_BOT no configurada.")
+    conn = psycopg2.connect(DATABASE_URL)
+    try:
+        if args.modo == "migrar": preparar_tabla(conn, DB_TABLE_NAME, DB_COLUMNS_TYPES, borrar_antigua=args.borrar_antigua)
+        elif args.modo == "mantener": print(mantener(conn, DB_TABLE_NAME, args.retencion_meses, args.archivo or None, args.retencion_latidos_dias))
+        else:
+            tipo, filas = estado(conn, DB_TABLE_NAME)
+            print(f"{DB_TABLE_NAME}: {'particionada' if tipo == 'p' else 'sin particionar' if tipo == 'r' else 'no existe'}")
+            for nombre, n, tam in filas: print(f"  {nombre}: ~{max(n, 0)} filas, {tam}")
+    finally: conn.close()
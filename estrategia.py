@@ -0,0 +1,33 @@
+# --- START OF FILE estrategia.py ---
+
+# Reglas de trading compartidas por gemini_bot (en vivo) y backtest.py (histórico).
+# Funcionan igual con Decimal (bot), float o arrays de NumPy (backtest vectorizado).
+
+import decimal
+
+RSI_UMBRAL_COMPRA = 40 # Pre-filtro: RSI por debajo de este valor...
+SMA_CRUCE = 20 # ...y el cierre cruza al alza esta SMA
+DESCUENTO_ENTRADA = decimal.Decimal('0.999') # Orden LIMIT de compra a precio * descuento
+TARGET_PROFIT_PERCENT = decimal.Decimal('2.0')
+STOP_LOSS_PERCENT = decimal.Decimal('1.0')
+ORDER_TIMEOUT_MINUTES = 15
+
+def _como(valor, ref):
+    return decimal.Decimal(str(valor)) if isinstance(ref, decimal.Decimal) else float(valor)
+
+def prefiltro_compra(rsi, close_prev, sma_prev, close, sma, umbral_rsi=RSI_UMBRAL_COMPRA):
+    # RSI bajo y el precio cruza la SMA al alza (cierre anterior por debajo, actual por encima). Con arrays devuelve una máscara.
+    return (rsi < umbral_rsi) & (close_prev < sma_prev) & (close > sma)
+
+def precio_entrada(precio, descuento=DESCUENTO_ENTRADA):
+    return precio * _como(descuento, precio)
+
+def niveles_salida(precio_compra, tp_pct=TARGET_PROFIT_PERCENT, sl_pct=STOP_LOSS_PERCENT):
+    # (precio take profit, precio stop loss) para una compra a precio_compra
+    uno = _como(1, precio_compra); cien = _como(100, precio_compra)
+    return precio_compra * (uno + _como(tp_pct, precio_compra) / cien), precio_compra * (uno - _como(sl_pct, precio_compra) / cien)
+
+def motivo_salida(precio, tp, sl):
+    if precio >= tp: return "TAKE_PROFIT"
+    if precio <= sl: return "STOP_LOSS"
+    return None
@@ -0,0 +1,93 @@
+# --- START OF FILE fake_kline_stream.py ---
+
+# Servidor local que imita el stream de klines de Binance (/ws/<simbolo>@kline_<intervalo>) para probar
+# el modo WebSocket de gemini_bot sin red. Reproduce un fichero JSONL de eventos 'kline' (uno por línea).
+#
+#   python fake_kline_stream.py grabar eventos.jsonl --mensajes 500          # graba del stream real
+#   python fake_kline_stream.py generar klines.json eventos.jsonl --ticks 5  # eventos a partir de klines REST
+#   python fake_kline_stream.py servir eventos.jsonl --velocidad 60 --cortar-cada 200
+#
+# Luego: BOT_WEBSOCKET_MODE=1 BOT_WS_URL=ws://127.0.0.1:8765 python gemini_bot.py (la ruta del stream se ignora)
+
+import argparse
+import json
+import logging
+import threading
+import time
+
+DEFAULT_STREAM_URL = "wss://stream.testnet.binance.vision/ws/btcusdt@kline_15m"
+
+def cargar_eventos(path):
+    with open(path, 'r') as f:
+        return [json.loads(linea) for linea in f if linea.strip()]
+
+def grabar(path, url, mensajes):
+    from websockets.sync.client import connect
+    with connect(url) as ws, open(path, 'w') as f:
+        for i in range(mensajes):
+            f.write(ws.recv().strip() + "\n")
+            if (i + 1) % 50 == 0: logging.info(f"{i + 1}/{mensajes} mensajes grabados.")
+    logging.info(f"Grabación guardada en {path}")
+
+def generar(klines_path, path, simbolo, intervalo, ticks):
+    # Convierte klines REST (lista de filas de get_klines) en eventos: 'ticks' actualizaciones intravela + cierre
+    with open(klines_path, 'r') as f: klines = json.load(f)
+    with open(path, 'w') as f:
+        for row in klines:
+            t, o, h, l, c, v, ct = int(row[0]), float(row[1]), float(row[2]), float(row[3]), float(row[4]), row[5], int(row[6])
+            for i in range(1, ticks + 1):
+                cerrada = i == ticks
+                precio = c if cerrada else o + (c - o) * i / ticks
+                evento = {"e": "kline", "E": t + (ct - t) * i // ticks, "s": simbolo.upper(),
+                          "k": {"t": t, "T": ct, "s": simbolo.upper(), "i": intervalo, "o": row[1],
+                                "h": row[2] if cerrada else f"{max(o, precio):.8f}", "l": row[3] if cerrada else f"{min(o, precio):.8f}",
+                                "c": f"{precio:.8f}", "v": v, "n": row[8], "x": cerrada, "q": row[7], "V": row[9], "Q": row[10], "B": "0"}}
+                f.write(json.dumps(evento) + "\n")
+    logging.info(f"{len(klines) * ticks} eventos generados en {path}")
+
+def servir(path, host, port, velocidad, cortar_cada, en_bucle):
+    from websockets.sync.server import serve
+    eventos = cargar_eventos(path)
+    if not eventos: logging.error(f"{path} no contiene eventos."); return
+    cursor = {"i": 0}; lock = threading.Lock() # El cursor es compartido: una reconexión continúa donde se cortó
+
+    def handler(ws):
+        logging.info(f"Cliente conectado: {ws.request.path if ws.request else '?'}")
+        enviados = 0
+        while True:
+            with lock:
+                if cursor["i"] >= len(eventos):
+                    if not en_bucle: logging.info("Fin de la grabación."); ws.close(); return
+                    cursor["i"] = 0
+                i = cursor["i"]; cursor["i"] += 1
+            if i > 0 and velocidad > 0:
+                espera = (eventos[i].get("E", 0) - eventos[i - 1].get("E", 0)) / 1000 / velocidad
+                if espera > 0: time.sleep(min(espera, 5))
+            ws.send(json.dumps(eventos[i])); enviados += 1
+            if cortar_cada and enviados >= cortar_cada:
+                logging.warning(f"Cortando la conexión tras {enviados} mensajes (prueba de reconexión).")
+                ws.close(); return
+
+    with serve(handler, host, port) as server:
+        logging.info(f"Stream falso de klines en ws://{host}:{port} ({len(eventos)} eventos, x{velocidad})")
+        try: server.serve_forever()
+        except KeyboardInterrupt: logging.info("Servidor detenido.")
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - FakeStream - %(message)s')
+    parser = argparse.ArgumentParser(description="Stream de klines falso y reproducible para el modo WebSocket del bot.")
+    sub = parser.add_subparsers(dest="modo", required=True)
+    p_grabar = sub.add_parser("grabar", help="Graba mensajes del stream real en JSONL")
+    p_grabar.add_argument("salida"); p_grabar.add_argument("--url", default=DEFAULT_STREAM_URL); p_grabar.add_argument("--mensajes", type=int, default=500)
+    p_gen = sub.add_parser("generar", help="Genera eventos a partir de klines REST guardadas en JSON")
+    p_gen.add_argument("klines"); p_gen.add_argument("salida"); p_gen.add_argument("--simbolo", default="BTCUSDT")
+    p_gen.add_argument("--intervalo", default="15m"); p_gen.add_argument("--ticks", type=int, default=5)
+    p_serv = sub.add_parser("servir", help="Reproduce un JSONL de eventos por WebSocket")
+    p_serv.add_argument("eventos"); p_serv.add_argument("--host", default="127.0.0.1"); p_serv.add_argument("--port", type=int, default=8765)
+    p_serv.add_argument("--velocidad", type=float, default=60.0, help="Factor sobre el tiempo real (0 = sin esperas)")
+    p_serv.add_argument("--cortar-cada", type=int, default=0, help="Cierra la conexión cada N mensajes para probar reconexión/resync")
+    p_serv.add_argument("--bucle", action="store_true", help="Vuelve a empezar al terminar la grabación")
+    args = parser.parse_args()
+    if args.modo == "grabar": grabar(args.salida, args.url, args.mensajes)
+    elif args.modo == "generar": generar(args.klines, args.salida, args.simbolo, args.intervalo, args.ticks)
+    else: servir(args.eventos, args.host, args.port, args.velocidad, args.cortar_cada, args.bucle)
@@ -0,0 +1,66 @@
+# --- START OF FILE fake_user_stream.py ---
+
+# User-data stream falso para probar el seguimiento de órdenes (ordenes.py) sin red: genera un escenario de
+# executionReport con fills parciales (NEW -> PARTIALLY_FILLED... -> FILLED o CANCELED) y lo sirve por WebSocket
+# reutilizando el servidor de fake_kline_stream.py.
+#
+#   python fake_user_stream.py generar eventos_orden.jsonl --order-id 12345 --precio 60000 --cantidad 0.001 --parciales 2
+#   python fake_user_stream.py servir eventos_orden.jsonl --velocidad 1
+#
+# Luego: BOT_USER_STREAM_URL=ws://127.0.0.1:8766/ws/fake python gemini_bot.py
+
+import argparse
+import decimal
+import json
+import logging
+import time
+
+from fake_kline_stream import servir
+
+def _execution_report(simbolo, order_id, lado, precio, cantidad, estado, ejecucion, ultima_qty, acumulado, evento_ms):
+    return {"e": "executionReport", "E": evento_ms, "s": simbolo, "c": f"fake{order_id}", "S": lado, "o": "LIMIT", "f": "GTC",
+            "q": f"{cantidad:.8f}", "p": f"{precio:.8f}", "x": ejecucion, "X": estado, "i": order_id,
+            "l": f"{ultima_qty:.8f}", "z": f"{acumulado:.8f}", "L": f"{precio if ultima_qty else 0:.8f}",
+            "Z": f"{acumulado * precio:.8f}", "T": evento_ms, "O": evento_ms}
+
+def generar(path, simbolo, order_id, lado, precio, cantidad, parciales, cancelar, paso_ms):
+    # Reparte la cantidad en 'parciales' fills + uno final (o una cancelación que deja la orden a medias)
+    simbolo = simbolo.upper(); lado = lado.upper()
+    precio = decimal.Decimal(str(precio)); cantidad = decimal.Decimal(str(cantidad))
+    base, quote = (simbolo[:-4], simbolo[-4:]) if simbolo.endswith("USDT") else (simbolo[:-3], simbolo[-3:])
+    t = int(time.time() * 1000); acumulado = decimal.Decimal('0')
+    eventos = [_execution_report(simbolo, order_id, lado, precio, cantidad, "NEW", "NEW", 0, acumulado, t)]
+    trozo = (cantidad / (parciales + 1)).quantize(decimal.Decimal('0.00000001'), rounding=decimal.ROUND_DOWN)
+    for _ in range(parciales):
+        t += paso_ms; acumulado += trozo
+        eventos.append(_execution_report(simbolo, order_id, lado, precio, cantidad, "PARTIALLY_FILLED", "TRADE", trozo, acumulado, t))
+    t += paso_ms
+    if cancelar: eventos.append(_execution_report(simbolo, order_id, lado, precio, cantidad, "CANCELED", "CANCELED", 0, acumulado, t))
+    else:
+        ultimo = cantidad - acumulado; acumulado = cantidad
+        eventos.append(_execution_report(simbolo, order_id, lado, precio, cantidad, "FILLED", "TRADE", ultimo, acumulado, t))
+    comprado = acumulado if lado == "BUY" else -acumulado
+    eventos.append({"e": "outboundAccountPosition", "E": t + 1, "u": t + 1,
+                    "B": [{"a": base, "f": f"{max(comprado, 0):.8f}", "l": "0.00000000"},
+                          {"a": quote, "f": f"{max(-comprado * precio, 0):.8f}", "l": "0.00000000"}]})
+    with open(path, 'w') as f:
+        for ev in eventos: f.write(json.dumps(ev) + "\n")
+    logging.info(f"{len(eventos)} eventos de la orden {order_id} ({lado} {cantidad} {simbolo}) en {path}")
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - FakeUserStream - %(message)s')
+    parser = argparse.ArgumentParser(description="User-data stream falso (executionReport con fills parciales).")
+    sub = parser.add_subparsers(dest="modo", required=True)
+    p_gen = sub.add_parser("generar", help="Genera el escenario de una orden en JSONL")
+    p_gen.add_argument("salida"); p_gen.add_argument("--simbolo", default="BTCUSDT"); p_gen.add_argument("--order-id", type=int, required=True)
+    p_gen.add_argument("--lado", choices=("BUY", "SELL"), default="BUY"); p_gen.add_argument("--precio", type=float, required=True)
+    p_gen.add_argument("--cantidad", type=float, required=True); p_gen.add_argument("--parciales", type=int, default=2)
+    p_gen.add_argument("--cancelar", action="store_true", help="Termina en CANCELED con la orden parcialmente ejecutada")
+    p_gen.add_argument("--paso-ms", type=int, default=2000, help="Separación entre eventos")
+    p_serv = sub.add_parser("servir", help="Sirve un JSONL de eventos por WebSocket")
+    p_serv.add_argument("eventos"); p_serv.add_argument("--host", default="127.0.0.1"); p_serv.add_argument("--port", type=int, default=8766)
+    p_serv.add_argument("--velocidad", type=float, default=1.0, help="Factor sobre el tiempo real (0 = sin esperas)")
+    args = parser.parse_args()
+    if args.modo == "generar":
+        generar(args.salida, args.simbolo, args.order_id, args.lado, args.precio, args.cantidad, args.parciales, args.cancelar, args.paso_ms)
+    else: servir(args.eventos, args.host, args.port, args.velocidad, 0, False)
@@ -1,31 +1,44 @@
 # --- START OF FILE gemini_bot.py ---
 
-import os
+# Importar este módulo no toca la red ni carga google.generativeai, python-binance o pandas (varios segundos entre
+# los tres): los clientes se crean en inicializar_binance()/inicializar_ia(), que llama run_ai_trading_bot().
+
 import time
+_T0_IMPORT = time.perf_counter()
+import os
 import logging
 import decimal
 from datetime import datetime, timedelta
 import json # Para guardar datos del gráfico y estado
+import threading
+import queue
+import signal
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 
-# --- BEGIN WORKAROUND for pandas_ta and NumPy 2.0+ ---
 import numpy as np
-if not hasattr(np, 'NaN'):
-    setattr(np, 'NaN', np.nan)
-# --- END WORKAROUND ---
-
-import google.generativeai as genai
-from binance.client import Client
-from binance.exceptions import BinanceAPIException, BinanceOrderException
 from dotenv import load_dotenv
 import psycopg2
 import psycopg2.extras
-import pandas as pd
-import pandas_ta as ta
+import psycopg2.pool
+
+from indicadores import EstadoIndicadores
+import estrategia
+from cuenta import SnapshotCuenta
+from ordenes import SeguidorOrdenes
+from reglas_simbolo import SymbolRules, CacheExchangeInfo
+from limites_binance import LimitadorBinance, ClienteLimitado, LimiteBinanceExcedido
+from metricas import Metricas
+from almacen_velas import AlmacenVelas, INTERVALOS_MS
+import esquema_bd
+from velas import BufferVelas, COLUMNAS_INDICADORES, como_dataframe, fila, hora_utc, puntos_grafico
+from perfilador import Perfilador, PROFILE_CICLOS_POR_DEFECTO
+import bot_ipc
 
 load_dotenv()
 
 # --- Configuración General ---
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - [%(threadName)s] %(message)s')
 
 # --- Configuración de Base de Datos PostgreSQL ---
 DATABASE_URL = os.environ.get("DATABASE_URL_BOT")
@@ -40,70 +53,174 @@ DB_COLUMNS_TYPES = {
     "orderid_abierta": "VARCHAR(50)", "notas_adicionales": "TEXT"
 }
 DB_COLUMN_ORDER = list(DB_COLUMNS_TYPES.keys())
+DB_POOL_MAX_CONNECTIONS = 2
+DB_WRITER_BATCH_SIZE = 50 # Filas por INSERT multi-fila
+DB_WRITER_FLUSH_SECONDS = 5 # Máximo que una fila espera en cola antes de insertarse
+DB_WRITER_QUEUE_MAX = 10000 # Con la cola llena las filas van directamente al fichero de volcado
+DB_SPILL_FILE = "trading_log_pendiente.jsonl" # Filas que no se pudieron insertar (BD caída); se reinsertan después
+DB_NOTIFY_CHANNEL = "trading_log_nuevo" # NOTIFY tras cada lote: la web refresca su historial sin sondear la tabla
+DB_PNL_TABLE = 'trading_pnl_diario' # Rollup por día y símbolo de las filas con G/P; lo lee /bot/history/pnl
+DB_PNL_WATERMARK_TABLE = 'trading_pnl_rollup_estado' # Último id de trading_log ya sumado al rollup
+# Particionado por meses y retención de DB_TABLE_NAME (ver esquema_bd.py); 0 = sin límite
+DB_RETENTION_MONTHS = int(os.environ.get("BOT_DB_RETENTION_MONTHS", "0")) # Meses completos que se conservan además del actual
+DB_ARCHIVE_DIR = os.environ.get("BOT_DB_ARCHIVE_DIR", "") # Si se da, cada partición retirada se guarda antes como CSV gzip
+DB_HEARTBEAT_RETENTION_DAYS = int(os.environ.get("BOT_DB_HEARTBEAT_RETENTION_DAYS", "0")) # Días de filas de ciclos sin acción
+DB_MAINTENANCE_SECONDS = 24 * 3600 # Cada cuánto el escritor crea particiones futuras y aplica la retención
 
 # --- Configuración de IA de Google Gemini ---
 GOOGLE_AI_API_KEY = os.environ.get("GOOGLE_AI_API_KEY")
-model_ai = None
-if GOOGLE_AI_API_KEY:
-    genai.configure(api_key=GOOGLE_AI_API_KEY)
-    AI_MODEL_NAME = 'gemini-1.5-flash-latest'
-    try:
-        model_ai = genai.GenerativeModel(AI_MODEL_NAME)
-        logging.info(f"Modelo IA Gemini '{AI_MODEL_NAME}' cargado.")
-    except Exception as e:
-        logging.error(f"Error cargando modelo IA '{AI_MODEL_NAME}': {e}")
-else:
-    logging.warning("GOOGLE_AI_API_KEY no encontrada. IA usará simulación.")
+AI_MODEL_NAME = 'gemini-1.5-flash-latest'
+model_ai = None # Lo crea inicializar_ia() (en segundo plano al arrancar; la primera consulta lo espera)
+EXCHANGE_INFO_FILE = os.environ.get("BOT_EXCHANGE_INFO_FILE", "exchange_info_cache.json") # Vacío = sin caché en disco
+KLINE_STORE_DIR = os.environ.get("BOT_KLINE_STORE", "almacen_velas") # Velas cerradas en disco (almacen_velas.py); vacío = no se guardan
+# La consulta a Gemini corre en un hilo aparte: el ciclo no la espera y la recoge en un ciclo posterior.
+AI_DEADLINE_SECONDS = float(os.environ.get("BOT_AI_DEADLINE", "10")) # Sin respuesta en este plazo se aplica AI_FALLBACK
+AI_FALLBACK = os.environ.get("BOT_AI_FALLBACK", "HOLD").strip().upper() # HOLD o REGLAS (comprar solo por el pre-filtro)
+AI_MAX_PRICE_DRIFT_PERCENT = 0.2 # Una respuesta se descarta si el precio se movió más que esto desde la pregunta
+AI_REQUEST_TIMEOUT_SECONDS = AI_DEADLINE_SECONDS + 2 # Timeout HTTP: poco más que el plazo, para que una llamada colgada libere pronto su hilo
+AI_MAX_CONCURRENT = 4 # Hilos del pool de IA además de uno por símbolo (llamadas ya vencidas que aún no han soltado el hilo)
 
 # --- Configuración de Binance ---
 USE_TESTNET = True
 if USE_TESTNET:
     BINANCE_API_KEY = os.environ.get("BINANCE_TESTNET_API_KEY")
     BINANCE_API_SECRET = os.environ.get("BINANCE_TESTNET_API_SECRET")
-    logging.info("--- USANDO BINANCE TESTNET ---")
 else:
     BINANCE_API_KEY = os.environ.get("BINANCE_PROD_API_KEY")
     BINANCE_API_SECRET = os.environ.get("BINANCE_PROD_API_SECRET")
-    logging.info("--- USANDO BINANCE PRODUCCIÓN ---")
-
-if not BINANCE_API_KEY or not BINANCE_API_SECRET:
-    logging.error("Claves API Binance no encontradas. Saliendo.")
-    exit()
-try:
-    binance_client = Client(BINANCE_API_KEY, BINANCE_API_SECRET, testnet=USE_TESTNET)
-    binance_client.ping()
-    logging.info(f"Conexión a Binance {'Testnet' if USE_TESTNET else 'Producción'} OK.")
-    server_time_offset = int(binance_client.get_server_time()['serverTime']) - int(time.time() * 1000)
-    logging.info(f"Desfase horario Binance: {server_time_offset} ms")
-except Exception as e:
-    logging.error(f"Error conectando a Binance: {e}")
-    exit()
+binance_client = None # Lo crea inicializar_binance(); toda petición pasa por limitador_binance
+limitador_binance = LimitadorBinance() # Pesos y cupos de Binance (ver limites_binance.py)
+server_time_offset = 0
+
+# Valores de binance.enums: así el módulo no necesita python-binance hasta crear el cliente
+KLINE_INTERVAL_1MINUTE = '1m'; KLINE_INTERVAL_15MINUTE = '15m'
+ORDER_TYPE_LIMIT = 'LIMIT'; ORDER_TYPE_MARKET = 'MARKET'; TIME_IN_FORCE_GTC = 'GTC'
+ORDER_STATUS_NEW = 'NEW'; ORDER_STATUS_PARTIALLY_FILLED = 'PARTIALLY_FILLED'; ORDER_STATUS_FILLED = 'FILLED'
+ORDER_STATUS_CANCELED = 'CANCELED'; ORDER_STATUS_PENDING_CANCEL = 'PENDING_CANCEL'
+ORDER_STATUS_REJECTED = 'REJECTED'; ORDER_STATUS_EXPIRED = 'EXPIRED'
+
+class _BinanceSinCargar(Exception): pass # Hasta importar python-binance ningún except de Binance puede coincidir
+BinanceAPIException = BinanceOrderException = _BinanceSinCargar
 
 # --- Parámetros de Trading ---
 SYMBOL_EXCHANGE = 'BTCUSDT'
 BASE_ASSET = 'BTC'
 QUOTE_ASSET = 'USDT'
 ORDER_AMOUNT_BASE = decimal.Decimal('0.0002')
-CHECK_INTERVAL = 60 # Reducir para actualizaciones más frecuentes del gráfico y estado si se desea
-TARGET_PROFIT_PERCENT = decimal.Decimal('2.0')
-STOP_LOSS_PERCENT = decimal.Decimal('1.0')
-ORDER_TIMEOUT_MINUTES = 15
-KLINE_INTERVAL_FOR_INDICATORS = Client.KLINE_INTERVAL_15MINUTE # O un intervalo más corto para el gráfico, ej. 1m
+# Pares a operar: "SIMBOLO[:cantidad_base]" separados por comas. Sin cantidad solo vale para SYMBOL_EXCHANGE (usa ORDER_AMOUNT_BASE).
+# El primero es el símbolo principal: recibe los comandos web sin símbolo y escribe CHART_DATA_FILE/BOT_STATUS_FILE.
+SYMBOLS_CONFIG = os.environ.get("BOT_SYMBOLS", SYMBOL_EXCHANGE)
+MAX_SYMBOL_WORKERS = 32 # Hilos del pool compartido; un símbolo lento solo ocupa el suyo
+CHECK_INTERVAL = 60 # Ticks ligeros (precio en vivo contra TP/SL y gráfico) entre cierres de vela
+# El ciclo completo (indicadores, pre-filtro/IA, BD, estado) se ejecuta justo después de cada cierre de vela de
+# KLINE_INTERVAL_FOR_INDICATORS. Ticks y cierres van en una rejilla fija del reloj de Binance (server_time_offset):
+# la duración de un ciclo o una pausa por error no desplaza los siguientes.
+CANDLE_CLOSE_DELAY_SECONDS = 1.0 # Margen tras el cierre para que Binance ya sirva la vela cerrada
+# Reglas de entrada/salida en estrategia.py (las mismas que evalúa backtest.py)
+TARGET_PROFIT_PERCENT = estrategia.TARGET_PROFIT_PERCENT
+STOP_LOSS_PERCENT = estrategia.STOP_LOSS_PERCENT
+ORDER_TIMEOUT_MINUTES = estrategia.ORDER_TIMEOUT_MINUTES
+KLINE_INTERVAL_FOR_INDICATORS = KLINE_INTERVAL_15MINUTE # O un intervalo más corto para el gráfico, ej. 1m
 KLINE_LIMIT_FOR_INDICATORS = 100 # Para indicadores
 KLINE_LIMIT_FOR_CHART = 200 # Velas para el gráfico, puede ser mayor
+KLINE_CACHE_MAX_SIZE = KLINE_LIMIT_FOR_CHART # Velas máximas retenidas por (símbolo, intervalo) en la caché incremental
+KLINE_CACHE_FETCH_LIMIT = 100 # Límite de las peticiones incrementales; si se llena hay un hueco y se resiembra
+INDICATOR_WARMUP_FROM_STORE = 1000 # Velas del almacén con las que se siembran los indicadores antes de la caché
 
 COMMAND_FILE = "web_command.txt"
 CHART_DATA_FILE = "chart_data.json"
 BOT_STATUS_FILE = "bot_status.json"
 MAX_CHART_POINTS = KLINE_LIMIT_FOR_CHART # Cuántas velas enviar al gráfico
+# Canal IPC con web_interface (socket Unix): estado, deltas del gráfico y comandos con ack. Los ficheros JSON se
+# siguen escribiendo (de forma atómica) como respaldo para quien no use el canal.
+USE_IPC_CHANNEL = os.environ.get("BOT_IPC", "true").strip().lower() in ("1", "true", "si", "yes")
+
+# --- Modo WebSocket (opcional): el ciclo se dispara con eventos del stream de klines en vez de cada CHECK_INTERVAL ---
+USE_WEBSOCKET_MODE = os.environ.get("BOT_WEBSOCKET_MODE", "false").strip().lower() in ("1", "true", "si", "yes")
+WS_BASE_URL = os.environ.get("BOT_WS_URL") or ("wss://stream.testnet.binance.vision" if USE_TESTNET else "wss://stream.binance.com:9443")
+WS_PRICE_MOVE_PERCENT = 0.3 # Movimiento (%) desde el último ciclo que dispara un ciclo sin esperar al cierre de vela
+WS_STALE_SECONDS = 30 # Sin mensajes durante este tiempo la conexión se da por muerta y se reconecta
+WS_RECONNECT_MAX_DELAY = 60 # Tope (s) del backoff exponencial de reconexión
+# User-data stream: executionReport (fills de nuestras órdenes) y outboundAccountPosition (saldos). Sin él, las
+# órdenes abiertas se reconcilian con un get_open_orders por ciclo. BOT_USER_STREAM_URL apunta a fake_user_stream.py.
+USE_USER_DATA_STREAM = os.environ.get("BOT_USER_STREAM", "true").strip().lower() in ("1", "true", "si", "yes")
+USER_STREAM_URL = os.environ.get("BOT_USER_STREAM_URL") # Si se da, se conecta tal cual (sin listenKey)
+USER_STREAM_KEEPALIVE_SECONDS = 30 * 60 # Binance caduca la listenKey a los 60 min sin keepalive
 
 # --- Estado del Bot ---
-has_position = False
-last_buy_price = decimal.Decimal('0.0')
-entry_timestamp = None # Para calcular tiempo en posición
+symbol_states = {} # symbol -> SymbolState (el primero es el principal)
 symbol_info_cache = {}
-open_order_details = None
-current_forced_action = None
+symbol_rules = {} # symbol -> SymbolRules compiladas de su exchange info
+exchange_info_cache = CacheExchangeInfo(fichero=EXCHANGE_INFO_FILE or None)
+kline_cache = {} # (symbol, interval) -> lista de klines crudas, ordenadas por open time
+kline_cache_locks = {} # (symbol, interval) -> Lock; el stream y los ciclos actualizan la misma caché
+velas_cache = {} # (symbol, interval) -> BufferVelas con la caché de klines ya decodificada
+almacen_velas = AlmacenVelas(KLINE_STORE_DIR) if KLINE_STORE_DIR else None
+indicator_states = {} # (symbol, interval) -> EstadoIndicadores incremental
+kline_stream_keys = set() # (symbol, interval) cuya caché mantiene al día un stream WebSocket conectado
+db_queue = queue.Queue(maxsize=DB_WRITER_QUEUE_MAX) # Filas pendientes para el escritor de BD
+db_writer_thread = None; db_writer_lock = threading.Lock(); db_spill_lock = threading.Lock(); db_pool = None
+_DB_WRITER_STOP = object()
+ai_executor = ThreadPoolExecutor(max_workers=AI_MAX_CONCURRENT, thread_name_prefix="ia") # dimensionar_pool_ia() lo ajusta a los símbolos
+account_snapshot = SnapshotCuenta(lambda: binance_client.get_account()) # Saldos de todos los activos con una sola llamada
+despertar_planificador = threading.Event() # Despierta al planificador (fin de ciclo, evento del stream, comando IPC)
+order_tracker = SeguidorOrdenes(al_cambiar=lambda symbol, orden: orden_actualizada(symbol, orden)) # Estado de nuestras órdenes
+ipc_server = None # bot_ipc.IpcServer si el canal está activo
+perfilador = Perfilador(directorio=os.environ.get("BOT_PROFILE_DIR", "perfiles")) # Comando PROFILE [N] o SIGUSR1
+metricas = Metricas() # Se publican con el estado del símbolo principal; la web las sirve en /bot/metrics
+metricas.describir("ciclo_segundos", "Duración total de un ciclo de trading")
+metricas.describir("ciclo_fase_segundos", "Duración de cada fase del ciclo (klines, indicadores, estado, grafico)")
+metricas.describir("ia_llamada_segundos", "Latencia de generate_content de Gemini")
+metricas.describir("binance_rest_segundos", "Ida y vuelta de cada petición REST a Binance (create_order = colocación de orden)")
+metricas.describir("db_escritura_segundos", "Duración de cada INSERT por lotes en trading_log")
+metricas.describir("ia_consultas_vencidas_total", "Consultas IA sin respuesta al vencer el plazo (sin_empezar = esperaban hilo libre en el pool)")
+
+class SymbolState:
+    # Estado de trading de un par. El cliente Binance, las cachés de info/klines y la BD se comparten entre todos.
+    def __init__(self, symbol, si_data, order_amount_base, principal=False):
+        self.symbol = symbol; self.si_data = si_data; self.principal = principal
+        self.base_asset = si_data.get('baseAsset', BASE_ASSET); self.quote_asset = si_data.get('quoteAsset', QUOTE_ASSET)
+        self.order_amount_base = order_amount_base
+        self.chart_data_file = CHART_DATA_FILE if principal else f"chart_data_{symbol}.json"
+        self.bot_status_file = BOT_STATUS_FILE if principal else f"bot_status_{symbol}.json"
+        self.has_position = False
+        self.last_buy_price = decimal.Decimal('0.0')
+        self.entry_timestamp = None # Para calcular tiempo en posición
+        self.open_order_details = None
+        self.current_forced_action = None # Solo lo toca el ciclo; los comandos llegan por self.comandos
+        self.comandos = queue.Queue() # Comandos web (hilo IPC o fichero) pendientes de recoger al empezar un ciclo
+        self.cur_price_float = None # Último precio de cierre visto (para P&L flotante si no hay klines en el ciclo)
+        self.consulta_ia = None # Consulta IA en curso: {"future", "tipo", "inicio", "vela_open_time", "precio"}
+        # Planificación: próximo ciclo por tiempo, pausa tras error y motivo pendiente de un evento del stream
+        self.proximo_ciclo = 0.0; self.pausa_hasta = 0.0; self.motivo_evento = None; self.precio_ultimo_ciclo = None
+        self.proxima_vela = 0.0 # Hora del próximo ciclo completo (justo tras el cierre de vela); hasta entonces, solo ticks
+        self.vela_decidida = None # Open time de la última vela cerrada con la entrada ya evaluada
+
+    def debe_ejecutar(self, ahora):
+        pendiente = self.motivo_evento is not None or not self.comandos.empty()
+        return ahora >= min(self.proximo_ciclo, self.proxima_vela) or (pendiente and ahora >= self.pausa_hasta)
+
+    def necesita_ciclo_completo(self):
+        # Lo que un tick ligero no gestiona: comandos web, órdenes abiertas y consultas IA pendientes
+        return (self.current_forced_action is not None or not self.comandos.empty() or self.open_order_details is not None
+                or self.consulta_ia is not None)
+
+    def recoger_comandos(self):
+        # Al empezar el ciclo: el último comando recibido sustituye al pendiente (como escribir encima del campo)
+        try:
+            while True: self.current_forced_action = self.comandos.get_nowait()
+        except queue.Empty: pass
+
+def parse_symbols_config(config):
+    pares = []
+    for item in config.split(","):
+        sym, _, qty = item.strip().upper().partition(":")
+        if not sym: continue
+        try: amount = decimal.Decimal(qty) if qty else (ORDER_AMOUNT_BASE if sym == SYMBOL_EXCHANGE else None)
+        except decimal.InvalidOperation: amount = None
+        if amount is None or amount <= 0: logging.error(f"Cantidad inválida o ausente para {sym} en BOT_SYMBOLS (formato SIMBOLO:cantidad). Se omite."); continue
+        pares.append((sym, amount))
+    return pares
 
 # --- Funciones de Base de Datos PostgreSQL ---
 def get_db_connection():
@@ -111,20 +228,61 @@ def get_db_connection():
     try: return psycopg2.connect(DATABASE_URL)
     except Exception as e: logging.error(f"Error conectando a BD: {e}"); return None
 
+# Rollup de G/P: cada lote insertado suma sus filas con ganancia_perdida_operacion_usdt a DB_PNL_TABLE en la
+# misma transacción (solo las de id > marca de agua, así que el coste es el del lote y no el del historial).
+# Los ids se confirman en orden porque solo inserta el hilo escritor; la marca se bloquea FOR UPDATE por si acaso.
+DB_PNL_CREATE_SQL = f"""
+    CREATE TABLE IF NOT EXISTS {DB_PNL_TABLE} (
+        dia DATE NOT NULL, simbolo VARCHAR(15) NOT NULL,
+        operaciones INTEGER NOT NULL, ganadoras INTEGER NOT NULL, perdedoras INTEGER NOT NULL,
+        pnl_usdt DECIMAL(20, 8) NOT NULL, mejor_usdt DECIMAL(20, 8), peor_usdt DECIMAL(20, 8),
+        PRIMARY KEY (dia, simbolo));
+    CREATE TABLE IF NOT EXISTS {DB_PNL_WATERMARK_TABLE} (unica BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (unica), ultimo_id BIGINT NOT NULL);
+    INSERT INTO {DB_PNL_WATERMARK_TABLE} (ultimo_id) VALUES (0) ON CONFLICT DO NOTHING;
+"""
+DB_PNL_REFRESH_SQL = f"""
+    WITH estado AS (SELECT ultimo_id FROM {DB_PNL_WATERMARK_TABLE} FOR UPDATE),
+    nuevas AS (
+        SELECT l.id, l."timestamp", l.simbolo, l.ganancia_perdida_operacion_usdt AS g
+        FROM {DB_TABLE_NAME} l, estado WHERE l.id > estado.ultimo_id),
+    sumadas AS (
+        INSERT INTO {DB_PNL_TABLE} AS d (dia, simbolo, operaciones, ganadoras, perdedoras, pnl_usdt, mejor_usdt, peor_usdt)
+        SELECT (n."timestamp" AT TIME ZONE 'UTC')::date, COALESCE(n.simbolo, ''), count(*),
+               count(*) FILTER (WHERE n.g > 0), count(*) FILTER (WHERE n.g < 0), sum(n.g), max(n.g), min(n.g)
+        FROM nuevas n WHERE n.g IS NOT NULL GROUP BY 1, 2
+        ON CONFLICT (dia, simbolo) DO UPDATE SET
+            operaciones = d.operaciones + EXCLUDED.operaciones, ganadoras = d.ganadoras + EXCLUDED.ganadoras,
+            perdedoras = d.perdedoras + EXCLUDED.perdedoras, pnl_usdt = d.pnl_usdt + EXCLUDED.pnl_usdt,
+            mejor_usdt = GREATEST(d.mejor_usdt, EXCLUDED.mejor_usdt), peor_usdt = LEAST(d.peor_usdt, EXCLUDED.peor_usdt))
+    UPDATE {DB_PNL_WATERMARK_TABLE} SET ultimo_id = m.max_id FROM (SELECT max(id) AS max_id FROM nuevas) m WHERE m.max_id IS NOT NULL;
+"""
+
 def initialize_db_table():
     conn = get_db_connection();
     if not conn: return
-    cols_sql = ",\n".join([f'"{cn}" {ct}' for cn,ct in DB_COLUMNS_TYPES.items()])
-    create_sql = f"CREATE TABLE IF NOT EXISTS {DB_TABLE_NAME} (id SERIAL PRIMARY KEY, {cols_sql});"
     try:
-        with conn.cursor() as cur: cur.execute(create_sql)
-        conn.commit(); logging.info(f"Tabla '{DB_TABLE_NAME}' verificada/creada.")
-    except Exception as e: logging.error(f"Error creando/verificando tabla: {e}")
+        esquema_bd.preparar_tabla(conn, DB_TABLE_NAME, DB_COLUMNS_TYPES) # Crea la tabla particionada o migra la antigua
+        with conn.cursor() as cur: cur.execute(DB_PNL_CREATE_SQL); cur.execute(DB_PNL_REFRESH_SQL) # Pone al día el rollup con el historial existente
+        conn.commit(); logging.info(f"Tablas '{DB_TABLE_NAME}' y '{DB_PNL_TABLE}' verificadas/creadas.")
+    except Exception as e: logging.error(f"Error creando/verificando tabla: {e}"); return
     finally: conn.close() if conn else None
+    mantener_db() # Con el rollup ya al día: lo que se retire ya está sumado
 
-def log_to_db(data_dict):
-    conn=get_db_connection();
+def mantener_db():
+    conn = get_db_connection()
     if not conn: return
+    try:
+        r = esquema_bd.mantener(conn, DB_TABLE_NAME, DB_RETENTION_MONTHS, DB_ARCHIVE_DIR or None, DB_HEARTBEAT_RETENTION_DAYS)
+        if r["creadas"] or r["soltadas"] or r["latidos_borrados"]:
+            logging.info(f"Mantenimiento de '{DB_TABLE_NAME}': {len(r['creadas'])} particiones creadas, {len(r['soltadas'])} retiradas, {r['latidos_borrados']} filas de latido borradas.")
+    except Exception as e: logging.error(f"Error en el mantenimiento de '{DB_TABLE_NAME}': {e}")
+    finally: conn.close()
+
+# --- Escritor de BD en segundo plano (pool + lotes + volcado a disco) ---
+# log_to_db solo encola la fila ya convertida; un hilo la inserta por lotes (INSERT multi-fila) con una
+# conexión persistente del pool. Si la BD no responde las filas se vuelcan a DB_SPILL_FILE y se reinsertan
+# en el siguiente lote que funcione. detener_db_writer() vacía la cola antes de salir.
+def log_to_db(data_dict):
     vals=[];
     for col_name in DB_COLUMN_ORDER:
         val=data_dict.get(col_name)
@@ -132,131 +290,283 @@ def log_to_db(data_dict):
         elif val is None or val=="N/A" or str(val).strip()=="": vals.append(None if DB_COLUMNS_TYPES.get(col_name,"").startswith("DECIMAL") or DB_COLUMNS_TYPES.get(col_name)=="BOOLEAN" else (str(val) if val is not None else None))
         elif isinstance(val,bool): vals.append(val)
         else: vals.append(str(val))
-    cols_str=",".join([f'"{c}"' for c in DB_COLUMN_ORDER]); ph_str=",".join(["%s"]*len(DB_COLUMN_ORDER))
-    ins_sql=f"INSERT INTO {DB_TABLE_NAME} ({cols_str}) VALUES ({ph_str});"
+    if not DATABASE_URL: logging.error("DATABASE_URL no configurada."); return
+    iniciar_db_writer()
+    try: db_queue.put_nowait(tuple(vals))
+    except queue.Full: logging.warning("Cola de escritura BD llena. Volcando fila a disco."); _volcar_filas_a_disco([tuple(vals)])
+
+def iniciar_db_writer():
+    global db_writer_thread
+    with db_writer_lock:
+        if db_writer_thread is None or not db_writer_thread.is_alive():
+            db_writer_thread = threading.Thread(target=_db_writer_loop, name="db-writer", daemon=True)
+            db_writer_thread.start()
+
+def detener_db_writer(timeout=30):
+    global db_writer_thread, db_pool
+    with db_writer_lock:
+        hilo = db_writer_thread; db_writer_thread = None
+    if hilo is None or not hilo.is_alive(): return
+    db_queue.put(_DB_WRITER_STOP); hilo.join(timeout)
+    if hilo.is_alive(): logging.error("El escritor de BD no terminó a tiempo; las filas pendientes se vuelcan a disco.")
+    restantes = []
+    while True: # Lo que quede en cola (p.ej. si el hilo no terminó) no se pierde
+        try: item = db_queue.get_nowait()
+        except queue.Empty: break
+        if item is not _DB_WRITER_STOP: restantes.append(item)
+    if restantes: _volcar_filas_a_disco(restantes)
+    if db_pool is not None:
+        try: db_pool.closeall()
+        except Exception as e: logging.debug(f"Error cerrando pool BD: {e}")
+        db_pool = None
+
+def _db_writer_loop():
+    pendientes = []; ultimo_flush = time.monotonic(); ultimo_mantenimiento = time.monotonic() # initialize_db_table ya lo hizo al arrancar
+    while True:
+        espera = max(0.0, DB_WRITER_FLUSH_SECONDS - (time.monotonic() - ultimo_flush))
+        try: item = db_queue.get(timeout=espera if pendientes else None)
+        except queue.Empty: item = None
+        parar = item is _DB_WRITER_STOP
+        if item is not None and not parar: pendientes.append(item)
+        while not parar and len(pendientes) < DB_WRITER_BATCH_SIZE: # Recoge lo que ya esté en cola sin esperar
+            try: item = db_queue.get_nowait()
+            except queue.Empty: break
+            if item is _DB_WRITER_STOP: parar = True
+            else: pendientes.append(item)
+        if pendientes and (parar or len(pendientes) >= DB_WRITER_BATCH_SIZE or time.monotonic() - ultimo_flush >= DB_WRITER_FLUSH_SECONDS):
+            _insertar_lote(pendientes); pendientes = []; ultimo_flush = time.monotonic()
+        if parar: return
+        if time.monotonic() - ultimo_mantenimiento >= DB_MAINTENANCE_SECONDS: # Aquí no compite con los INSERT del lote
+            mantener_db(); ultimo_mantenimiento = time.monotonic()
+
+def _get_db_pool():
+    global db_pool
+    if db_pool is None:
+        db_pool = psycopg2.pool.ThreadedConnectionPool(1, DB_POOL_MAX_CONNECTIONS, DATABASE_URL)
+    return db_pool
+
+def _insertar_lote(filas):
+    cols_str = ",".join([f'"{c}"' for c in DB_COLUMN_ORDER])
+    ins_sql = f"INSERT INTO {DB_TABLE_NAME} ({cols_str}) VALUES %s"
+    conn = None; pool = None; t0 = time.monotonic()
     try:
-        with conn.cursor() as cur: cur.execute(ins_sql,tuple(vals))
-        conn.commit(); logging.debug(f"Datos insertados en '{DB_TABLE_NAME}'.")
-    except Exception as e: logging.error(f"Error insertando en BD: {e}"); logging.error(f"Datos: {dict(zip(DB_COLUMN_ORDER,vals))}")
-    finally: conn.close() if conn else None
+        pool = _get_db_pool(); conn = pool.getconn()
+        with db_spill_lock: # Primero lo volcado en caídas anteriores, para conservar el orden
+            volcadas = _leer_filas_volcadas()
+            with conn.cursor() as cur:
+                if volcadas: psycopg2.extras.execute_values(cur, ins_sql, volcadas, page_size=DB_WRITER_BATCH_SIZE)
+                psycopg2.extras.execute_values(cur, ins_sql, filas, page_size=DB_WRITER_BATCH_SIZE)
+                cur.execute(DB_PNL_REFRESH_SQL)
+                cur.execute(f"NOTIFY {DB_NOTIFY_CHANNEL};") # Se entrega al hacer commit
+            conn.commit()
+            if volcadas: os.remove(DB_SPILL_FILE); logging.info(f"{len(volcadas)} filas volcadas a disco reinsertadas en '{DB_TABLE_NAME}'.")
+        logging.debug(f"{len(filas)} filas insertadas en '{DB_TABLE_NAME}'.")
+        pool.putconn(conn)
+        metricas.observar("db_escritura_segundos", time.monotonic() - t0); metricas.incrementar("db_filas_total", len(filas), resultado="insertada")
+    except Exception as e:
+        logging.error(f"Error insertando lote en BD ({len(filas)} filas): {e}. Volcando a {DB_SPILL_FILE}.")
+        if conn is not None:
+            try: conn.rollback()
+            except Exception: pass
+            try: pool.putconn(conn, close=True)
+            except Exception: pass
+        _volcar_filas_a_disco(filas); metricas.incrementar("db_filas_total", len(filas), resultado="volcada")
+
+def _fila_a_json(v):
+    if isinstance(v, decimal.Decimal): return str(v)
+    return v
+
+def _volcar_filas_a_disco(filas):
+    with db_spill_lock:
+        try:
+            with open(DB_SPILL_FILE, 'a') as f:
+                for fila in filas: f.write(json.dumps([_fila_a_json(v) for v in fila]) + "\n")
+        except Exception as e: logging.error(f"Error volcando {len(filas)} filas a {DB_SPILL_FILE}: {e}"); logging.error(f"Datos: {filas}")
+
+def _leer_filas_volcadas():
+    if not os.path.exists(DB_SPILL_FILE): return []
+    with open(DB_SPILL_FILE, 'r') as f:
+        return [tuple(json.loads(linea)) for linea in f if linea.strip()]
 
 # --- Funciones Binance (Auxiliares, Interacción) ---
 def get_binance_symbol_info(symbol):
     if symbol not in symbol_info_cache:
-        try: info = binance_client.get_symbol_info(symbol); symbol_info_cache[symbol] = info
-        except BinanceAPIException as e: logging.error(f"Error API info {symbol}: {e}"); return None
+        info = exchange_info_cache.obtener(symbol) # Desde disco si no ha caducado
+        if info is None:
+            try: info = binance_client.get_symbol_info(symbol)
+            except BinanceAPIException as e: logging.error(f"Error API info {symbol}: {e}"); return None
+            if not info: logging.error(f"{symbol} no existe en el exchange."); return None
+            exchange_info_cache.guardar(symbol, info)
+        symbol_info_cache[symbol] = info; symbol_rules[symbol] = SymbolRules(info)
         logging.info(f"Info y filtros para {symbol} cacheados.")
     return symbol_info_cache[symbol]
 
-def _get_filter_value(si, ft, fk):
-    if not si or 'filters' not in si: return None
-    for f in si['filters']:
-        if f['filterType']==ft: return decimal.Decimal(str(f.get(fk,'0')))
-    return None
+def precargar_symbol_info(symbols):
+    # Arranque: los pares sin exchange info vigente en disco se descargan juntos (get_symbol_info baja la lista entera por cada par)
+    try: exchange_info_cache.precargar(symbols, descargar_exchange_info)
+    except Exception as e: logging.warning(f"No se pudo precargar la exchange info ({e}); se pedirá par a par.")
+
+def descargar_exchange_info():
+    info = binance_client.get_exchange_info()
+    if info.get('rateLimits'): limitador_binance.configurar(info['rateLimits']) # Los límites reales de la cuenta/entorno
+    return info
+
+def reglas_de(si):
+    reglas = symbol_rules.get(si['symbol'])
+    if reglas is None or reglas.si is not si: reglas = symbol_rules[si['symbol']] = SymbolRules(si)
+    return reglas
 
 def format_quantity(si, q):
-    ss=_get_filter_value(si,'LOT_SIZE','stepSize'); 
-    q_decimal = decimal.Decimal(str(q))
-    return (q_decimal // ss) * ss if ss and ss > 0 else q_decimal
+    return reglas_de(si).cuantizar_cantidad(q)
 
 def format_price(si, p):
-    ts=_get_filter_value(si,'PRICE_FILTER','tickSize'); 
-    p_decimal = decimal.Decimal(str(p))
-    return (p_decimal // ts) * ts if ts and ts > 0 else p_decimal
+    return reglas_de(si).cuantizar_precio(p)
 
 def check_min_notional(si, q, p):
-    mn_val=_get_filter_value(si,'NOTIONAL','minNotional')
-    if mn_val is None: logging.warning(f"No minNotional para {si.get('symbol','N/A')}. Asume OK."); return True
-    q_decimal = decimal.Decimal(str(q))
-    p_decimal = decimal.Decimal(str(p))
-    cur_not = q_decimal * p_decimal
-    if cur_not < mn_val: logging.warning(f"Orden no cumple MIN_NOTIONAL ({mn_val}). Nocional: {cur_not}"); return False
-    logging.debug(f"MIN_NOTIONAL: {cur_not} >= {mn_val}. OK."); return True
+    reglas = reglas_de(si)
+    if reglas.min_notional is None: logging.warning(f"No minNotional para {si.get('symbol','N/A')}. Asume OK."); return True
+    cur_not = decimal.Decimal(str(q)) * decimal.Decimal(str(p))
+    if cur_not < reglas.min_notional: logging.warning(f"Orden no cumple MIN_NOTIONAL ({reglas.min_notional}). Nocional: {cur_not}"); return False
+    logging.debug(f"MIN_NOTIONAL: {cur_not} >= {reglas.min_notional}. OK."); return True
 
 def get_binance_asset_balance(asset):
-    try: bal_info=binance_client.get_asset_balance(asset=asset); return decimal.Decimal(bal_info['free']) if bal_info and 'free' in bal_info else decimal.Decimal('0.0')
-    except Exception as e: logging.error(f"Error balance {asset}: {e}"); return decimal.Decimal('0.0')
+    return account_snapshot.saldo(asset) # Desde la instantánea de cuenta (get_account solo si caducó o se invalidó)
 
 # --- Funciones para Datos Adicionales e Indicadores ---
-def obtener_klines_df(symbol, interval, limit=100):
+def actualizar_kline_cache(symbol, interval):
+    # Siembra el buffer una vez y después solo pide velas desde la última open time conocida.
+    # La primera vela devuelta es la que estaba abierta: se reemplaza en su sitio; el resto se añade.
+    key = (symbol, interval)
+    with kline_cache_locks.setdefault(key, threading.Lock()):
+        return _actualizar_kline_cache(key, symbol, interval)
+
+def _actualizar_kline_cache(key, symbol, interval):
+    buf = kline_cache.get(key)
+    if buf and key in kline_stream_keys: return buf # El stream WebSocket ya la mantiene al día
+    if buf:
+        nuevas = binance_client.get_klines(symbol=symbol, interval=interval, startTime=buf[-1][0], limit=KLINE_CACHE_FETCH_LIMIT)
+        if nuevas and len(nuevas) < KLINE_CACHE_FETCH_LIMIT:
+            for k in nuevas:
+                if k[0] == buf[-1][0]: buf[-1] = k
+                elif k[0] > buf[-1][0]: buf.append(k)
+            if len(buf) > KLINE_CACHE_MAX_SIZE: del buf[:-KLINE_CACHE_MAX_SIZE]
+            return buf
+        if nuevas: logging.info(f"Hueco de klines demasiado grande para {symbol} {interval}. Resembrando caché.")
+    klines = binance_client.get_klines(symbol=symbol, interval=interval, limit=KLINE_CACHE_MAX_SIZE)
+    if not klines: return buf
+    kline_cache[key] = list(klines); logging.debug(f"Caché de klines sembrada para {symbol} {interval}: {len(klines)} velas.")
+    return kline_cache[key]
+
+def obtener_velas(symbol, interval, limit=100):
+    # Últimas limit velas como array estructurado (velas.DTYPE_VELA); copia propia, el ciclo escribe en ella los indicadores
     try:
-        klines = binance_client.get_klines(symbol=symbol, interval=interval, limit=limit)
-        if not klines: logging.warning(f"No se recibieron klines para {symbol}"); return None
-        df = pd.DataFrame(klines, columns=['timestamp', 'open', 'high', 'low', 'close', 'volume', 
-                                           'close_time', 'quote_asset_volume', 'number_of_trades', 
-                                           'taker_buy_base_asset_volume', 'taker_buy_quote_asset_volume', 'ignore'])
-        for col in ['open', 'high', 'low', 'close', 'volume']: df[col] = pd.to_numeric(df[col])
-        df['timestamp'] = pd.to_datetime(df['timestamp'], unit='ms')
-        return df
+        key = (symbol, interval)
+        with metricas.medir("ciclo_fase_segundos", fase="klines"), kline_cache_locks.setdefault(key, threading.Lock()):
+            klines = _actualizar_kline_cache(key, symbol, interval)
+            if not klines: logging.warning(f"No se recibieron klines para {symbol}"); return None
+            buffer = velas_cache.get(key)
+            if buffer is None: buffer = velas_cache[key] = BufferVelas(KLINE_CACHE_MAX_SIZE)
+            velas = buffer.sincronizar(klines)
+            if almacen_velas:
+                try: almacen_velas.guardar_cerradas(symbol, interval, velas)
+                except OSError as e: logging.warning(f"No se pudieron guardar las velas de {symbol} {interval} en {KLINE_STORE_DIR}: {e}")
+            return velas[-limit:].copy()
     except Exception as e: logging.error(f"Error obteniendo/procesando klines {symbol}: {e}"); return None
 
-def calcular_indicadores(df):
-    if df is None or df.empty or len(df) < 20: # Ajustar si los indicadores necesitan más
-        logging.warning("DataFrame vacío o insuficiente para calcular indicadores.")
-        return df
+def precio_actual(symbol):
+    # Último precio sin tocar la caché de klines ni el almacén: el cierre de la vela en caché (lo mantiene el
+    # stream) o, si aún no hay caché para el símbolo, una sola consulta al ticker
+    buf = kline_cache.get((symbol, KLINE_INTERVAL_FOR_INDICATORS))
+    if buf: return float(buf[-1][4])
+    try: return float(binance_client.get_symbol_ticker(symbol=symbol)['price'])
+    except Exception as e: logging.error(f"Error obteniendo el precio de {symbol}: {e}"); return None
+
+def obtener_klines_df(symbol, interval, limit=100):
+    # Vista pandas de obtener_velas (columna timestamp como datetime) para quien necesite un DataFrame
+    velas = obtener_velas(symbol, interval, limit)
+    return como_dataframe(velas) if velas is not None else None
+
+def calcular_indicadores(velas, symbol=SYMBOL_EXCHANGE, interval=KLINE_INTERVAL_FOR_INDICATORS):
+    with metricas.medir("ciclo_fase_segundos", fase="indicadores"): return _calcular_indicadores(velas, symbol, interval)
+
+def _calcular_indicadores(velas, symbol, interval):
+    if velas is None or len(velas) < 20: # Ajustar si los indicadores necesitan más
+        logging.warning("Velas vacías o insuficientes para calcular indicadores.")
+        return velas
     try:
-        df.ta.rsi(length=14, append=True, col_names=('RSI_14',))
-        df.ta.sma(length=20, append=True, col_names=('SMA_20',))
-        df.ta.sma(length=50, append=True, col_names=('SMA_50',))
-        return df
-    except Exception as e: logging.error(f"Error calculando indicadores: {e}"); return df
-
-def formatear_klines_para_prompt(df, num_klines_to_show=5):
-    if df is None or df.empty or len(df) < num_klines_to_show: return "Datos de klines insuficientes."
-    relevant_klines = df[['timestamp', 'open', 'high', 'low', 'close', 'volume']].tail(num_klines_to_show)
+        key = (symbol, interval); estado = indicator_states.get(key)
+        tiempos = velas['open_time']; cierres = velas['close']
+        if estado is None or estado.open_time is None or tiempos[0] > estado.open_time: # Sin estado o sin solape: sembrar
+            estado = indicator_states[key] = EstadoIndicadores()
+            cache = kline_cache.get(key) or []
+            if almacen_velas: # Historia guardada anterior a la caché: el RSI (media de Wilder) arranca ya convergido
+                hist = almacen_velas.leer(symbol, interval, hasta=cache[0][0] if cache else int(tiempos[0]), limite=INDICATOR_WARMUP_FROM_STORE)
+                for t, c in zip(hist['open_time'].tolist(), hist['close'].tolist()): estado.actualizar(t, c)
+            for k in cache:
+                if k[0] < tiempos[0]: estado.actualizar(k[0], k[4])
+        # Solo se alimentan la vela que estaba abierta (con su cierre definitivo) y las nuevas
+        for i in range(int(np.searchsorted(tiempos, estado.open_time if estado.open_time is not None else tiempos[0])), len(velas)):
+            estado.actualizar(int(tiempos[i]), cierres[i])
+        for col in COLUMNAS_INDICADORES: velas[col] = np.nan
+        filas = [(-1, estado.valores()), (-2, estado.previo), (-3, estado.anterior)][:len(velas)]
+        for pos, valores in filas:
+            for col in COLUMNAS_INDICADORES:
+                if valores and valores.get(col) is not None: velas[col][pos] = valores[col]
+        return velas
+    except Exception as e: logging.error(f"Error calculando indicadores: {e}"); return velas
+
+def formatear_klines_para_prompt(velas, num_klines_to_show=5):
+    if velas is None or len(velas) < num_klines_to_show: return "Datos de klines insuficientes."
     summary_str = f"Ultimas {num_klines_to_show} velas ({KLINE_INTERVAL_FOR_INDICATORS}):\n"
-    for _, row in relevant_klines.iterrows():
-        summary_str += f"  T: {row['timestamp'].strftime('%H:%M')}, O:{row['open']:.2f}, H:{row['high']:.2f}, L:{row['low']:.2f}, C:{row['close']:.2f}, V:{row['volume']:.2f}\n"
+    for t, o, h, l, c, v in zip(*(velas[col][-num_klines_to_show:].tolist() for col in ('open_time', 'open', 'high', 'low', 'close', 'volume'))):
+        summary_str += f"  T: {hora_utc(t)}, O:{o:.2f}, H:{h:.2f}, L:{l:.2f}, C:{c:.2f}, V:{v:.2f}\n"
     return summary_str
 
-def place_order_on_binance(si_data, qty_base, price_qt, side_val, order_type=Client.ORDER_TYPE_LIMIT):
+def place_order_on_binance(si_data, qty_base, price_qt, side_val, order_type=ORDER_TYPE_LIMIT):
     sym = si_data['symbol']
     try:
-        fmt_qty = format_quantity(si_data, qty_base)
-        min_q = _get_filter_value(si_data, 'LOT_SIZE', 'minQty')
-        if min_q and fmt_qty < min_q: logging.error(f"Qty {fmt_qty} < minQty ({min_q})."); return None
-        if fmt_qty <= 0: logging.error(f"Qty <=0 ({fmt_qty})."); return None
-        
+        if order_type not in (ORDER_TYPE_LIMIT, ORDER_TYPE_MARKET): logging.error(f"Tipo orden no soportado: {order_type}"); return None
+        # Cantidad y precio redondeados y validados contra todos los filtros de una vez (en MARKET price_qt es el precio actual, solo para el nocional)
+        fmt_qty, fmt_price, error = reglas_de(si_data).validar_orden(qty_base, price_qt, limit=order_type == ORDER_TYPE_LIMIT)
+        if error: logging.error(error); return None
+
         params = {'symbol': sym, 'side': side_val.upper(), 'type': order_type, 'quantity': f"{fmt_qty:.8f}"} # Asegurar formato decimal
-        
-        # Convertir price_qt a Decimal para cálculos y comprobaciones
-        price_qt_decimal = decimal.Decimal(str(price_qt))
-
-        if order_type == Client.ORDER_TYPE_LIMIT:
-            fmt_price = format_price(si_data, price_qt_decimal)
-            if not check_min_notional(si_data, fmt_qty, fmt_price): return None
-            params.update({'timeInForce': Client.TIME_IN_FORCE_GTC, 'price': f"{fmt_price:.8f}"}) # Asegurar formato decimal
-        elif order_type == Client.ORDER_TYPE_MARKET:
-            if not check_min_notional(si_data, fmt_qty, price_qt_decimal): return None # price_qt es el precio actual para notional
-        else:
-            logging.error(f"Tipo orden no soportado: {order_type}"); return None
-        
+        if order_type == ORDER_TYPE_LIMIT:
+            params.update({'timeInForce': TIME_IN_FORCE_GTC, 'price': f"{fmt_price:.8f}"}) # Asegurar formato decimal
+
         logging.info(f"Intentando orden: {params}"); resp = binance_client.create_order(**params)
+        metricas.incrementar("ordenes_total", lado=params['side'], tipo=order_type)
+        account_snapshot.invalidar() # La orden (y su posible fill) cambia los saldos libres
+        order_tracker.registrar(resp) # Punto de partida; los executionReport la mantienen al día
         logging.info(f"Respuesta orden: {resp}"); return resp
-    except (BinanceAPIException,BinanceOrderException) as e: logging.error(f"Error Binance orden {side_val} {sym}: {e.status_code}-{e.message}")
+    except (BinanceAPIException,BinanceOrderException) as e:
+        logging.error(f"Error Binance orden {side_val} {sym}: {e.status_code}-{e.message}")
+        if getattr(e, 'code', None) == -1013: exchange_info_cache.invalidar(sym) # Filtro rechazado: releer filtros en el próximo arranque
     except Exception as e: logging.error(f"Error inesperado orden: {e}")
     return None
 
 # --- Funciones de IA de Google Gemini ---
-def get_ai_trading_signal(market_data_summary_for_ai, current_price_val, rsi_val=None, sma20_val=None, sma50_val=None, klines_summary_str=None):
+def get_ai_trading_signal(market_data_summary_for_ai, current_price_val, rsi_val=None, sma20_val=None, sma50_val=None, klines_summary_str=None,
+                          symbol=SYMBOL_EXCHANGE, base_asset=BASE_ASSET, quote_asset=QUOTE_ASSET):
     FORZAR_SEÑAL_PARA_PRUEBA = None # ASEGÚRATE QUE ESTO SEA None PARA OPERACIÓN NORMAL CON WEB
     if FORZAR_SEÑAL_PARA_PRUEBA:
         logging.warning(f"SEÑAL IA FORZADA (INTERNA DEL BOT): {FORZAR_SEÑAL_PARA_PRUEBA}")
         return FORZAR_SEÑAL_PARA_PRUEBA
-    if not model_ai:
+    modelo = inicializar_ia()
+    if not modelo:
         logging.warning("Modelo IA no disponible. Usando simulación.")
         sim_resp = ["BUY", "HOLD", "HOLD", "SELL", "HOLD"]
         s_idx = getattr(get_ai_trading_signal, "c", 0) % len(sim_resp)
         get_ai_trading_signal.c = s_idx + 1; sig_txt = sim_resp[s_idx]
-        logging.info(f"Respuesta SIMULADA IA: {sig_txt}"); return sig_txt
+        logging.info(f"Respuesta SIMULADA IA: {sig_txt}"); metricas.incrementar("ia_llamadas_total", resultado="simulada"); return sig_txt
     try:
         current_price_val_float = float(current_price_val) # IA espera float para el prompt
         prompt_parts = [
-            f"Eres analista experto en trading de {SYMBOL_EXCHANGE} en Binance.",
+            f"Eres analista experto en trading de {symbol} en Binance.",
             "Objetivo: swing trading corto plazo (horas-días), buena relación riesgo/beneficio.",
             "Prioriza capital; si no hay señal clara, HOLD.\n", "Estado Actual General:",
             market_data_summary_for_ai, "\nDatos de Mercado Adicionales:",
-            f"- Precio Actual {BASE_ASSET}: {current_price_val_float:.2f} {QUOTE_ASSET}"
+            f"- Precio Actual {base_asset}: {current_price_val_float:.2f} {quote_asset}"
         ]
         if klines_summary_str: prompt_parts.append(f"- Velas Recientes: {klines_summary_str}")
         if rsi_val is not None: prompt_parts.append(f"- RSI(14): {float(rsi_val):.2f}")
@@ -271,389 +581,770 @@ def get_ai_trading_signal(market_data_summary_for_ai, current_price_val, rsi_val
                              "Responde ÚNICAMENTE con: BUY, SELL, o HOLD."])
         prompt = "\n".join(prompt_parts)
         logging.info(f"Enviando prompt a IA ({AI_MODEL_NAME})...");
-        response = model_ai.generate_content(prompt)
+        with metricas.medir("ia_llamada_segundos"):
+            response = modelo.generate_content(prompt, request_options={"timeout": AI_REQUEST_TIMEOUT_SECONDS})
+        metricas.incrementar("ia_llamadas_total", resultado="respuesta")
         sig_txt = "HOLD" 
         if response and hasattr(response, 'text') and response.text: sig_txt = response.text.strip().upper()
         elif response and hasattr(response, 'parts') and response.parts:
             full_text = "".join(part.text for part in response.parts if hasattr(part, 'text'))
             sig_txt = full_text.strip().upper()
         logging.info(f"Respuesta IA: '{sig_txt}'")
-        if sig_txt in ["BUY","SELL","HOLD"]: return sig_txt
-        if "BUY" in sig_txt: return "BUY"
-        if "SELL" in sig_txt: return "SELL"
-        logging.warning(f"Respuesta IA no reconocida: '{sig_txt}'. Defaulting to HOLD.")
-        return "HOLD"
-    except Exception as e: logging.error(f"Error señal IA: {e}"); return "HOLD"
+        if sig_txt in ["BUY","SELL","HOLD"]: senal = sig_txt
+        elif "BUY" in sig_txt: senal = "BUY"
+        elif "SELL" in sig_txt: senal = "SELL"
+        else:
+            logging.warning(f"Respuesta IA no reconocida: '{sig_txt}'. Defaulting to HOLD.")
+            senal = "HOLD"
+        return senal
+    except Exception as e: logging.error(f"Error señal IA: {e}"); metricas.incrementar("ia_llamadas_total", resultado="error"); return "HOLD"
+
+# --- Consulta IA con plazo ---
+def dimensionar_pool_ia():
+    # Un hilo por símbolo más margen: unas pocas llamadas colgadas no dejan a los demás símbolos esperando turno
+    global ai_executor
+    anterior = ai_executor; ai_executor = ThreadPoolExecutor(max_workers=len(symbol_states) + AI_MAX_CONCURRENT, thread_name_prefix="ia")
+    anterior.shutdown(wait=False)
+
+def lanzar_consulta_ia(st, tipo, vela, precio, *args, **kwargs):
+    # Envía get_ai_trading_signal(*args, **kwargs) al pool de IA; al terminar despierta al planificador para ese símbolo.
+    # 'vela' (open time) y 'precio' son los de la pregunta: la respuesta solo se aplica si siguen vigentes.
+    fut = ai_executor.submit(get_ai_trading_signal, *args, **kwargs)
+    st.consulta_ia = {"future": fut, "tipo": tipo, "inicio": time.time(), "vela_open_time": vela, "precio": decimal.Decimal(str(precio))}
+    def _al_terminar(_fut):
+        if _fut.cancelled(): return # La canceló resolver_consulta_ia al vencer el plazo
+        if st.motivo_evento is None: st.motivo_evento = "RESPUESTA_IA"
+        despertar_planificador.set()
+    fut.add_done_callback(_al_terminar)
+    logging.info(f"Consulta IA ({tipo}) lanzada a {precio:.4f}; plazo {AI_DEADLINE_SECONDS:.0f}s.")
+
+def resolver_consulta_ia(st, vela_open_time, precio_actual):
+    # ("EN_CURSO", None) dentro de plazo; ("RESPUESTA" | "FALLBACK", señal); o ("DESCARTADA", motivo) si la
+    # respuesta llegó para otra vela o con el precio ya movido: nunca se aplica a un precio viejo.
+    c = st.consulta_ia; fut = c["future"]; espera = time.time() - c["inicio"]
+    if fut.done():
+        estado = "RESPUESTA"
+        try: senal = fut.result()
+        except Exception as e: logging.error(f"Error en la consulta IA: {e}"); senal = "HOLD"
+    elif espera < AI_DEADLINE_SECONDS: return "EN_CURSO", None
+    else:
+        estado = "FALLBACK"; senal = "BUY" if AI_FALLBACK == "REGLAS" else "HOLD"
+        sin_empezar = fut.cancel() # Solo se puede cancelar si seguía en la cola del pool: nunca llegó a preguntar
+        metricas.incrementar("ia_consultas_vencidas_total", estado="sin_empezar" if sin_empezar else "en_curso")
+        if sin_empezar: logging.warning(f"La consulta IA venció sin empezar: el pool de IA estaba lleno.")
+        logging.warning(f"La IA no respondió en {AI_DEADLINE_SECONDS:.0f}s. Fallback {AI_FALLBACK}: {senal}.")
+    st.consulta_ia = None
+    if vela_open_time != c["vela_open_time"]: return "DESCARTADA", "Respuesta IA de una vela anterior"
+    desvio = abs(precio_actual - c["precio"]) / c["precio"] * 100
+    if desvio > decimal.Decimal(str(AI_MAX_PRICE_DRIFT_PERCENT)): return "DESCARTADA", f"Precio movido {desvio:.2f}% desde la consulta IA"
+    logging.info(f"Señal IA ({c['tipo']}, {estado}) tras {espera:.1f}s: {senal}")
+    return estado, senal
+
+def comprar_por_ia(st, db_data_this_cycle, sufijo=""):
+    # Orden LIMIT de compra a precio_entrada del último cierre, tras la confirmación de la IA
+    db_data_this_cycle["accion_bot"] = f"INTENTO_COMPRA_IA{sufijo}"; logging.info(f"IA: COMPRAR {st.order_amount_base} {st.base_asset}...")
+    precio_compra_limit = estrategia.precio_entrada(decimal.Decimal(str(st.cur_price_float)))
+    precio_compra_limit_formateado = format_price(st.si_data, precio_compra_limit)
+    order_res = place_order_on_binance(st.si_data, st.order_amount_base, precio_compra_limit_formateado, "BUY", ORDER_TYPE_LIMIT)
+    if order_res:
+        if order_res.get('status') == ORDER_STATUS_FILLED:
+            st.has_position = True; st.entry_timestamp = datetime.now(); exec_qty = decimal.Decimal(order_res.get('executedQty','0')); cum_qt_qty = decimal.Decimal(order_res.get('cummulativeQuoteQty','0'))
+            st.last_buy_price = cum_qt_qty/exec_qty if exec_qty > 0 else decimal.Decimal(order_res.get('price',str(st.cur_price_float)))
+            logging.info(f"COMPRA LLENADA INMEDIATAMENTE (IA{sufijo}): {exec_qty} {st.base_asset} a ~{st.last_buy_price:.4f}. ID:{order_res.get('orderId')}")
+            db_data_this_cycle.update({"accion_bot":f"COMPRA_EJECUTADA_IA{sufijo}", "precio_ejecutado":st.last_buy_price, "cantidad_base_ejecutada":exec_qty, "costo_total_usdt":cum_qt_qty, "orderid_abierta": str(order_res.get('orderId'))})
+        elif order_res.get('status') in [ORDER_STATUS_NEW, ORDER_STATUS_PARTIALLY_FILLED]:
+            st.open_order_details = {'orderId': order_res['orderId'], 'side': 'BUY', 'price': decimal.Decimal(order_res['price']), 'qty': decimal.Decimal(order_res['origQty']), 'timestamp': datetime.now()}
+            db_data_this_cycle.update({"accion_bot":f"COMPRA_ORDEN_ABIERTA_IA{sufijo}", "orderid_abierta": str(order_res['orderId'])})
+        else: db_data_this_cycle.update({"accion_bot":f"FALLO_COLOCAR_COMPRA_IA{sufijo}", "notas_adicionales":f"Resp: {order_res.get('status')}"})
+    else: db_data_this_cycle.update({"accion_bot":f"FALLO_COMPRA_API_IA{sufijo}", "notas_adicionales":"place_order_on_binance devolvió None"})
+
+def aplicar_comando_web(command, symbol=None):
+    # Marca el comando en el SymbolState (símbolo principal si no se indica) y despierta al planificador.
+    # Devuelve (ok, mensaje) para el ack del canal IPC.
+    command = (command or "").strip().upper()
+    palabras = command.split()
+    if palabras[:1] == ["PROFILE"]: # "PROFILE [N]": perfila los N ciclos siguientes; N va en el propio comando
+        ciclos = palabras[1] if len(palabras) > 1 else str(PROFILE_CICLOS_POR_DEFECTO)
+        if not ciclos.isdigit(): return False, f"Número de ciclos inválido: {ciclos}"
+        return perfilador.iniciar(int(ciclos))
+    st = symbol_states.get(symbol.strip().upper()) if symbol else next(iter(symbol_states.values()), None)
+    if command not in ["FORCE_BUY", "FORCE_SELL", "FORCE_IA_CONSULT", "CLEAR_FORCED_ACTION"] or not st:
+        logging.warning(f"Comando web desconocido o símbolo no operado: {command} {symbol or ''}")
+        return False, f"Comando desconocido o símbolo no operado: {command} {symbol or ''}".strip()
+    st.comandos.put(command) # El ciclo lo recoge al empezar; aquí no se toca el estado que el ciclo puede estar usando
+    logging.info(f"Comando web recibido: {command} ({st.symbol})")
+    despertar_planificador.set()
+    return True, f"{command} aceptado para {st.symbol}"
 
 def check_for_web_command():
-    global current_forced_action
+    # Respaldo por fichero. Formato: "COMANDO" (símbolo principal), "COMANDO SIMBOLO" o "PROFILE [N]".
     try:
         if os.path.exists(COMMAND_FILE):
             with open(COMMAND_FILE, 'r') as f:
-                command = f.read().strip().upper()
-            if command in ["FORCE_BUY", "FORCE_SELL", "FORCE_IA_CONSULT", "CLEAR_FORCED_ACTION"]:
-                current_forced_action = command
-                logging.info(f"Comando web recibido: {current_forced_action}")
-            else:
-                logging.warning(f"Comando web desconocido: {command}")
+                partes = f.read().strip().upper().split()
             os.remove(COMMAND_FILE)
+            if partes[:1] == ["PROFILE"]: aplicar_comando_web(" ".join(partes)) # Sus argumentos no son un símbolo
+            else: aplicar_comando_web(partes[0] if partes else "", partes[1] if len(partes) > 1 else None)
     except Exception as e:
         logging.error(f"Error leyendo el archivo de comando web: {e}")
-        current_forced_action = None
+
+def escribir_json_atomico(path, data):
+    # El lector nunca ve un fichero a medio escribir: se escribe aparte y se renombra encima.
+    tmp = f"{path}.tmp"
+    with open(tmp, 'w') as f: json.dump(data, f)
+    os.replace(tmp, path)
+
+def iniciar_canal_ipc():
+    global ipc_server
+    if not USE_IPC_CHANNEL: return
+    try: ipc_server = bot_ipc.IpcServer(on_command=aplicar_comando_web).start()
+    except (OSError, AttributeError) as e: logging.warning(f"No se pudo abrir el canal IPC ({e}). Solo ficheros JSON.")
+
+# --- Métricas ---
+def _ms(segundos):
+    return round(segundos * 1000, 1) if segundos is not None else None
+
+def _metrica_peticion_binance(metodo, peso, segundos, ok):
+    metricas.observar("binance_rest_segundos", segundos, metodo=metodo)
+    metricas.incrementar("binance_rest_peso_total", peso)
+    if not ok: metricas.incrementar("binance_rest_errores_total", metodo=metodo)
+
+def exportar_metricas():
+    # Contadores e histogramas acumulados más medidores que se leen en el momento
+    limites = limitador_binance.estado()
+    medidores = [("db_cola_filas", {}, db_queue.qsize()), ("cuenta_edad_segundos", {}, round(min(account_snapshot.edad(), 1e9), 3)),
+                 ("binance_esperas_limite", {}, limites["esperas"]), ("binance_respuestas_429", {}, limites["respuestas_429"])]
+    for nombre, cubeta in limites["cubetas"].items():
+        medidores.append(("binance_cupo_disponible", {"limite": nombre}, cubeta["disponible"]))
+        medidores.append(("binance_cupo_usado_servidor", {"limite": nombre}, cubeta["usado_servidor"]))
+    return metricas.exportar(medidores)
+
+# --- Seguimiento de órdenes ---
+def orden_actualizada(symbol, orden):
+    # Callback del seguidor: un fill o cambio de estado de la orden abierta dispara un ciclo del símbolo
+    if orden['status'] != ORDER_STATUS_NEW: account_snapshot.invalidar() # Fill o cierre: saldos cambiados
+    st = symbol_states.get(symbol)
+    if st and st.open_order_details and st.open_order_details['orderId'] == orden['orderId']:
+        if st.motivo_evento is None: st.motivo_evento = "ORDEN_ACTUALIZADA"
+        despertar_planificador.set()
+
+def estado_orden_abierta(st):
+    # Del seguidor (stream o reconciliación por lotes); get_order solo si la orden no está registrada (p.ej. tras reiniciar)
+    if order_tracker.necesita_reconciliar():
+        order_tracker.reconciliar(lambda: binance_client.get_open_orders(), lambda sym, oid: binance_client.get_order(symbol=sym, orderId=oid))
+    info = order_tracker.estado(st.open_order_details['orderId'])
+    if info is None:
+        info = binance_client.get_order(symbol=st.symbol, orderId=st.open_order_details['orderId']); order_tracker.registrar(info)
+    return info
+
+def aplicar_ejecucion_parcial(st, info, db_data_this_cycle):
+    # Orden cerrada sin llenarse del todo: lo ejecutado cuenta igual (compra -> posición, venta -> G/P de esa parte)
+    exec_qty = decimal.Decimal((info or {}).get('executedQty') or '0')
+    if exec_qty <= 0: return
+    cum_qt_qty = decimal.Decimal(info.get('cummulativeQuoteQty') or '0'); avg_filled_price = cum_qt_qty / exec_qty
+    notas = f"{db_data_this_cycle.get('notas_adicionales', '')}. Parcial: {exec_qty} a ~{avg_filled_price:.4f}"
+    db_data_this_cycle.update({"precio_ejecutado": avg_filled_price, "cantidad_base_ejecutada": exec_qty, "costo_total_usdt": cum_qt_qty, "notas_adicionales": notas})
+    if st.open_order_details['side'] == 'BUY':
+        st.has_position = True; st.last_buy_price = avg_filled_price; st.entry_timestamp = datetime.now()
+        logging.info(f"COMPRA PARCIAL: {exec_qty} {st.base_asset} a ~{avg_filled_price:.4f}. Se mantiene como posición.")
+    else:
+        gn_ls_op = (avg_filled_price - st.last_buy_price) * exec_qty if st.last_buy_price > 0 else decimal.Decimal('0.0')
+        logging.info(f"VENTA PARCIAL: {exec_qty} {st.base_asset} a ~{avg_filled_price:.4f}. G/P: {gn_ls_op:.4f}. El resto sigue en posición.")
+        db_data_this_cycle["ganancia_perdida_operacion_usdt"] = gn_ls_op
 
 # --- Lógica Principal del Bot ---
-def run_ai_trading_bot():
-    global has_position, last_buy_price, entry_timestamp, open_order_details, current_forced_action
-    initialize_db_table()
-    logging.info(f"Iniciando AI Trading Bot para {SYMBOL_EXCHANGE}...")
-    si_data = get_binance_symbol_info(SYMBOL_EXCHANGE)
-    if not si_data: logging.error(f"No info para {SYMBOL_EXCHANGE}. Saliendo."); return
+def publicar_grafico(st, velas):
+    chart_points_ohlc = puntos_grafico(velas, MAX_CHART_POINTS)
+    try:
+        with metricas.medir("ciclo_fase_segundos", fase="grafico"):
+            if ipc_server: ipc_server.publish_chart(st.symbol, st.principal, chart_points_ohlc)
+            escribir_json_atomico(st.chart_data_file, chart_points_ohlc)
+        logging.debug(f"Datos del gráfico OHLC actualizados en {st.chart_data_file}")
+    except Exception as e_chart: logging.error(f"Error escribiendo datos del gráfico: {e_chart}")
 
-    cur_price_float = None # Para P&L flotante si no hay klines en el ciclo
+def construir_estado_bot(st, velas_indicadas, bal_base, bal_quote, ultima_accion):
+    # Estado que se publica al final de cada ciclo (IPC y bot_status*.json)
+    current_pnl_usdt_status = decimal.Decimal('0.0')
+    current_pnl_percent_status = decimal.Decimal('0.0')
+    time_in_position_str_status = "N/A"
+    tp_price_status = None
+    sl_price_status = None
 
-    while True:
-        ts_str = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        db_data_this_cycle = {col: None for col in DB_COLUMN_ORDER}
-        db_data_this_cycle.update({"timestamp": datetime.now(), "simbolo": SYMBOL_EXCHANGE})
-        order_action_this_cycle = False
+    if st.has_position and st.last_buy_price > 0:
+        cur_price_for_pnl_float_status = None
+        # Intenta usar el st.cur_price_float ya obtenido (en este ciclo o en uno anterior)
+        if st.cur_price_float is not None:
+            cur_price_for_pnl_float_status = st.cur_price_float
+        elif velas_indicadas is not None and len(velas_indicadas): # 'velas_indicadas' debería estar disponible si se procesó la lógica normal
+             cur_price_for_pnl_float_status = float(velas_indicadas['close'][-1])
+        else: # Fallback si no hay klines procesados en este ciclo (ej. solo se gestionó orden abierta)
+            cur_price_for_pnl_float_status = precio_actual(st.symbol)
+        
+        if cur_price_for_pnl_float_status is not None:
+            current_pnl_usdt_status = (decimal.Decimal(str(cur_price_for_pnl_float_status)) - st.last_buy_price) * st.order_amount_base
+            costo_compra_total_status = st.last_buy_price * st.order_amount_base
+            if costo_compra_total_status > 0 :
+                current_pnl_percent_status = (current_pnl_usdt_status / costo_compra_total_status) * 100
         
-        check_for_web_command()
+        if st.entry_timestamp:
+           time_in_pos = datetime.now() - st.entry_timestamp
+           time_in_position_str_status = str(time_in_pos).split('.')[0]
+        
+        tp_price_status, sl_price_status = (float(p) for p in estrategia.niveles_salida(st.last_buy_price, TARGET_PROFIT_PERCENT, STOP_LOSS_PERCENT))
 
-        try:
-            bal_base_ant = get_binance_asset_balance(BASE_ASSET)
-            bal_qt_ant = get_binance_asset_balance(QUOTE_ASSET)
-            logging.info(f"--- Nuevo Ciclo ({ts_str}) | Pos: {'Sí' if has_position else 'No'}, Ult.Compra: {last_buy_price if has_position else 'N/A'} | "
-                         f"Bal {BASE_ASSET}: {bal_base_ant:.8f}, Bal {QUOTE_ASSET}: {bal_qt_ant:.4f} | "
-                         f"Orden Abierta: {open_order_details['orderId'] if open_order_details else 'No'} | "
-                         f"Acción Forzada Web: {current_forced_action or 'Ninguna'} ---")
-
-            forced_action_executed_this_cycle = False
-            # --- LÓGICA DE ACCIÓN FORZADA DESDE WEB ---
-            if current_forced_action == "FORCE_BUY" and not has_position and not open_order_details:
-                logging.warning("--- ACCIÓN FORZADA DESDE WEB: COMPRA ---")
-                db_data_this_cycle["accion_bot"] = "FORZAR_COMPRA_WEB"; db_data_this_cycle["tipo_orden_ia"] = "FORZADO_WEB"
-                latest_klines_df_temp = obtener_klines_df(SYMBOL_EXCHANGE, KLINE_INTERVAL_FOR_INDICATORS, 1)
-                if latest_klines_df_temp is not None and not latest_klines_df_temp.empty:
-                    forced_buy_price = decimal.Decimal(str(latest_klines_df_temp.iloc[-1]['close']))
-                    order_res = place_order_on_binance(si_data, ORDER_AMOUNT_BASE, forced_buy_price, "BUY", Client.ORDER_TYPE_MARKET)
-                    if order_res and order_res.get('status') == Client.ORDER_STATUS_FILLED:
-                        has_position = True; entry_timestamp = datetime.now()
-                        exec_qty = decimal.Decimal(order_res.get('executedQty','0'))
-                        cum_qt_qty = decimal.Decimal(order_res.get('cummulativeQuoteQty','0'))
-                        last_buy_price = cum_qt_qty / exec_qty if exec_qty > 0 else forced_buy_price
-                        logging.info(f"COMPRA FORZADA WEB LLENADA: {exec_qty} {BASE_ASSET} a ~{last_buy_price:.4f}. ID:{order_res.get('orderId')}")
-                        db_data_this_cycle.update({"precio_ejecutado": last_buy_price, "cantidad_base_ejecutada": exec_qty, "costo_total_usdt": cum_qt_qty, "orderid_abierta": str(order_res.get('orderId'))})
-                    elif order_res: db_data_this_cycle["notas_adicionales"] = f"Fallo compra forzada: {order_res.get('status')}"
-                    else: db_data_this_cycle["notas_adicionales"] = "Fallo API compra forzada"
-                else: db_data_this_cycle["notas_adicionales"] = "Sin precio para compra forzada"
-                current_forced_action = None; forced_action_executed_this_cycle = True
-
-            elif current_forced_action == "FORCE_SELL" and has_position and not open_order_details:
-                logging.warning("--- ACCIÓN FORZADA DESDE WEB: VENTA ---")
-                db_data_this_cycle["accion_bot"] = "FORZAR_VENTA_WEB"; db_data_this_cycle["tipo_orden_ia"] = "FORZADO_WEB"
-                latest_klines_df_temp = obtener_klines_df(SYMBOL_EXCHANGE, KLINE_INTERVAL_FOR_INDICATORS, 1)
-                if latest_klines_df_temp is not None and not latest_klines_df_temp.empty:
-                    forced_sell_price = decimal.Decimal(str(latest_klines_df_temp.iloc[-1]['close']))
-                    current_base_bal = get_binance_asset_balance(BASE_ASSET); sell_qty_forced = min(ORDER_AMOUNT_BASE, current_base_bal)
-                    if sell_qty_forced > decimal.Decimal('0'):
-                        order_res = place_order_on_binance(si_data, sell_qty_forced, forced_sell_price, "SELL", Client.ORDER_TYPE_MARKET)
-                        if order_res and order_res.get('status') == Client.ORDER_STATUS_FILLED:
-                            exec_qty_s = decimal.Decimal(order_res.get('executedQty','0')); cum_qt_qty_s = decimal.Decimal(order_res.get('cummulativeQuoteQty','0'))
-                            avg_s_price = cum_qt_qty_s / exec_qty_s if exec_qty_s > 0 else forced_sell_price
-                            gn_ls_op = (avg_s_price - last_buy_price) * exec_qty_s if last_buy_price > 0 else decimal.Decimal('0.0')
-                            logging.info(f"VENTA FORZADA WEB LLENADA: {exec_qty_s} {BASE_ASSET} a ~{avg_s_price:.4f}. G/P: {gn_ls_op:.4f}. ID:{order_res.get('orderId')}")
-                            db_data_this_cycle.update({"precio_ejecutado": avg_s_price, "cantidad_base_ejecutada": exec_qty_s, "costo_total_usdt": cum_qt_qty_s, "ganancia_perdida_operacion_usdt": gn_ls_op, "orderid_abierta": str(order_res.get('orderId'))})
-                            has_position = False; last_buy_price = decimal.Decimal('0.0'); entry_timestamp = None
-                        elif order_res: db_data_this_cycle["notas_adicionales"] = f"Fallo venta forzada: {order_res.get('status')}"
-                        else: db_data_this_cycle["notas_adicionales"] = "Fallo API venta forzada"
-                    else: db_data_this_cycle["notas_adicionales"] = f"Sin saldo {BASE_ASSET} para venta forzada"
-                else: db_data_this_cycle["notas_adicionales"] = "Sin precio para venta forzada"
-                current_forced_action = None; forced_action_executed_this_cycle = True
-            
-            elif current_forced_action == "FORCE_IA_CONSULT" and not has_position and not open_order_details:
-                logging.warning("--- ACCIÓN FORZADA DESDE WEB: CONSULTA IA (para Compra Potencial) ---")
-                db_data_this_cycle["accion_bot"] = "FORZAR_CONSULTA_IA_WEB"
-                klines_df_ia = obtener_klines_df(SYMBOL_EXCHANGE, KLINE_INTERVAL_FOR_INDICATORS, KLINE_LIMIT_FOR_INDICATORS)
-                klines_df_indicado_ia = calcular_indicadores(klines_df_ia)
-                if klines_df_indicado_ia is None or klines_df_indicado_ia.empty or len(klines_df_indicado_ia) < 2:
-                    db_data_this_cycle["notas_adicionales"] = "Fallo datos para consulta IA forzada"
+    return {
+        "has_position": st.has_position,
+        "last_buy_price": float(st.last_buy_price) if st.last_buy_price > 0 else None,
+        "pnl_usdt": float(current_pnl_usdt_status),
+        "pnl_percent": float(current_pnl_percent_status),
+        "target_profit_price": tp_price_status,
+        "stop_loss_price": sl_price_status,
+        "time_in_position": time_in_position_str_status,
+        "open_order_id": st.open_order_details['orderId'] if st.open_order_details else None,
+        "base_asset_balance": float(bal_base), # Los balances ya obtenidos en el ciclo, para consistencia
+        "quote_asset_balance": float(bal_quote),
+        "last_bot_action": ultima_accion or "N/A",
+        "symbol": st.symbol, "kline_interval": KLINE_INTERVAL_FOR_INDICATORS,
+        "timestamp": datetime.now().isoformat(),
+        "check_interval_seconds": CHECK_INTERVAL, # <-- AÑADIR ESTO
+        "next_cycle_seconds": round(max(0.0, proximo_en_rejilla(INTERVALOS_MS[KLINE_INTERVAL_FOR_INDICATORS] / 1000) - time.time())), # Próximo ciclo completo (cierre de vela)
+        "balances_age_seconds": round(account_snapshot.edad(), 1),
+        "rate_limits": limitador_binance.estado(),
+        "cycle_p50_ms": _ms(metricas.cuantil("ciclo_segundos", 0.5, symbol=st.symbol)),
+        "cycle_p99_ms": _ms(metricas.cuantil("ciclo_segundos", 0.99, symbol=st.symbol)),
+        "profiling": perfilador.estado(),
+    }
+
+def ejecutar_ciclo(st):
+    # Un ciclo completo de decisión (comandos web, orden abierta, pre-filtro/IA, TP/SL, BD y estado).
+    # Devuelve la pausa extra (segundos) que pide un error; 0 si el ciclo terminó bien.
+    si_data = st.si_data; velas_indicadas = None
+    ts_str = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    db_data_this_cycle = {col: None for col in DB_COLUMN_ORDER}
+    db_data_this_cycle.update({"timestamp": datetime.now(), "simbolo": st.symbol})
+    order_action_this_cycle = False
+
+    try:
+        st.recoger_comandos()
+        bal_base_ant = get_binance_asset_balance(st.base_asset)
+        bal_qt_ant = get_binance_asset_balance(st.quote_asset)
+        logging.info(f"--- Nuevo Ciclo ({ts_str}) | Pos: {'Sí' if st.has_position else 'No'}, Ult.Compra: {st.last_buy_price if st.has_position else 'N/A'} | "
+                     f"Bal {st.base_asset}: {bal_base_ant:.8f}, Bal {st.quote_asset}: {bal_qt_ant:.4f} | "
+                     f"Orden Abierta: {st.open_order_details['orderId'] if st.open_order_details else 'No'} | "
+                     f"Acción Forzada Web: {st.current_forced_action or 'Ninguna'} ---")
+
+        forced_action_executed_this_cycle = False
+        # --- LÓGICA DE ACCIÓN FORZADA DESDE WEB ---
+        if st.current_forced_action == "FORCE_BUY" and not st.has_position and not st.open_order_details:
+            logging.warning("--- ACCIÓN FORZADA DESDE WEB: COMPRA ---")
+            db_data_this_cycle["accion_bot"] = "FORZAR_COMPRA_WEB"; db_data_this_cycle["tipo_orden_ia"] = "FORZADO_WEB"
+            latest_velas_temp = obtener_velas(st.symbol, KLINE_INTERVAL_FOR_INDICATORS, 1)
+            if latest_velas_temp is not None and len(latest_velas_temp):
+                forced_buy_price = decimal.Decimal(str(float(latest_velas_temp['close'][-1])))
+                order_res = place_order_on_binance(si_data, st.order_amount_base, forced_buy_price, "BUY", ORDER_TYPE_MARKET)
+                if order_res and order_res.get('status') == ORDER_STATUS_FILLED:
+                    st.has_position = True; st.entry_timestamp = datetime.now()
+                    exec_qty = decimal.Decimal(order_res.get('executedQty','0'))
+                    cum_qt_qty = decimal.Decimal(order_res.get('cummulativeQuoteQty','0'))
+                    st.last_buy_price = cum_qt_qty / exec_qty if exec_qty > 0 else forced_buy_price
+                    logging.info(f"COMPRA FORZADA WEB LLENADA: {exec_qty} {st.base_asset} a ~{st.last_buy_price:.4f}. ID:{order_res.get('orderId')}")
+                    db_data_this_cycle.update({"precio_ejecutado": st.last_buy_price, "cantidad_base_ejecutada": exec_qty, "costo_total_usdt": cum_qt_qty, "orderid_abierta": str(order_res.get('orderId'))})
+                elif order_res: db_data_this_cycle["notas_adicionales"] = f"Fallo compra forzada: {order_res.get('status')}"
+                else: db_data_this_cycle["notas_adicionales"] = "Fallo API compra forzada"
+            else: db_data_this_cycle["notas_adicionales"] = "Sin precio para compra forzada"
+            st.current_forced_action = None; forced_action_executed_this_cycle = True
+
+        elif st.current_forced_action == "FORCE_SELL" and st.has_position and not st.open_order_details:
+            logging.warning("--- ACCIÓN FORZADA DESDE WEB: VENTA ---")
+            db_data_this_cycle["accion_bot"] = "FORZAR_VENTA_WEB"; db_data_this_cycle["tipo_orden_ia"] = "FORZADO_WEB"
+            latest_velas_temp = obtener_velas(st.symbol, KLINE_INTERVAL_FOR_INDICATORS, 1)
+            if latest_velas_temp is not None and len(latest_velas_temp):
+                forced_sell_price = decimal.Decimal(str(float(latest_velas_temp['close'][-1])))
+                current_base_bal = get_binance_asset_balance(st.base_asset); sell_qty_forced = min(st.order_amount_base, current_base_bal)
+                if sell_qty_forced > decimal.Decimal('0'):
+                    order_res = place_order_on_binance(si_data, sell_qty_forced, forced_sell_price, "SELL", ORDER_TYPE_MARKET)
+                    if order_res and order_res.get('status') == ORDER_STATUS_FILLED:
+                        exec_qty_s = decimal.Decimal(order_res.get('executedQty','0')); cum_qt_qty_s = decimal.Decimal(order_res.get('cummulativeQuoteQty','0'))
+                        avg_s_price = cum_qt_qty_s / exec_qty_s if exec_qty_s > 0 else forced_sell_price
+                        gn_ls_op = (avg_s_price - st.last_buy_price) * exec_qty_s if st.last_buy_price > 0 else decimal.Decimal('0.0')
+                        logging.info(f"VENTA FORZADA WEB LLENADA: {exec_qty_s} {st.base_asset} a ~{avg_s_price:.4f}. G/P: {gn_ls_op:.4f}. ID:{order_res.get('orderId')}")
+                        db_data_this_cycle.update({"precio_ejecutado": avg_s_price, "cantidad_base_ejecutada": exec_qty_s, "costo_total_usdt": cum_qt_qty_s, "ganancia_perdida_operacion_usdt": gn_ls_op, "orderid_abierta": str(order_res.get('orderId'))})
+                        st.has_position = False; st.last_buy_price = decimal.Decimal('0.0'); st.entry_timestamp = None
+                    elif order_res: db_data_this_cycle["notas_adicionales"] = f"Fallo venta forzada: {order_res.get('status')}"
+                    else: db_data_this_cycle["notas_adicionales"] = "Fallo API venta forzada"
+                else: db_data_this_cycle["notas_adicionales"] = f"Sin saldo {st.base_asset} para venta forzada"
+            else: db_data_this_cycle["notas_adicionales"] = "Sin precio para venta forzada"
+            st.current_forced_action = None; forced_action_executed_this_cycle = True
+        
+        elif st.current_forced_action == "FORCE_IA_CONSULT" and not st.has_position and not st.open_order_details:
+            logging.warning("--- ACCIÓN FORZADA DESDE WEB: CONSULTA IA (para Compra Potencial) ---")
+            db_data_this_cycle["accion_bot"] = "FORZAR_CONSULTA_IA_WEB"
+            velas_ia = calcular_indicadores(obtener_velas(st.symbol, KLINE_INTERVAL_FOR_INDICATORS, KLINE_LIMIT_FOR_INDICATORS), st.symbol)
+            if velas_ia is None or len(velas_ia) < 2:
+                db_data_this_cycle["notas_adicionales"] = "Fallo datos para consulta IA forzada"
+            elif st.consulta_ia is not None:
+                db_data_this_cycle["notas_adicionales"] = "Ya hay una consulta IA en curso"
+            else:
+                latest_data_ia = fila(velas_ia, -1); cur_price_ia = decimal.Decimal(str(latest_data_ia['close']))
+                rsi_actual_ia = latest_data_ia.get('RSI_14'); sma20_actual_ia = latest_data_ia.get('SMA_20'); sma50_actual_ia = latest_data_ia.get('SMA_50')
+                logging.info(f"Forzando consulta IA con Precio: {cur_price_ia:.4f}, RSI: {float(rsi_actual_ia or 0):.2f}")
+                klines_str_summary_ia = formatear_klines_para_prompt(velas_ia, 5)
+                mkt_sum_ai_ia = f"Actualmente no tengo una posición abierta en {st.symbol} (Consulta IA Forzada).\n"
+                lanzar_consulta_ia(st, "FORZADA", latest_data_ia['open_time'], cur_price_ia,
+                                   mkt_sum_ai_ia, cur_price_ia, rsi_actual_ia, sma20_actual_ia, sma50_actual_ia, klines_str_summary_ia, st.symbol, st.base_asset, st.quote_asset)
+                db_data_this_cycle.update({"tipo_orden_ia": "PENDIENTE", "notas_adicionales": "Consulta lanzada; la compra se decide al llegar la respuesta"})
+            st.current_forced_action = None; forced_action_executed_this_cycle = True
+
+        elif st.current_forced_action == "CLEAR_FORCED_ACTION":
+            logging.info("Acción forzada web limpiada."); st.current_forced_action = None
+        
+        if forced_action_executed_this_cycle:
+            # No es necesario obtener klines de nuevo si ya se hizo para la acción forzada
+            pass # La lógica de guardado de estado y BD se hace al final del try
+        # --- FIN LÓGICA DE ACCIÓN FORZADA ---
+
+        # Si no se ejecutó una acción forzada que requiera 'continue', sigue la lógica normal
+        if not forced_action_executed_this_cycle:
+            if st.open_order_details: # GESTIONAR ORDEN ABIERTA (LÓGICA NORMAL)
+                order_action_this_cycle = True
+                logging.info(f"Verificando orden ID: {st.open_order_details['orderId']} ({st.open_order_details['side']})")
+                db_data_this_cycle["orderid_abierta"] = str(st.open_order_details['orderId'])
+                try:
+                    order_status_info = estado_orden_abierta(st)
+                    logging.info(f"Estado orden {st.open_order_details['orderId']}: {order_status_info['status']} (ejecutado {order_status_info['executedQty']})")
+                    if order_status_info['status'] == ORDER_STATUS_FILLED:
+                        logging.info(f"¡Orden {st.open_order_details['orderId']} ({st.open_order_details['side']}) LLENADA!")
+                        exec_qty = decimal.Decimal(order_status_info.get('executedQty','0'))
+                        cum_qt_qty = decimal.Decimal(order_status_info.get('cummulativeQuoteQty','0'))
+                        avg_filled_price = cum_qt_qty / exec_qty if exec_qty > 0 else st.open_order_details['price']
+                        db_data_this_cycle.update({"precio_ejecutado": avg_filled_price, "cantidad_base_ejecutada": exec_qty, "costo_total_usdt": cum_qt_qty})
+                        if st.open_order_details['side'] == 'BUY':
+                            st.has_position = True; st.last_buy_price = avg_filled_price; st.entry_timestamp = datetime.now()
+                            logging.info(f"COMPRA COMPLETADA (previa): {exec_qty} {st.base_asset} a ~{st.last_buy_price:.4f}.")
+                            db_data_this_cycle["accion_bot"] = "COMPRA_LLENADA_PREVIA"
+                        elif st.open_order_details['side'] == 'SELL':
+                            gn_ls_op = (avg_filled_price - st.last_buy_price) * exec_qty if st.last_buy_price > 0 else decimal.Decimal('0.0')
+                            logging.info(f"VENTA COMPLETADA (previa): {exec_qty} {st.base_asset} a ~{avg_filled_price:.4f}. G/P: {gn_ls_op:.4f}.")
+                            db_data_this_cycle.update({"accion_bot": "VENTA_LLENADA_PREVIA", "ganancia_perdida_operacion_usdt": gn_ls_op})
+                            st.has_position = False; st.last_buy_price = decimal.Decimal('0.0'); st.entry_timestamp = None
+                        order_tracker.olvidar(st.open_order_details['orderId']); st.open_order_details = None
+                    elif order_status_info['status'] in [ORDER_STATUS_CANCELED, ORDER_STATUS_EXPIRED, ORDER_STATUS_REJECTED, ORDER_STATUS_PENDING_CANCEL]:
+                        logging.warning(f"Orden {st.open_order_details['orderId']} no activa o cancelada. Estado: {order_status_info['status']}")
+                        db_data_this_cycle.update({"accion_bot":f"ORDEN_FALLIDA_O_CANCELADA_PREVIA ({order_status_info['status']})", "notas_adicionales": f"OrderID: {st.open_order_details['orderId']}"})
+                        aplicar_ejecucion_parcial(st, order_status_info, db_data_this_cycle)
+                        order_tracker.olvidar(st.open_order_details['orderId']); st.open_order_details = None
+                    else: 
+                        time_since_order = datetime.now() - st.open_order_details['timestamp']
+                        if time_since_order > timedelta(minutes=ORDER_TIMEOUT_MINUTES):
+                            logging.warning(f"Orden {st.open_order_details['orderId']} timeout. Cancelando...")
+                            try: 
+                                resp_cancel = binance_client.cancel_order(symbol=st.symbol, orderId=st.open_order_details['orderId']); account_snapshot.invalidar()
+                                logging.info(f"Orden {st.open_order_details['orderId']} cancelada.")
+                                db_data_this_cycle.update({"accion_bot":"ORDEN_CANCELADA_TIMEOUT", "notas_adicionales": f"OrderID: {st.open_order_details['orderId']}"})
+                                aplicar_ejecucion_parcial(st, resp_cancel, db_data_this_cycle) # La respuesta trae lo ejecutado hasta la cancelación
+                            except Exception as e_cancel: 
+                                logging.error(f"Error cancelando orden {st.open_order_details['orderId']}: {e_cancel}")
+                                db_data_this_cycle.update({"accion_bot":"ERROR_CANCELAR_ORDEN", "notas_adicionales": f"ID: {st.open_order_details['orderId']}, Err: {e_cancel}"})
+                            order_tracker.olvidar(st.open_order_details['orderId']); st.open_order_details = None
+                        else:
+                            logging.info(f"Orden {st.open_order_details['orderId']} ({order_status_info['status']}) abierta. Tiempo: {time_since_order}.")
+                            db_data_this_cycle.update({"accion_bot":"ESPERANDO_ORDEN_ABIERTA", "notas_adicionales": f"OrderID: {st.open_order_details['orderId']}"})
+                except Exception as e_get_order:
+                    logging.error(f"Error verificando orden {st.open_order_details['orderId']}: {e_get_order}")
+                    db_data_this_cycle.update({"accion_bot":"ERROR_VERIFICAR_ORDEN", "notas_adicionales": f"ID: {st.open_order_details['orderId']}, Err: {e_get_order}"})
+
+            # LÓGICA NORMAL DE TRADING (SI NO HAY ORDEN ABIERTA GESTIONADA)
+            elif not st.open_order_details: # Asegurar que solo se ejecuta si no hay orden abierta pendiente de la lógica anterior
+                # Los indicadores solo se calculan para evaluar la entrada, una vez por vela cerrada (ver más abajo)
+                velas_indicadas = obtener_velas(st.symbol, KLINE_INTERVAL_FOR_INDICATORS, KLINE_LIMIT_FOR_CHART) # Usar KLINE_LIMIT_FOR_CHART
+                if velas_indicadas is not None and len(velas_indicadas): publicar_grafico(st, velas_indicadas)
+
+                if velas_indicadas is None or len(velas_indicadas) < KLINE_LIMIT_FOR_INDICATORS: # Chequear contra límite de indicadores
+                    db_data_this_cycle.update({"accion_bot":"ERROR_DATOS_INDICADORES", "notas_adicionales":"Insuficientes datos."})
                 else:
-                    latest_data_ia = klines_df_indicado_ia.iloc[-1]; cur_price_ia = decimal.Decimal(str(latest_data_ia['close']))
-                    rsi_actual_ia = latest_data_ia.get('RSI_14'); sma20_actual_ia = latest_data_ia.get('SMA_20'); sma50_actual_ia = latest_data_ia.get('SMA_50')
-                    logging.info(f"Forzando consulta IA con Precio: {cur_price_ia:.4f}, RSI: {float(rsi_actual_ia or 0):.2f}")
-                    klines_str_summary_ia = formatear_klines_para_prompt(klines_df_indicado_ia, 5)
-                    mkt_sum_ai_ia = f"Actualmente no tengo una posición abierta en {SYMBOL_EXCHANGE} (Consulta IA Forzada).\n"
-                    ai_sig_final_ia = get_ai_trading_signal(mkt_sum_ai_ia, cur_price_ia, rsi_actual_ia, sma20_actual_ia, sma50_actual_ia, klines_str_summary_ia)
-                    logging.info(f"Señal IA (forzada consulta): {ai_sig_final_ia}")
-                    db_data_this_cycle.update({"tipo_orden_ia": ai_sig_final_ia, "respuesta_ia_completa": str(ai_sig_final_ia)})
-                    if ai_sig_final_ia == "BUY":
-                        logging.info(f"IA (consulta forzada) decidió COMPRAR {ORDER_AMOUNT_BASE} {BASE_ASSET}...")
-                        precio_compra_limit_ia = cur_price_ia * decimal.Decimal('0.999') # Orden LÍMITE
-                        precio_compra_limit_formateado_ia = format_price(si_data, precio_compra_limit_ia)
-                        order_res = place_order_on_binance(si_data, ORDER_AMOUNT_BASE, precio_compra_limit_formateado_ia, "BUY", Client.ORDER_TYPE_LIMIT)
-                        if order_res:
-                            if order_res.get('status') == Client.ORDER_STATUS_FILLED:
-                                has_position = True; entry_timestamp = datetime.now(); exec_qty = decimal.Decimal(order_res.get('executedQty','0')); cum_qt_qty = decimal.Decimal(order_res.get('cummulativeQuoteQty','0'))
-                                last_buy_price = cum_qt_qty/exec_qty if exec_qty > 0 else cur_price_ia
-                                logging.info(f"COMPRA (IA consulta forzada) LLENADA: {exec_qty} {BASE_ASSET} a ~{last_buy_price:.4f}. ID:{order_res.get('orderId')}")
-                                db_data_this_cycle.update({"accion_bot":"COMPRA_EJECUTADA_IA_FORZADA_WEB", "precio_ejecutado":last_buy_price, "cantidad_base_ejecutada":exec_qty, "costo_total_usdt":cum_qt_qty, "orderid_abierta": str(order_res.get('orderId'))})
-                            elif order_res.get('status') in [Client.ORDER_STATUS_NEW, Client.ORDER_STATUS_PARTIALLY_FILLED]:
-                                open_order_details = {'orderId': order_res['orderId'], 'side': 'BUY', 'price': decimal.Decimal(order_res['price']), 'qty': decimal.Decimal(order_res['origQty']), 'timestamp': datetime.now()}
-                                db_data_this_cycle.update({"accion_bot":"COMPRA_ORDEN_ABIERTA_IA_FORZADA_WEB", "orderid_abierta": str(order_res['orderId'])})
-                            else: db_data_this_cycle.update({"notas_adicionales":f"Fallo colocar compra IA forzada: {order_res.get('status')}"})
-                        else: db_data_this_cycle.update({"notas_adicionales":"Fallo API compra IA forzada"})
-                    else: logging.info(f"IA (consulta forzada) decidió {ai_sig_final_ia}. No se realiza compra.")
-                current_forced_action = None; forced_action_executed_this_cycle = True
-
-            elif current_forced_action == "CLEAR_FORCED_ACTION":
-                logging.info("Acción forzada web limpiada."); current_forced_action = None
-            
-            if forced_action_executed_this_cycle:
-                # No es necesario obtener klines de nuevo si ya se hizo para la acción forzada
-                pass # La lógica de guardado de estado y BD se hace al final del try
-            # --- FIN LÓGICA DE ACCIÓN FORZADA ---
-
-            # Si no se ejecutó una acción forzada que requiera 'continue', sigue la lógica normal
-            if not forced_action_executed_this_cycle:
-                if open_order_details: # GESTIONAR ORDEN ABIERTA (LÓGICA NORMAL)
-                    order_action_this_cycle = True
-                    logging.info(f"Verificando orden ID: {open_order_details['orderId']} ({open_order_details['side']})")
-                    db_data_this_cycle["orderid_abierta"] = str(open_order_details['orderId'])
-                    try:
-                        order_status_info = binance_client.get_order(symbol=SYMBOL_EXCHANGE, orderId=open_order_details['orderId'])
-                        logging.info(f"Estado orden {open_order_details['orderId']}: {order_status_info['status']}")
-                        if order_status_info['status'] == Client.ORDER_STATUS_FILLED:
-                            logging.info(f"¡Orden {open_order_details['orderId']} ({open_order_details['side']}) LLENADA!")
-                            exec_qty = decimal.Decimal(order_status_info.get('executedQty','0'))
-                            cum_qt_qty = decimal.Decimal(order_status_info.get('cummulativeQuoteQty','0'))
-                            avg_filled_price = cum_qt_qty / exec_qty if exec_qty > 0 else open_order_details['price']
-                            db_data_this_cycle.update({"precio_ejecutado": avg_filled_price, "cantidad_base_ejecutada": exec_qty, "costo_total_usdt": cum_qt_qty})
-                            if open_order_details['side'] == 'BUY':
-                                has_position = True; last_buy_price = avg_filled_price; entry_timestamp = datetime.now()
-                                logging.info(f"COMPRA COMPLETADA (previa): {exec_qty} {BASE_ASSET} a ~{last_buy_price:.4f}.")
-                                db_data_this_cycle["accion_bot"] = "COMPRA_LLENADA_PREVIA"
-                            elif open_order_details['side'] == 'SELL':
-                                gn_ls_op = (avg_filled_price - last_buy_price) * exec_qty if last_buy_price > 0 else decimal.Decimal('0.0')
-                                logging.info(f"VENTA COMPLETADA (previa): {exec_qty} {BASE_ASSET} a ~{avg_filled_price:.4f}. G/P: {gn_ls_op:.4f}.")
-                                db_data_this_cycle.update({"accion_bot": "VENTA_LLENADA_PREVIA", "ganancia_perdida_operacion_usdt": gn_ls_op})
-                                has_position = False; last_buy_price = decimal.Decimal('0.0'); entry_timestamp = None
-                            open_order_details = None
-                        elif order_status_info['status'] in [Client.ORDER_STATUS_CANCELED, Client.ORDER_STATUS_EXPIRED, Client.ORDER_STATUS_REJECTED, Client.ORDER_STATUS_PENDING_CANCEL]:
-                            logging.warning(f"Orden {open_order_details['orderId']} no activa o cancelada. Estado: {order_status_info['status']}")
-                            db_data_this_cycle.update({"accion_bot":f"ORDEN_FALLIDA_O_CANCELADA_PREVIA ({order_status_info['status']})", "notas_adicionales": f"OrderID: {open_order_details['orderId']}"})
-                            open_order_details = None
-                        else: 
-                            time_since_order = datetime.now() - open_order_details['timestamp']
-                            if time_since_order > timedelta(minutes=ORDER_TIMEOUT_MINUTES):
-                                logging.warning(f"Orden {open_order_details['orderId']} timeout. Cancelando...")
-                                try: 
-                                    binance_client.cancel_order(symbol=SYMBOL_EXCHANGE, orderId=open_order_details['orderId'])
-                                    logging.info(f"Orden {open_order_details['orderId']} cancelada.")
-                                    db_data_this_cycle.update({"accion_bot":"ORDEN_CANCELADA_TIMEOUT", "notas_adicionales": f"OrderID: {open_order_details['orderId']}"})
-                                except Exception as e_cancel: 
-                                    logging.error(f"Error cancelando orden {open_order_details['orderId']}: {e_cancel}")
-                                    db_data_this_cycle.update({"accion_bot":"ERROR_CANCELAR_ORDEN", "notas_adicionales": f"ID: {open_order_details['orderId']}, Err: {e_cancel}"})
-                                open_order_details = None
+                    latest_data = fila(velas_indicadas, -1); st.cur_price_float = latest_data['close']
+                    logging.info(f"Precio actual (cierre últ. vela): {st.cur_price_float:.4f}")
+
+                    vela_open_time = latest_data['open_time']; vela_cerrada = int(velas_indicadas['open_time'][-2])
+                    if st.has_position: st.consulta_ia = None # Ya no aplica (p. ej. compra forzada mientras esperaba)
+                    if not st.has_position and st.consulta_ia is not None: # RESPUESTA (O PLAZO VENCIDO) DE UNA CONSULTA IA
+                        sufijo = "_FORZADA_WEB" if st.consulta_ia["tipo"] == "FORZADA" else ""
+                        estado_ia, resultado_ia = resolver_consulta_ia(st, vela_open_time, decimal.Decimal(str(st.cur_price_float)))
+                        if estado_ia == "EN_CURSO":
+                            db_data_this_cycle.update({"accion_bot": "CONSULTA_IA_EN_CURSO", "tipo_orden_ia": "PENDIENTE"})
+                        elif estado_ia == "DESCARTADA":
+                            logging.warning(f"{resultado_ia}. Se descarta.")
+                            db_data_this_cycle.update({"accion_bot": f"RESPUESTA_IA_DESCARTADA{sufijo}", "notas_adicionales": resultado_ia})
+                        else:
+                            db_data_this_cycle.update({"tipo_orden_ia": resultado_ia, "respuesta_ia_completa": f"{resultado_ia} ({estado_ia})"})
+                            if resultado_ia == "BUY": comprar_por_ia(st, db_data_this_cycle, sufijo)
                             else:
-                                logging.info(f"Orden {open_order_details['orderId']} ({order_status_info['status']}) abierta. Tiempo: {time_since_order}.")
-                                db_data_this_cycle.update({"accion_bot":"ESPERANDO_ORDEN_ABIERTA", "notas_adicionales": f"OrderID: {open_order_details['orderId']}"})
-                    except Exception as e_get_order:
-                        logging.error(f"Error verificando orden {open_order_details['orderId']}: {e_get_order}")
-                        db_data_this_cycle.update({"accion_bot":"ERROR_VERIFICAR_ORDEN", "notas_adicionales": f"ID: {open_order_details['orderId']}, Err: {e_get_order}"})
-
-                # LÓGICA NORMAL DE TRADING (SI NO HAY ORDEN ABIERTA GESTIONADA)
-                elif not open_order_details: # Asegurar que solo se ejecuta si no hay orden abierta pendiente de la lógica anterior
-                    klines_df_trading = obtener_klines_df(SYMBOL_EXCHANGE, KLINE_INTERVAL_FOR_INDICATORS, KLINE_LIMIT_FOR_CHART) # Usar KLINE_LIMIT_FOR_CHART
-                    klines_df_indicado = calcular_indicadores(klines_df_trading) # Calcular indicadores sobre este df
-
-                    # --- GUARDAR DATOS PARA EL GRÁFICO ---
-                    if klines_df_indicado is not None and not klines_df_indicado.empty:
-                        df_for_chart = klines_df_indicado.tail(MAX_CHART_POINTS).copy()
-                        df_for_chart['time'] = df_for_chart['timestamp'].apply(lambda x: int(x.timestamp())) 
-                        chart_points_ohlc = df_for_chart[['time', 'open', 'high', 'low', 'close']].to_dict(orient='records')
-                        try:
-                            with open(CHART_DATA_FILE, 'w') as f_chart: json.dump(chart_points_ohlc, f_chart)
-                            logging.debug(f"Datos del gráfico OHLC actualizados en {CHART_DATA_FILE}")
-                        except Exception as e_chart: logging.error(f"Error escribiendo datos del gráfico: {e_chart}")
-                    # --- FIN GUARDAR DATOS PARA EL GRÁFICO ---
-
-                    if klines_df_indicado is None or klines_df_indicado.empty or len(klines_df_indicado) < KLINE_LIMIT_FOR_INDICATORS: # Chequear contra límite de indicadores
-                        db_data_this_cycle.update({"accion_bot":"ERROR_DATOS_INDICADORES", "notas_adicionales":"Insuficientes datos."})
-                    else:
-                        latest_data = klines_df_indicado.iloc[-1]; prev_data = klines_df_indicado.iloc[-2]
-                        cur_price_float = latest_data['close']; rsi_actual = latest_data.get('RSI_14')
-                        sma20_actual = latest_data.get('SMA_20'); sma50_actual = latest_data.get('SMA_50')
-                        rsi_display_str = f"{float(rsi_actual or 0):.2f}"
-                        logging.info(f"Precio actual (cierre últ. vela): {cur_price_float:.4f}. RSI: {rsi_display_str}")
-
-                        if not has_position: # LÓGICA DE ENTRADA (COMPRA NORMAL)
-                            condicion_pre_filtro_compra = False
-                            # ASEGÚRATE QUE ESTA ES TU CONDICIÓN DE PRE-FILTRO REAL
-                            if rsi_actual is not None and sma20_actual is not None and prev_data.get('SMA_20') is not None and prev_data.get('close') is not None:
-                                if float(rsi_actual) < 40 and float(prev_data['close']) < float(prev_data['SMA_20']) and cur_price_float > float(sma20_actual):
-                                     condicion_pre_filtro_compra = True
-                                     logging.info(f"PRE-FILTRO COMPRA ACTIVADO: RSI={float(rsi_actual):.2f}, Precio cruzó SMA20.")
-                            
-                            if condicion_pre_filtro_compra:
-                                logging.info("Consultando IA para confirmación de COMPRA...")
-                                klines_str_summary = formatear_klines_para_prompt(klines_df_indicado, 5)
-                                mkt_sum_ai = f"Actualmente no tengo una posición abierta en {SYMBOL_EXCHANGE}.\n"
-                                # ASEGÚRATE QUE FORZAR_SEÑAL_PARA_PRUEBA en get_ai_trading_signal es None
-                                ai_sig_final = get_ai_trading_signal(mkt_sum_ai, decimal.Decimal(str(cur_price_float)), rsi_actual, sma20_actual, sma50_actual, klines_str_summary)
-                                logging.info(f"Señal IA para entrada: {ai_sig_final}")
-                                db_data_this_cycle.update({"tipo_orden_ia": ai_sig_final, "respuesta_ia_completa": str(ai_sig_final)})
-                                
-                                if ai_sig_final == "BUY":
-                                    db_data_this_cycle["accion_bot"] = "INTENTO_COMPRA_IA"; logging.info(f"IA: COMPRAR {ORDER_AMOUNT_BASE} {BASE_ASSET}...")
-                                    precio_compra_limit = decimal.Decimal(str(cur_price_float)) * decimal.Decimal('0.999')
-                                    precio_compra_limit_formateado = format_price(si_data, precio_compra_limit)
-                                    order_res = place_order_on_binance(si_data, ORDER_AMOUNT_BASE, precio_compra_limit_formateado, "BUY", Client.ORDER_TYPE_LIMIT)
-                                    if order_res:
-                                        if order_res.get('status') == Client.ORDER_STATUS_FILLED:
-                                            has_position = True; entry_timestamp = datetime.now(); exec_qty = decimal.Decimal(order_res.get('executedQty','0')); cum_qt_qty = decimal.Decimal(order_res.get('cummulativeQuoteQty','0'))
-                                            last_buy_price = cum_qt_qty/exec_qty if exec_qty > 0 else decimal.Decimal(order_res.get('price',str(cur_price_float)))
-                                            logging.info(f"COMPRA LLENADA INMEDIATAMENTE (IA): {exec_qty} {BASE_ASSET} a ~{last_buy_price:.4f}. ID:{order_res.get('orderId')}")
-                                            db_data_this_cycle.update({"accion_bot":"COMPRA_EJECUTADA_IA", "precio_ejecutado":last_buy_price, "cantidad_base_ejecutada":exec_qty, "costo_total_usdt":cum_qt_qty, "orderid_abierta": str(order_res.get('orderId'))})
-                                        elif order_res.get('status') in [Client.ORDER_STATUS_NEW, Client.ORDER_STATUS_PARTIALLY_FILLED]:
-                                            open_order_details = {'orderId': order_res['orderId'], 'side': 'BUY', 'price': decimal.Decimal(order_res['price']), 'qty': decimal.Decimal(order_res['origQty']), 'timestamp': datetime.now()}
-                                            db_data_this_cycle.update({"accion_bot":"COMPRA_ORDEN_ABIERTA_IA", "orderid_abierta": str(order_res['orderId'])})
-                                        else: db_data_this_cycle.update({"accion_bot":"FALLO_COLOCAR_COMPRA_IA", "notas_adicionales":f"Resp: {order_res.get('status')}"})
-                                    else: db_data_this_cycle.update({"accion_bot":"FALLO_COMPRA_API_IA", "notas_adicionales":"place_order_on_binance devolvió None"})
-                                else: # IA no confirmó BUY
-                                    db_data_this_cycle["accion_bot"] = f"IA_NO_CONFIRMA_COMPRA ({ai_sig_final})"
-                                    logging.info(f"IA no confirma compra ({ai_sig_final}). Pre-filtro fue TRUE.")
-                            else: # Pre-filtro no se activó
-                                db_data_this_cycle["accion_bot"] = "PREFILTRO_NO_COMPRA"
-                                db_data_this_cycle["tipo_orden_ia"] = "N/A_PREFILTRO"
-
-                        elif has_position: # LÓGICA DE SALIDA (TP/SL NORMAL)
-                            db_data_this_cycle.update({"tipo_orden_ia": "N/A_REGLAS_SALIDA", "respuesta_ia_completa": "Salida por reglas TP/SL"})
-                            target_sell_price_tp = last_buy_price * (decimal.Decimal('1') + TARGET_PROFIT_PERCENT / decimal.Decimal('100'))
-                            target_sell_price_sl = last_buy_price * (decimal.Decimal('1') - STOP_LOSS_PERCENT / decimal.Decimal('100'))
-                            current_real_price_decimal = decimal.Decimal(str(cur_price_float))
-                            price_to_check_conditions = current_real_price_decimal # ASEGÚRATE QUE NO HAY FORZADO DE PRECIO AQUÍ
-                            logging.info(f"Posición abierta. Compra: {last_buy_price:.4f}. Actual: {price_to_check_conditions:.4f}. TP: {target_sell_price_tp:.4f}, SL: {target_sell_price_sl:.4f}")
-                            accion_salida = None; precio_salida_orden = None; tipo_salida = ""; orden_tipo_salida = None
-                            if price_to_check_conditions >= target_sell_price_tp:
-                                accion_salida = True; precio_salida_orden = target_sell_price_tp 
-                                tipo_salida = "TAKE_PROFIT"; orden_tipo_salida = Client.ORDER_TYPE_LIMIT
-                                logging.info(f"¡TAKE PROFIT ALCANZADO! Intentando vender con orden LIMIT a {precio_salida_orden:.4f}.")
-                            elif price_to_check_conditions <= target_sell_price_sl:
-                                accion_salida = True; precio_salida_orden = price_to_check_conditions # Usar precio actual para orden MARKET
-                                tipo_salida = "STOP_LOSS"; orden_tipo_salida = Client.ORDER_TYPE_MARKET
-                                logging.warning(f"¡STOP LOSS ALCANZADO! Intentando vender con orden MARKET.")
-                            if accion_salida:
-                                db_data_this_cycle["accion_bot"] = f"INTENTO_VENTA_{tipo_salida}"
-                                precio_orden_formateado = format_price(si_data, precio_salida_orden)
-                                current_base_balance = get_binance_asset_balance(BASE_ASSET); sell_qty = min(ORDER_AMOUNT_BASE, current_base_balance)
-                                if sell_qty <= decimal.Decimal('0'):
-                                    logging.warning(f"No hay {BASE_ASSET} para vender. Saldo: {current_base_balance}")
-                                    db_data_this_cycle.update({"accion_bot":f"FALLO_VENTA_{tipo_salida}_NO_SALDO"}); has_position = False; last_buy_price = decimal.Decimal('0.0'); entry_timestamp = None
-                                else:
-                                    order_res = place_order_on_binance(si_data, sell_qty, precio_orden_formateado, "SELL", order_type=orden_tipo_salida)
-                                    if order_res:
-                                        if order_res.get('status') == Client.ORDER_STATUS_FILLED:
-                                            exec_qty_s = decimal.Decimal(order_res.get('executedQty','0')); cum_qt_qty_s = decimal.Decimal(order_res.get('cummulativeQuoteQty','0'))
-                                            avg_s_price = cum_qt_qty_s/exec_qty_s if exec_qty_s > 0 else decimal.Decimal(order_res.get('price',str(cur_price_float)))
-                                            gn_ls_op = (avg_s_price-last_buy_price)*exec_qty_s if last_buy_price > 0 else decimal.Decimal('0.0')
-                                            logging.info(f"VENTA {tipo_salida} LLENADA: {exec_qty_s} {BASE_ASSET} a ~{avg_s_price:.4f}. G/P: {gn_ls_op:.4f}. ID:{order_res.get('orderId')}")
-                                            db_data_this_cycle.update({"accion_bot":f"VENTA_EJECUTADA_{tipo_salida}", "precio_ejecutado":avg_s_price, "cantidad_base_ejecutada":exec_qty_s, "costo_total_usdt":cum_qt_qty_s, "ganancia_perdida_operacion_usdt":gn_ls_op, "orderid_abierta": str(order_res.get('orderId'))})
-                                            has_position=False; last_buy_price=decimal.Decimal('0.0'); entry_timestamp = None
-                                        elif order_res.get('status') in [Client.ORDER_STATUS_NEW, Client.ORDER_STATUS_PARTIALLY_FILLED] and orden_tipo_salida == Client.ORDER_TYPE_LIMIT:
-                                            open_order_details = {'orderId': order_res['orderId'], 'side': 'SELL', 'price': decimal.Decimal(order_res['price']), 'qty': decimal.Decimal(order_res['origQty']), 'timestamp': datetime.now()}
-                                            db_data_this_cycle.update({"accion_bot":f"VENTA_ORDEN_ABIERTA_{tipo_salida}", "orderid_abierta": str(order_res['orderId'])})
-                                        else: db_data_this_cycle.update({"accion_bot":f"FALLO_COLOCAR_VENTA_{tipo_salida}", "notas_adicionales":f"Resp: {order_res.get('status')}"})
-                                    else: db_data_this_cycle.update({"accion_bot":f"FALLO_VENTA_API_{tipo_salida}", "notas_adicionales":"place_order_on_binance devolvió None"})
-                            else: # Ni TP ni SL
-                                if db_data_this_cycle.get("accion_bot") is None: db_data_this_cycle["accion_bot"] = "MANTENER_POSICION_ABIERTA"
-                                logging.info("Manteniendo posición. Ni TP ni SL alcanzados.")
-            
-            # --- Actualizar datos finales para BD y ESTADO DEL BOT ---
-            if db_data_this_cycle.get("accion_bot") is None and not open_order_details and not order_action_this_cycle and not forced_action_executed_this_cycle :
-                db_data_this_cycle["accion_bot"] = "CICLO_SIN_ACCION_NOTABLE" # Si no se hizo nada más
-
-            # Balances para el log y para el estado del bot
-            bal_base_desp_log = get_binance_asset_balance(BASE_ASSET)
-            bal_qt_desp_log = get_binance_asset_balance(QUOTE_ASSET)
-            db_data_this_cycle.update({
-                "tiene_posicion_despues": has_position, 
-                "precio_ultima_compra_despues": last_buy_price if has_position and last_buy_price > 0 else None,
-                "balance_base_despues": bal_base_desp_log, 
-                "balance_quote_despues": bal_qt_desp_log,
-                "orderid_abierta": str(open_order_details['orderId']) if open_order_details else db_data_this_cycle.get("orderid_abierta") # Mantener si ya se llenó una orden en este ciclo
-            })
-            for col in DB_COLUMN_ORDER: # Asegurar que todas las columnas para la BD tienen un valor
-                if col not in db_data_this_cycle: db_data_this_cycle[col] = None
-            log_to_db(db_data_this_cycle)
-
-            # --- GUARDAR ESTADO DEL BOT (se repite aquí para asegurar que se escribe después de todas las acciones del ciclo) ---
-            current_pnl_usdt_status = decimal.Decimal('0.0')
-            current_pnl_percent_status = decimal.Decimal('0.0')
-            time_in_position_str_status = "N/A"
-            tp_price_status = None
-            sl_price_status = None
-
-            if has_position and last_buy_price > 0:
-                cur_price_for_pnl_float_status = None
-                # Intenta usar el cur_price_float ya obtenido si está disponible en el scope del ciclo
-                if 'cur_price_float' in locals() and cur_price_float is not None:
-                    cur_price_for_pnl_float_status = cur_price_float
-                elif klines_df_indicado is not None and not klines_df_indicado.empty : # 'klines_df_indicado' debería estar disponible si se procesó la lógica normal
-                     cur_price_for_pnl_float_status = klines_df_indicado.iloc[-1]['close']
-                else: # Fallback si no hay klines procesados en este ciclo (ej. solo se gestionó orden abierta)
-                    temp_klines_pnl = obtener_klines_df(SYMBOL_EXCHANGE, Client.KLINE_INTERVAL_1MINUTE, 1)
-                    if temp_klines_pnl is not None and not temp_klines_pnl.empty:
-                        cur_price_for_pnl_float_status = temp_klines_pnl.iloc[-1]['close']
-                
-                if cur_price_for_pnl_float_status is not None:
-                    current_pnl_usdt_status = (decimal.Decimal(str(cur_price_for_pnl_float_status)) - last_buy_price) * ORDER_AMOUNT_BASE
-                    costo_compra_total_status = last_buy_price * ORDER_AMOUNT_BASE
-                    if costo_compra_total_status > 0 :
-                        current_pnl_percent_status = (current_pnl_usdt_status / costo_compra_total_status) * 100
-                
-                if entry_timestamp:
-                   time_in_pos = datetime.now() - entry_timestamp
-                   time_in_position_str_status = str(time_in_pos).split('.')[0]
-                
-                tp_price_status = float(last_buy_price * (1 + TARGET_PROFIT_PERCENT/100))
-                sl_price_status = float(last_buy_price * (1 - STOP_LOSS_PERCENT/100))
-
-            bot_status_data = {
-                "has_position": has_position,
-                "last_buy_price": float(last_buy_price) if last_buy_price > 0 else None,
-                "pnl_usdt": float(current_pnl_usdt_status),
-                "pnl_percent": float(current_pnl_percent_status),
-                "target_profit_price": tp_price_status,
-                "stop_loss_price": sl_price_status,
-                "time_in_position": time_in_position_str_status,
-                "open_order_id": open_order_details['orderId'] if open_order_details else None,
-                "base_asset_balance": float(bal_base_desp_log), # Usar los balances ya obtenidos para consistencia
-                "quote_asset_balance": float(bal_qt_desp_log),
-                "last_bot_action": db_data_this_cycle.get("accion_bot", "N/A"),
-                "timestamp": datetime.now().isoformat(),
-                "check_interval_seconds": CHECK_INTERVAL # <-- AÑADIR ESTO
-
-            }
-            try:
-                with open(BOT_STATUS_FILE, 'w') as f_s: json.dump(bot_status_data, f_s)
-                logging.debug(f"Estado del bot actualizado en {BOT_STATUS_FILE}")
-            except Exception as e_s: logging.error(f"Error escribiendo estado del bot: {e_s}")
-            # --- FIN GUARDAR ESTADO DEL BOT ---
-
-        except KeyboardInterrupt: logging.info("Bot detenido por el usuario."); break
-        except BinanceAPIException as bae:
-            logging.error(f"Error API Binance: {bae.status_code} - {bae.message}", exc_info=True)
-            db_err_data = {c:None for c in DB_COLUMN_ORDER}; db_err_data.update({"timestamp":datetime.now(),"accion_bot":"ERROR_BINANCE_API", "simbolo":SYMBOL_EXCHANGE,"notas_adicionales":f"{bae.status_code}-{bae.message}"[:200]})
-            log_to_db(db_err_data); time.sleep(CHECK_INTERVAL)
-        except Exception as e:
-            logging.error(f"Error catastrófico en ciclo principal: {e}", exc_info=True)
-            db_err_data = {c:None for c in DB_COLUMN_ORDER}; db_err_data.update({"timestamp":datetime.now(),"accion_bot":"ERROR_CATASTROFICO_CICLO", "simbolo":SYMBOL_EXCHANGE,"notas_adicionales":str(e)[:500]})
-            log_to_db(db_err_data); time.sleep(max(CHECK_INTERVAL, 120)) # Pausa más larga
+                                db_data_this_cycle["accion_bot"] = f"IA_NO_CONFIRMA_COMPRA{sufijo} ({resultado_ia})"
+                                logging.info(f"IA no confirma compra ({resultado_ia}).")
+
+                    elif not st.has_position and st.vela_decidida == vela_cerrada: # Entrada ya evaluada con estas velas cerradas
+                        logging.info("Sin vela cerrada nueva desde la última evaluación de entrada.")
+
+                    elif not st.has_position: # LÓGICA DE ENTRADA (COMPRA NORMAL)
+                        # Se evalúa sobre las dos últimas velas cerradas (como backtest.py), una sola vez por vela:
+                        # mientras no cierre otra, las entradas del pre-filtro no cambian.
+                        velas_indicadas = calcular_indicadores(velas_indicadas, st.symbol); st.vela_decidida = vela_cerrada
+                        cerrada = fila(velas_indicadas, -2); prev_data = fila(velas_indicadas, -3)
+                        rsi_actual = cerrada.get('RSI_14'); sma20_actual = cerrada.get('SMA_20'); sma50_actual = cerrada.get('SMA_50')
+                        logging.info(f"Vela cerrada {hora_utc(vela_cerrada)} UTC: cierre {cerrada['close']:.4f}, RSI {float(rsi_actual or 0):.2f}")
+                        condicion_pre_filtro_compra = False
+                        # ASEGÚRATE QUE ESTA ES TU CONDICIÓN DE PRE-FILTRO REAL
+                        if rsi_actual is not None and sma20_actual is not None and prev_data.get('SMA_20') is not None and prev_data.get('close') is not None:
+                            if estrategia.prefiltro_compra(float(rsi_actual), float(prev_data['close']), float(prev_data['SMA_20']), cerrada['close'], float(sma20_actual)):
+                                 condicion_pre_filtro_compra = True
+                                 logging.info(f"PRE-FILTRO COMPRA ACTIVADO: RSI={float(rsi_actual):.2f}, Precio cruzó SMA20.")
+                        
+                        if condicion_pre_filtro_compra:
+                            logging.info("Consultando IA para confirmación de COMPRA...")
+                            klines_str_summary = formatear_klines_para_prompt(velas_indicadas, 5)
+                            mkt_sum_ai = f"Actualmente no tengo una posición abierta en {st.symbol}.\n"
+                            # La respuesta se recoge en un ciclo posterior (el planificador lo adelanta al llegar)
+                            lanzar_consulta_ia(st, "NORMAL", vela_open_time, st.cur_price_float,
+                                               mkt_sum_ai, decimal.Decimal(str(st.cur_price_float)), rsi_actual, sma20_actual, sma50_actual, klines_str_summary,
+                                               st.symbol, st.base_asset, st.quote_asset)
+                            db_data_this_cycle.update({"accion_bot": "CONSULTA_IA_LANZADA", "tipo_orden_ia": "PENDIENTE"})
+                        else: # Pre-filtro no se activó
+                            db_data_this_cycle["accion_bot"] = "PREFILTRO_NO_COMPRA"
+                            db_data_this_cycle["tipo_orden_ia"] = "N/A_PREFILTRO"
+
+                    elif st.has_position: # LÓGICA DE SALIDA (TP/SL NORMAL)
+                        db_data_this_cycle.update({"tipo_orden_ia": "N/A_REGLAS_SALIDA", "respuesta_ia_completa": "Salida por reglas TP/SL"})
+                        target_sell_price_tp, target_sell_price_sl = estrategia.niveles_salida(st.last_buy_price, TARGET_PROFIT_PERCENT, STOP_LOSS_PERCENT)
+                        current_real_price_decimal = decimal.Decimal(str(st.cur_price_float))
+                        price_to_check_conditions = current_real_price_decimal # ASEGÚRATE QUE NO HAY FORZADO DE PRECIO AQUÍ
+                        logging.info(f"Posición abierta. Compra: {st.last_buy_price:.4f}. Actual: {price_to_check_conditions:.4f}. TP: {target_sell_price_tp:.4f}, SL: {target_sell_price_sl:.4f}")
+                        accion_salida = None; precio_salida_orden = None; tipo_salida = ""; orden_tipo_salida = None
+                        motivo = estrategia.motivo_salida(price_to_check_conditions, target_sell_price_tp, target_sell_price_sl)
+                        if motivo == "TAKE_PROFIT":
+                            accion_salida = True; precio_salida_orden = target_sell_price_tp 
+                            tipo_salida = "TAKE_PROFIT"; orden_tipo_salida = ORDER_TYPE_LIMIT
+                            logging.info(f"¡TAKE PROFIT ALCANZADO! Intentando vender con orden LIMIT a {precio_salida_orden:.4f}.")
+                        elif motivo == "STOP_LOSS":
+                            accion_salida = True; precio_salida_orden = price_to_check_conditions # Usar precio actual para orden MARKET
+                            tipo_salida = "STOP_LOSS"; orden_tipo_salida = ORDER_TYPE_MARKET
+                            logging.warning(f"¡STOP LOSS ALCANZADO! Intentando vender con orden MARKET.")
+                        if accion_salida:
+                            db_data_this_cycle["accion_bot"] = f"INTENTO_VENTA_{tipo_salida}"
+                            precio_orden_formateado = format_price(si_data, precio_salida_orden)
+                            current_base_balance = get_binance_asset_balance(st.base_asset); sell_qty = min(st.order_amount_base, current_base_balance)
+                            if sell_qty <= decimal.Decimal('0'):
+                                logging.warning(f"No hay {st.base_asset} para vender. Saldo: {current_base_balance}")
+                                db_data_this_cycle.update({"accion_bot":f"FALLO_VENTA_{tipo_salida}_NO_SALDO"}); st.has_position = False; st.last_buy_price = decimal.Decimal('0.0'); st.entry_timestamp = None
+                            else:
+                                order_res = place_order_on_binance(si_data, sell_qty, precio_orden_formateado, "SELL", order_type=orden_tipo_salida)
+                                if order_res:
+                                    if order_res.get('status') == ORDER_STATUS_FILLED:
+                                        exec_qty_s = decimal.Decimal(order_res.get('executedQty','0')); cum_qt_qty_s = decimal.Decimal(order_res.get('cummulativeQuoteQty','0'))
+                                        avg_s_price = cum_qt_qty_s/exec_qty_s if exec_qty_s > 0 else decimal.Decimal(order_res.get('price',str(st.cur_price_float)))
+                                        gn_ls_op = (avg_s_price-st.last_buy_price)*exec_qty_s if st.last_buy_price > 0 else decimal.Decimal('0.0')
+                                        logging.info(f"VENTA {tipo_salida} LLENADA: {exec_qty_s} {st.base_asset} a ~{avg_s_price:.4f}. G/P: {gn_ls_op:.4f}. ID:{order_res.get('orderId')}")
+                                        db_data_this_cycle.update({"accion_bot":f"VENTA_EJECUTADA_{tipo_salida}", "precio_ejecutado":avg_s_price, "cantidad_base_ejecutada":exec_qty_s, "costo_total_usdt":cum_qt_qty_s, "ganancia_perdida_operacion_usdt":gn_ls_op, "orderid_abierta": str(order_res.get('orderId'))})
+                                        st.has_position=False; st.last_buy_price=decimal.Decimal('0.0'); st.entry_timestamp = None
+                                    elif order_res.get('status') in [ORDER_STATUS_NEW, ORDER_STATUS_PARTIALLY_FILLED] and orden_tipo_salida == ORDER_TYPE_LIMIT:
+                                        st.open_order_details = {'orderId': order_res['orderId'], 'side': 'SELL', 'price': decimal.Decimal(order_res['price']), 'qty': decimal.Decimal(order_res['origQty']), 'timestamp': datetime.now()}
+                                        db_data_this_cycle.update({"accion_bot":f"VENTA_ORDEN_ABIERTA_{tipo_salida}", "orderid_abierta": str(order_res['orderId'])})
+                                    else: db_data_this_cycle.update({"accion_bot":f"FALLO_COLOCAR_VENTA_{tipo_salida}", "notas_adicionales":f"Resp: {order_res.get('status')}"})
+                                else: db_data_this_cycle.update({"accion_bot":f"FALLO_VENTA_API_{tipo_salida}", "notas_adicionales":"place_order_on_binance devolvió None"})
+                        else: # Ni TP ni SL
+                            if db_data_this_cycle.get("accion_bot") is None: db_data_this_cycle["accion_bot"] = "MANTENER_POSICION_ABIERTA"
+                            logging.info("Manteniendo posición. Ni TP ni SL alcanzados.")
         
-        logging.info(f"--- Fin de Ciclo --- Esperando {CHECK_INTERVAL} segundos...")
-        time.sleep(CHECK_INTERVAL)
+        # --- Actualizar datos finales para BD y ESTADO DEL BOT ---
+        if db_data_this_cycle.get("accion_bot") is None and not st.open_order_details and not order_action_this_cycle and not forced_action_executed_this_cycle :
+            db_data_this_cycle["accion_bot"] = "CICLO_SIN_ACCION_NOTABLE" # Si no se hizo nada más
+
+        # Balances para el log y para el estado del bot
+        bal_base_desp_log = get_binance_asset_balance(st.base_asset)
+        bal_qt_desp_log = get_binance_asset_balance(st.quote_asset)
+        db_data_this_cycle.update({
+            "tiene_posicion_despues": st.has_position, 
+            "precio_ultima_compra_despues": st.last_buy_price if st.has_position and st.last_buy_price > 0 else None,
+            "balance_base_despues": bal_base_desp_log, 
+            "balance_quote_despues": bal_qt_desp_log,
+            "orderid_abierta": str(st.open_order_details['orderId']) if st.open_order_details else db_data_this_cycle.get("orderid_abierta") # Mantener si ya se llenó una orden en este ciclo
+        })
+        for col in DB_COLUMN_ORDER: # Asegurar que todas las columnas para la BD tienen un valor
+            if col not in db_data_this_cycle: db_data_this_cycle[col] = None
+        log_to_db(db_data_this_cycle)
+
+        # --- GUARDAR ESTADO DEL BOT (se repite aquí para asegurar que se escribe después de todas las acciones del ciclo) ---
+        bot_status_data = construir_estado_bot(st, velas_indicadas, bal_base_desp_log, bal_qt_desp_log, db_data_this_cycle.get("accion_bot"))
+        if st.principal: bot_status_data["metrics"] = exportar_metricas() # Una sola copia (las métricas son de todo el proceso)
+        try:
+            with metricas.medir("ciclo_fase_segundos", fase="estado"):
+                if ipc_server: ipc_server.publish_status(st.symbol, st.principal, bot_status_data)
+                escribir_json_atomico(st.bot_status_file, bot_status_data)
+            logging.debug(f"Estado del bot actualizado en {st.bot_status_file}")
+        except Exception as e_s: logging.error(f"Error escribiendo estado del bot: {e_s}")
+        # --- FIN GUARDAR ESTADO DEL BOT ---
+
+    except LimiteBinanceExcedido as le:
+        # Solo este símbolo espera lo que pide Binance; el resto del bot sigue a ritmo del limitador
+        logging.warning(f"{le}. Ciclo de {st.symbol} aplazado.")
+        return max(le.espera, 1)
+    except BinanceAPIException as bae:
+        logging.error(f"Error API Binance: {bae.status_code} - {bae.message}", exc_info=True)
+        db_err_data = {c:None for c in DB_COLUMN_ORDER}; db_err_data.update({"timestamp":datetime.now(),"accion_bot":"ERROR_BINANCE_API", "simbolo":st.symbol,"notas_adicionales":f"{bae.status_code}-{bae.message}"[:200]})
+        log_to_db(db_err_data); return CHECK_INTERVAL
+    except Exception as e:
+        logging.error(f"Error catastrófico en ciclo principal: {e}", exc_info=True)
+        db_err_data = {c:None for c in DB_COLUMN_ORDER}; db_err_data.update({"timestamp":datetime.now(),"accion_bot":"ERROR_CATASTROFICO_CICLO", "simbolo":st.symbol,"notas_adicionales":str(e)[:500]})
+        log_to_db(db_err_data); return max(CHECK_INTERVAL, 120) # Pausa más larga
+    return 0
+
+# --- Modo WebSocket: klines por stream y ciclos disparados por eventos ---
+def aplicar_kline_stream(symbol, interval, k):
+    # Vuelca un evento 'kline' del stream en la caché con el mismo formato que las filas REST.
+    # Devuelve False si hay un hueco respecto a la caché (hace falta resincronizar por REST).
+    key = (symbol, interval)
+    with kline_cache_locks.setdefault(key, threading.Lock()):
+        buf = kline_cache.get(key)
+        if not buf: return False
+        fila = [k['t'], k['o'], k['h'], k['l'], k['c'], k['v'], k['T'], k['q'], k['n'], k['V'], k['Q'], k.get('B', '0')]
+        if fila[0] == buf[-1][0]: buf[-1] = fila
+        elif fila[0] > buf[-1][0]:
+            if fila[0] > buf[-1][6] + 1: return False
+            buf.append(fila)
+            if len(buf) > KLINE_CACHE_MAX_SIZE: del buf[:-KLINE_CACHE_MAX_SIZE]
+        return True
+
+def resincronizar_kline_cache(key):
+    kline_stream_keys.discard(key); actualizar_kline_cache(*key); kline_stream_keys.add(key)
+
+def motivo_ciclo_por_evento(st, k):
+    # Decide si un evento del stream justifica ejecutar ya el pipeline de decisión del símbolo.
+    if k.get('x'): return "CIERRE_VELA"
+    precio = decimal.Decimal(str(k['c']))
+    if st.has_position and st.last_buy_price > 0:
+        motivo = estrategia.motivo_salida(precio, *estrategia.niveles_salida(st.last_buy_price, TARGET_PROFIT_PERCENT, STOP_LOSS_PERCENT))
+        if motivo: return "TP_ALCANZADO" if motivo == "TAKE_PROFIT" else "SL_ALCANZADO"
+    if st.precio_ultimo_ciclo and abs(precio - st.precio_ultimo_ciclo) / st.precio_ultimo_ciclo * 100 >= decimal.Decimal(str(WS_PRICE_MOVE_PERCENT)):
+        return "MOVIMIENTO_PRECIO"
+    return None
+
+def run_ws_kline_listener(despertar):
+    # Hilo: un único stream combinado mantiene al día la caché de todos los símbolos y marca los ciclos por evento.
+    from websockets.sync.client import connect
+    keys = {sym: (sym, KLINE_INTERVAL_FOR_INDICATORS) for sym in symbol_states}
+    streams = "/".join(f"{sym.lower()}@kline_{KLINE_INTERVAL_FOR_INDICATORS}" for sym in symbol_states)
+    url = f"{WS_BASE_URL.rstrip('/')}/stream?streams={streams}"
+    espera_reconexion = 1
+    while True:
+        try:
+            with connect(url, open_timeout=10, close_timeout=2) as ws:
+                logging.info(f"Stream de klines conectado ({len(keys)} símbolos): {url}")
+                for key in keys.values(): resincronizar_kline_cache(key) # Lo perdido mientras no había conexión
+                espera_reconexion = 1
+                while True:
+                    try: msg = json.loads(ws.recv(timeout=WS_STALE_SECONDS))
+                    except TimeoutError: raise ConnectionError(f"Sin mensajes del stream en {WS_STALE_SECONDS}s")
+                    data = msg.get('data', msg) # Stream combinado ({"stream", "data"}) o crudo
+                    st = symbol_states.get(data.get('s')) if data.get('e') == 'kline' else None
+                    if not st: continue
+                    k = data['k']; key = keys[st.symbol]; motivo = None
+                    if not aplicar_kline_stream(*key, k):
+                        logging.warning(f"Hueco en el stream de klines de {st.symbol}. Resincronizando por REST...")
+                        resincronizar_kline_cache(key); aplicar_kline_stream(*key, k); motivo = "RESINCRONIZACION"
+                    motivo = motivo_ciclo_por_evento(st, k) or motivo
+                    if motivo and st.motivo_evento is None: st.motivo_evento = motivo; despertar.set()
+        except Exception as e:
+            for key in keys.values(): kline_stream_keys.discard(key)
+            logging.error(f"Stream de klines desconectado ({e}). Reintentando en {espera_reconexion}s...")
+            time.sleep(espera_reconexion); espera_reconexion = min(espera_reconexion * 2, WS_RECONNECT_MAX_DELAY)
+
+def run_user_data_stream():
+    # Hilo: fills de nuestras órdenes y cambios de saldo. Mientras está conectado no hace falta preguntar por REST.
+    from websockets.sync.client import connect
+    espera_reconexion = 1
+    while True:
+        listen_key = None
+        try:
+            if USER_STREAM_URL: url = USER_STREAM_URL
+            else: listen_key = binance_client.stream_get_listen_key(); url = f"{WS_BASE_URL.rstrip('/')}/ws/{listen_key}"
+            with connect(url, open_timeout=10, close_timeout=2) as ws:
+                logging.info("User-data stream conectado.")
+                order_tracker.stream_activo = True; account_snapshot.marcar_stream(True)
+                order_tracker.reconciliar(lambda: binance_client.get_open_orders(), lambda sym, oid: binance_client.get_order(symbol=sym, orderId=oid),
+                                          forzar=True) # Lo ocurrido mientras no había conexión
+                espera_reconexion = 1; ultimo_keepalive = time.time()
+                while True:
+                    if listen_key and time.time() - ultimo_keepalive > USER_STREAM_KEEPALIVE_SECONDS:
+                        binance_client.stream_keepalive(listen_key); ultimo_keepalive = time.time()
+                    try: msg = json.loads(ws.recv(timeout=60))
+                    except TimeoutError: continue # Sin órdenes el stream calla; los pings del websocket vigilan la conexión
+                    tipo = msg.get('e')
+                    if tipo == 'executionReport': order_tracker.aplicar_execution_report(msg)
+                    elif tipo == 'outboundAccountPosition': account_snapshot.aplicar_outbound_account_position(msg)
+                    elif tipo == 'listenKeyExpired': raise ConnectionError("listenKey caducada")
+        except Exception as e:
+            order_tracker.stream_activo = False; account_snapshot.marcar_stream(False)
+            logging.error(f"User-data stream desconectado ({e}). Reintentando en {espera_reconexion}s...")
+            time.sleep(espera_reconexion); espera_reconexion = min(espera_reconexion * 2, WS_RECONNECT_MAX_DELAY)
+
+# --- Planificador multi-símbolo ---
+def proximo_en_rejilla(periodo, desde=None):
+    # Primer instante posterior a desde (time.time() local) de la rejilla k * periodo + CANDLE_CLOSE_DELAY_SECONDS
+    # del reloj de Binance. Con periodo = duración de la vela, el primero tras el próximo cierre.
+    ms = int(periodo * 1000); margen = int(CANDLE_CLOSE_DELAY_SECONDS * 1000)
+    servidor = int((time.time() if desde is None else desde) * 1000) + server_time_offset
+    return (((servidor - margen) // ms + 1) * ms + margen - server_time_offset) / 1000
+
+def tick_precio(st):
+    # Tick entre cierres de vela: precio en vivo contra TP/SL y gráfico, sin indicadores, saldos, BD ni estado.
+    # Devuelve el motivo para adelantar el ciclo completo, o None si no hay nada que hacer.
+    velas = obtener_velas(st.symbol, KLINE_INTERVAL_FOR_INDICATORS, KLINE_LIMIT_FOR_CHART)
+    if velas is None or len(velas) < 2: return "SIN_VELAS" # El ciclo completo registra el error
+    st.cur_price_float = float(velas['close'][-1]); publicar_grafico(st, velas)
+    if not st.has_position: # Vela cerrada aún sin evaluar (p. ej. Binance la sirvió tarde al despertar tras el cierre)
+        return "VELA_CERRADA_SIN_EVALUAR" if int(velas['open_time'][-2]) != st.vela_decidida else None
+    if st.last_buy_price <= 0: return None
+    motivo = estrategia.motivo_salida(decimal.Decimal(str(st.cur_price_float)), *estrategia.niveles_salida(st.last_buy_price, TARGET_PROFIT_PERCENT, STOP_LOSS_PERCENT))
+    return ("TP_ALCANZADO" if motivo == "TAKE_PROFIT" else "SL_ALCANZADO") if motivo else None
+
+def _ciclo_simbolo(st, despertar):
+    threading.current_thread().name = st.symbol # Aparece en cada línea de log del ciclo
+    motivo = st.motivo_evento; st.motivo_evento = None
+    if motivo: logging.info(f"Ciclo disparado por evento: {motivo}")
+    completo = motivo is not None or time.time() >= st.proxima_vela or st.necesita_ciclo_completo()
+    t0 = time.monotonic(); perfilado = perfilador.inicio_ciclo(st.symbol); pausa_error = 0 # Los ticks también cuentan como ciclos perfilados
+    try:
+        if not completo:
+            motivo = tick_precio(st)
+            if motivo: logging.info(f"Tick: {motivo}. Ciclo completo."); completo = True
+        if completo: pausa_error = ejecutar_ciclo(st)
+    except Exception as e: logging.critical(f"Error no controlado en el ciclo de {st.symbol}: {e}", exc_info=True); pausa_error = max(CHECK_INTERVAL, 120)
+    finally: perfilador.fin_ciclo(perfilado)
+    if completo:
+        metricas.observar("ciclo_segundos", time.monotonic() - t0, symbol=st.symbol)
+        metricas.incrementar("ciclos_total", symbol=st.symbol, resultado="error" if pausa_error else "ok")
+    else: metricas.incrementar("ticks_total", symbol=st.symbol)
+    ahora = time.time()
+    st.pausa_hasta = ahora + pausa_error; st.proximo_ciclo = proximo_en_rejilla(CHECK_INTERVAL, st.pausa_hasta)
+    if pausa_error: st.proxima_vela = st.proximo_ciclo # Lo que falló se reintenta completo
+    elif completo: st.proxima_vela = proximo_en_rejilla(INTERVALOS_MS[KLINE_INTERVAL_FOR_INDICATORS] / 1000, ahora)
+    consulta = st.consulta_ia
+    if consulta is not None and not pausa_error: # Revisar al vencer el plazo aunque la IA no conteste
+        st.proximo_ciclo = min(st.proximo_ciclo, consulta["inicio"] + AI_DEADLINE_SECONDS)
+    buf = kline_cache.get((st.symbol, KLINE_INTERVAL_FOR_INDICATORS))
+    if completo: st.precio_ultimo_ciclo = decimal.Decimal(str(buf[-1][4])) if buf else None # Referencia de MOVIMIENTO_PRECIO
+    despertar.set()
+
+def run_scheduler():
+    # Un solo proceso para todos los pares: cada símbolo tiene como mucho un ciclo en curso en el pool compartido,
+    # así que uno lento (IA, red) no retrasa a los demás.
+    despertar = despertar_planificador; en_curso = {}
+    pool = ThreadPoolExecutor(max_workers=min(MAX_SYMBOL_WORKERS, len(symbol_states)), thread_name_prefix="ciclo")
+    if USE_WEBSOCKET_MODE:
+        logging.info("Modo WebSocket activo: los ciclos se disparan por eventos del stream de klines.")
+        threading.Thread(target=run_ws_kline_listener, args=(despertar,), name="ws-klines", daemon=True).start()
+    if USE_USER_DATA_STREAM: threading.Thread(target=run_user_data_stream, name="user-stream", daemon=True).start()
+    try:
+        while True:
+            check_for_web_command()
+            ahora = time.time()
+            for st in symbol_states.values():
+                fut = en_curso.get(st.symbol)
+                if fut is not None and not fut.done(): continue
+                if st.debe_ejecutar(ahora): en_curso[st.symbol] = pool.submit(_ciclo_simbolo, st, despertar)
+            despertar.wait(timeout=1.0); despertar.clear()
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+# --- Arranque ---
+class InformeArranque:
+    # Tiempos por fase del arranque, para vigilar que un reinicio siga por debajo del segundo
+    def __init__(self):
+        self.fases = [("import del módulo", _DURACION_IMPORT)]
+
+    @contextmanager
+    def fase(self, nombre):
+        t0 = time.perf_counter()
+        try: yield
+        finally: self.fases.append((nombre, time.perf_counter() - t0))
+
+    def registrar(self):
+        total = sum(d for _, d in self.fases)
+        logging.info(f"Arranque en {total * 1000:.0f} ms: " + ", ".join(f"{n} {d * 1000:.0f} ms" for n, d in self.fases))
+
+def inicializar_binance(informe=None):
+    # Crea el cliente y mide el desfase horario. Devuelve False (sin salir del proceso) si no hay claves o conexión.
+    global binance_client, server_time_offset, BinanceAPIException, BinanceOrderException
+    informe = informe or InformeArranque()
+    if binance_client is not None: return True
+    logging.info(f"--- USANDO BINANCE {'TESTNET' if USE_TESTNET else 'PRODUCCIÓN'} ---")
+    if not BINANCE_API_KEY or not BINANCE_API_SECRET: logging.error("Claves API Binance no encontradas."); return False
+    with informe.fase("import python-binance"):
+        from binance.client import Client
+        from binance.exceptions import BinanceAPIException, BinanceOrderException
+    try:
+        with informe.fase("cliente y hora del servidor"):
+            # Client() ya hace un ping; get_server_time confirma la conexión y da el desfase en la misma ida y vuelta
+            cliente = ClienteLimitado(Client(BINANCE_API_KEY, BINANCE_API_SECRET, testnet=USE_TESTNET), limitador_binance, al_llamar=_metrica_peticion_binance)
+            server_time_offset = int(cliente.get_server_time()['serverTime']) - int(time.time() * 1000)
+    except Exception as e: logging.error(f"Error conectando a Binance: {e}"); return False
+    binance_client = cliente
+    logging.info(f"Conexión a Binance {'Testnet' if USE_TESTNET else 'Producción'} OK. Desfase horario: {server_time_offset} ms")
+    return True
+
+_ia_lock = threading.Lock(); _ia_inicializada = False
+
+def inicializar_ia():
+    # Idempotente; la primera llamada importa google.generativeai (~1.5 s) y crea el modelo
+    global model_ai, _ia_inicializada
+    with _ia_lock:
+        if _ia_inicializada: return model_ai
+        if GOOGLE_AI_API_KEY:
+            t0 = time.perf_counter()
+            try:
+                import google.generativeai as genai
+                genai.configure(api_key=GOOGLE_AI_API_KEY)
+                model_ai = genai.GenerativeModel(AI_MODEL_NAME)
+                logging.info(f"Modelo IA Gemini '{AI_MODEL_NAME}' cargado en {(time.perf_counter() - t0) * 1000:.0f} ms.")
+            except Exception as e: logging.error(f"Error cargando modelo IA '{AI_MODEL_NAME}': {e}")
+        else: logging.warning("GOOGLE_AI_API_KEY no encontrada. IA usará simulación.")
+        _ia_inicializada = True
+        return model_ai
+
+def run_ai_trading_bot():
+    informe = InformeArranque()
+    if not inicializar_binance(informe): logging.error("Sin conexión a Binance. Saliendo."); return
+    threading.Thread(target=inicializar_ia, name="init-ia", daemon=True).start() # En paralelo con el resto del arranque
+    with informe.fase("tabla de BD"): initialize_db_table()
+    simbolos_config = parse_symbols_config(SYMBOLS_CONFIG)
+    with informe.fase("exchange info"):
+        precargar_symbol_info([symbol for symbol, _ in simbolos_config])
+        for symbol, amount in simbolos_config:
+            si_data = get_binance_symbol_info(symbol)
+            if not si_data: logging.error(f"No info para {symbol}. Se omite."); continue
+            symbol_states[symbol] = SymbolState(symbol, si_data, amount, principal=not symbol_states)
+    if not symbol_states: logging.error("Ningún símbolo operable. Saliendo."); return
+    dimensionar_pool_ia()
+    logging.info(f"Iniciando AI Trading Bot para {', '.join(symbol_states)} (ciclo completo al cierre de cada vela de {KLINE_INTERVAL_FOR_INDICATORS}, ticks cada {CHECK_INTERVAL}s)...")
+    with informe.fase("canal IPC"): iniciar_canal_ipc()
+    informe.registrar()
+    try: run_scheduler()
+    except KeyboardInterrupt: logging.info("Bot detenido por el usuario.")
+    finally:
+        ai_executor.shutdown(wait=False, cancel_futures=True) # Una consulta colgada no retrasa la salida más que su timeout
+        detener_db_writer() # Vacía la cola de filas antes de salir
+        if ipc_server: ipc_server.close()
+
+_DURACION_IMPORT = time.perf_counter() - _T0_IMPORT
+
+def _sigterm_handler(signum, frame):
+    raise KeyboardInterrupt # Misma salida ordenada que Ctrl+C (vacía la cola de BD)
+
+def _sigusr1_handler(signum, frame):
+    ok, msg = perfilador.iniciar(PROFILE_CICLOS_POR_DEFECTO); logging.info(f"SIGUSR1: {msg}") # kill -USR1 <pid>
 
 if __name__ == "__main__":
+    signal.signal(signal.SIGTERM, _sigterm_handler)
+    if hasattr(signal, "SIGUSR1"): signal.signal(signal.SIGUSR1, _sigusr1_handler)
     if not DATABASE_URL: logging.warning("DATABASE_URL no configurada.")
     if not GOOGLE_AI_API_KEY: logging.warning("GOOGLE_AI_API_KEY no configurada. IA usará simulación.")
     api_keys_ok = True
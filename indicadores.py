@@ -0,0 +1,98 @@
+# --- START OF FILE indicadores.py ---
+
+# Indicadores incrementales para el bucle principal: RSI (media de Wilder) y SMAs.
+# Cada vela cerrada se incorpora una sola vez; los ticks de la vela abierta solo recalculan
+# el último valor a partir del estado cerrado, así que cada actualización es O(1).
+# Los valores coinciden con los de pandas_ta (rsi = rma ajustada con alpha=1/length, sma = media móvil).
+
+import math
+from collections import deque
+
+import numpy as np
+
+RSI_LENGTH = 14
+SMA_LENGTHS = (20, 50)
+RESYNC_SUMAS_CADA = 1000 # Velas cerradas entre recálculos exactos de las sumas (evita deriva de coma flotante)
+
+class EstadoIndicadores:
+    def __init__(self, rsi_length=RSI_LENGTH, sma_lengths=SMA_LENGTHS):
+        self.rsi_length = rsi_length
+        self.sma_lengths = tuple(sma_lengths)
+        self.beta = 1.0 - 1.0 / rsi_length
+        self.cierres = deque(maxlen=max(self.sma_lengths)) # Cierres de velas ya cerradas
+        self.sumas = {n: 0.0 for n in self.sma_lengths} # Suma de los últimos n-1 cierres cerrados por cada SMA
+        self.rsi_pos = 0.0; self.rsi_neg = 0.0; self.rsi_n = 0 # Sumas EWM (sin normalizar) de subidas/bajadas y nº de diferencias
+        self.velas_cerradas = 0
+        self.open_time = None # Open time (ms) de la vela abierta
+        self.close_abierta = None
+        self.previo = None # Valores de la última vela cerrada
+        self.anterior = None # Valores de la penúltima vela cerrada (el pre-filtro compara las dos últimas cerradas)
+
+    def actualizar(self, open_time, close):
+        close = float(close)
+        if self.open_time is None or open_time == self.open_time:
+            self.open_time = open_time; self.close_abierta = close
+        elif open_time > self.open_time:
+            self._cerrar_vela()
+            self.open_time = open_time; self.close_abierta = close
+        return self
+
+    def _cerrar_vela(self):
+        self.anterior = self.previo; self.previo = self.valores()
+        c = self.close_abierta
+        if self.cierres:
+            d = c - self.cierres[-1]
+            self.rsi_pos = max(d, 0.0) + self.beta * self.rsi_pos
+            self.rsi_neg = max(-d, 0.0) + self.beta * self.rsi_neg
+            self.rsi_n += 1
+        for n in self.sma_lengths:
+            if n <= 1: continue
+            self.sumas[n] += c
+            if len(self.cierres) >= n - 1: self.sumas[n] -= self.cierres[-(n - 1)]
+        self.cierres.append(c); self.velas_cerradas += 1
+        if self.velas_cerradas % RESYNC_SUMAS_CADA == 0:
+            ultimos = list(self.cierres)
+            for n in self.sma_lengths: self.sumas[n] = math.fsum(ultimos[-(n - 1):]) if n > 1 else 0.0
+
+    def valores(self):
+        c = self.close_abierta
+        res = {"close": c, f"RSI_{self.rsi_length}": None}
+        for n in self.sma_lengths:
+            res[f"SMA_{n}"] = (self.sumas[n] + c) / n if c is not None and len(self.cierres) >= n - 1 else None
+        if c is not None and self.cierres and self.rsi_n + 1 >= self.rsi_length:
+            d = c - self.cierres[-1]
+            pos = max(d, 0.0) + self.beta * self.rsi_pos
+            neg = max(-d, 0.0) + self.beta * self.rsi_neg
+            if pos + neg > 0: res[f"RSI_{self.rsi_length}"] = 100.0 * pos / (pos + neg)
+        return res
+
+# --- Versiones vectorizadas (backtest): mismos valores que EstadoIndicadores vela a vela, con NaN donde aquél da None ---
+def _ewm_suma(x, beta, bloque=128):
+    # y[t] = x[t] + beta * y[t-1] por bloques: dentro de cada bloque es un cumsum escalado (beta^-j no desborda
+    # con bloques cortos) y solo el arrastre entre bloques es secuencial.
+    n = len(x); nb = -(-n // bloque)
+    xb = np.zeros(nb * bloque); xb[:n] = x; xb = xb.reshape(nb, bloque)
+    pot = beta ** np.arange(bloque)
+    dentro = np.cumsum(xb / pot, axis=1) * pot # Suma EWM sin el arrastre de bloques anteriores
+    arrastre = np.zeros(nb); beta_b = beta ** bloque
+    for b in range(1, nb): arrastre[b] = beta_b * arrastre[b - 1] + dentro[b - 1, -1]
+    return (dentro + arrastre[:, None] * (beta * pot)).ravel()[:n]
+
+def rsi_vectorizado(close, length=RSI_LENGTH):
+    close = np.asarray(close, dtype=float)
+    d = np.diff(close, prepend=np.nan)[1:]
+    beta = 1.0 - 1.0 / length
+    pos = _ewm_suma(np.maximum(d, 0.0), beta); neg = _ewm_suma(np.maximum(-d, 0.0), beta)
+    total = pos + neg
+    with np.errstate(invalid="ignore", divide="ignore"): rsi = np.where(total > 0, 100.0 * pos / total, np.nan)
+    out = np.full(len(close), np.nan); out[1:] = rsi
+    out[:length] = np.nan # Igual que min_periods=length
+    return out
+
+def sma_vectorizada(close, n):
+    close = np.asarray(close, dtype=float)
+    out = np.full(len(close), np.nan)
+    if len(close) < n: return out
+    c = np.concatenate(([0.0], np.cumsum(close)))
+    out[n - 1:] = (c[n:] - c[:-n]) / n
+    return out
@@ -0,0 +1,166 @@
+# --- START OF FILE limites_binance.py ---
+
+# Capa por la que pasan todas las peticiones REST a Binance. Lleva un token bucket por tipo de límite
+# (REQUEST_WEIGHT por minuto, ORDERS por 10 s y por día, RAW_REQUESTS), se corrige con las cabeceras
+# X-MBX-USED-WEIGHT-* / X-MBX-ORDER-COUNT-* de cada respuesta y da prioridad a la gestión de órdenes:
+# los datos de mercado esperan si hay una orden en cola y no consumen la reserva. Un 429 frena todas las
+# peticiones el tiempo que indica Retry-After y la llamada se reintenta; un 418 (IP bloqueada) se propaga.
+
+import logging
+import re
+import threading
+import time
+
+# Límites por defecto de Binance Spot; se sustituyen por los rateLimits de la exchange info cuando se descarga
+LIMITES_POR_DEFECTO = [
+    {"rateLimitType": "REQUEST_WEIGHT", "interval": "MINUTE", "intervalNum": 1, "limit": 6000},
+    {"rateLimitType": "ORDERS", "interval": "SECOND", "intervalNum": 10, "limit": 100},
+    {"rateLimitType": "ORDERS", "interval": "DAY", "intervalNum": 1, "limit": 200000},
+    {"rateLimitType": "RAW_REQUESTS", "interval": "MINUTE", "intervalNum": 5, "limit": 61000},
+]
+SEGUNDOS_INTERVALO = {"SECOND": 1, "MINUTE": 60, "HOUR": 3600, "DAY": 86400}
+# Peso de cada método del cliente (documentación de la API Spot); el resto cuenta 1
+PESOS = {
+    "get_klines": 2, "get_historical_klines": 2, "get_account": 20, "get_asset_balance": 20, "get_order": 4,
+    "get_open_orders": lambda kw: 6 if kw.get("symbol") else 80, "get_all_orders": 20, "get_my_trades": 20,
+    "get_exchange_info": 20, "get_symbol_info": 20, "get_symbol_ticker": lambda kw: 2 if kw.get("symbol") else 4, "get_server_time": 1, "ping": 1,
+    "create_order": 1, "cancel_order": 1, "stream_get_listen_key": 2, "stream_keepalive": 2,
+}
+METODOS_ORDEN = {"create_order", "order_limit_buy", "order_limit_sell", "order_market_buy", "order_market_sell"} # Consumen ORDERS
+METODOS_PRIORITARIOS = METODOS_ORDEN | {"cancel_order", "get_order", "get_open_orders"}
+RESERVA_PRIORITARIA = 0.1 # Fracción de cada cubeta que los datos de mercado no pueden gastar
+MAX_ESPERA_SEGUNDOS = 30 # Más espera que esto y la petición falla con LimiteBinanceExcedido
+REINTENTOS_429 = 3
+_CABECERA = re.compile(r"x-mbx-(used-weight|order-count)-(\d+)([smhd])$")
+_UNIDADES = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+
+class LimiteBinanceExcedido(Exception):
+    def __init__(self, espera, mensaje=None):
+        super().__init__(mensaje or f"Límite de peticiones de Binance: reintentar en {espera:.1f}s")
+        self.espera = espera
+
+class Cubeta:
+    def __init__(self, limite, ventana):
+        self.limite = limite; self.ventana = ventana; self.tasa = limite / ventana
+        self.tokens = float(limite); self.actualizado = time.monotonic(); self.usado_servidor = None
+
+    def _rellenar(self, ahora):
+        self.tokens = min(self.limite, self.tokens + (ahora - self.actualizado) * self.tasa); self.actualizado = ahora
+
+    def espera(self, coste, reserva, ahora):
+        self._rellenar(ahora)
+        falta = coste + reserva * self.limite - self.tokens
+        return falta / self.tasa if falta > 0 else 0.0
+
+    def consumir(self, coste):
+        self.tokens -= coste
+
+    def sincronizar(self, usado, ahora):
+        # El servidor cuenta también lo que gastan otros procesos con la misma IP/cuenta: solo puede bajar tokens
+        self._rellenar(ahora); self.usado_servidor = usado
+        self.tokens = min(self.tokens, self.limite - usado)
+
+class LimitadorBinance:
+    def __init__(self, limites=None):
+        self.cond = threading.Condition(); self.cubetas = {} # (tipo, segundos) -> Cubeta
+        self.prioritarias_esperando = 0; self.bloqueado_hasta = 0.0
+        self.esperas = 0; self.segundos_esperados = 0.0; self.respuestas_429 = 0
+        self.configurar(limites or LIMITES_POR_DEFECTO)
+
+    def configurar(self, limites):
+        with self.cond:
+            nuevas = {}
+            for l in limites:
+                clave = (l["rateLimitType"], SEGUNDOS_INTERVALO.get(l["interval"], 60) * l.get("intervalNum", 1))
+                cubeta = Cubeta(l["limit"], clave[1]); previa = self.cubetas.get(clave)
+                if previa: cubeta.tokens = min(previa.tokens, cubeta.limite)
+                nuevas[clave] = cubeta
+            self.cubetas = nuevas
+
+    def _costes(self, peso, orden):
+        for (tipo, _), cubeta in self.cubetas.items():
+            coste = peso if tipo == "REQUEST_WEIGHT" else (1 if tipo == "RAW_REQUESTS" or orden else 0)
+            if coste: yield cubeta, coste
+
+    def adquirir(self, peso, orden=False, prioritaria=False, max_espera=MAX_ESPERA_SEGUNDOS):
+        with self.cond:
+            if prioritaria: self.prioritarias_esperando += 1
+            inicio = time.monotonic(); esperado = False
+            try:
+                while True:
+                    ahora = time.monotonic()
+                    espera = max([self.bloqueado_hasta - ahora] + [c.espera(coste, 0 if prioritaria else RESERVA_PRIORITARIA, ahora) for c, coste in self._costes(peso, orden)])
+                    if espera <= 0 and not prioritaria and self.prioritarias_esperando: espera = 0.05 # Cede el turno a las órdenes
+                    if espera <= 0:
+                        for c, coste in self._costes(peso, orden): c.consumir(coste)
+                        if esperado: self.esperas += 1; self.segundos_esperados += ahora - inicio
+                        return
+                    if ahora - inicio + espera > max_espera: raise LimiteBinanceExcedido(espera)
+                    esperado = True; self.cond.wait(min(espera, 1.0))
+            finally:
+                if prioritaria: self.prioritarias_esperando -= 1; self.cond.notify_all()
+
+    def registrar_cabeceras(self, cabeceras):
+        ahora = time.monotonic()
+        with self.cond:
+            for nombre, valor in cabeceras.items():
+                m = _CABECERA.match(nombre.lower())
+                if not m: continue
+                tipo = "REQUEST_WEIGHT" if m.group(1) == "used-weight" else "ORDERS"
+                cubeta = self.cubetas.get((tipo, int(m.group(2)) * _UNIDADES[m.group(3)]))
+                if cubeta:
+                    try: cubeta.sincronizar(int(valor), ahora)
+                    except ValueError: pass
+
+    def penalizar(self, codigo, retry_after, intento):
+        # 429/418: nadie pide nada hasta que pase Retry-After (o un backoff exponencial si no viene)
+        espera = retry_after if retry_after is not None else min(2 ** intento, MAX_ESPERA_SEGUNDOS)
+        with self.cond:
+            self.respuestas_429 += 1; self.bloqueado_hasta = max(self.bloqueado_hasta, time.monotonic() + espera)
+        return espera
+
+    def estado(self):
+        with self.cond:
+            ahora = time.monotonic(); cubetas = {}
+            for (tipo, segundos), c in self.cubetas.items():
+                c._rellenar(ahora)
+                cubetas[f"{tipo}_{segundos}s"] = {"limite": c.limite, "disponible": round(c.tokens, 1), "usado_servidor": c.usado_servidor}
+            return {"cubetas": cubetas, "esperas": self.esperas, "segundos_esperados": round(self.segundos_esperados, 3),
+                    "respuestas_429": self.respuestas_429, "bloqueado_segundos": round(max(0.0, self.bloqueado_hasta - ahora), 1)}
+
+def _retry_after(e):
+    try: return float(e.response.headers.get("Retry-After"))
+    except (AttributeError, TypeError, ValueError): return None
+
+class ClienteLimitado:
+    # Envuelve el Client de python-binance: mismos métodos, pero cada llamada pasa por el limitador
+    def __init__(self, cliente, limitador, al_llamar=None):
+        self.cliente = cliente; self.limitador = limitador
+        self.al_llamar = al_llamar # al_llamar(metodo, peso, segundos, ok) tras cada petición (métricas)
+        sesion = getattr(cliente, "session", None)
+        if sesion is not None: sesion.hooks.setdefault("response", []).append(self._al_responder)
+
+    def _al_responder(self, respuesta, *args, **kwargs):
+        self.limitador.registrar_cabeceras(respuesta.headers)
+
+    def __getattr__(self, nombre):
+        atributo = getattr(self.cliente, nombre)
+        if not callable(atributo): return atributo
+        peso = PESOS.get(nombre, 1); orden = nombre in METODOS_ORDEN; prioritaria = nombre in METODOS_PRIORITARIOS
+
+        def llamada(*args, **kwargs):
+            coste = peso(kwargs) if callable(peso) else peso
+            for intento in range(REINTENTOS_429 + 1):
+                self.limitador.adquirir(coste, orden, prioritaria)
+                t0 = time.monotonic(); ok = False
+                try: resultado = atributo(*args, **kwargs); ok = True; return resultado
+                except Exception as e:
+                    codigo = getattr(e, "status_code", None)
+                    if codigo not in (429, 418): raise
+                    espera = self.limitador.penalizar(codigo, _retry_after(e), intento)
+                    if codigo == 418 or intento == REINTENTOS_429:
+                        raise LimiteBinanceExcedido(espera, f"Binance respondió {codigo} en {nombre}; reintentar en {espera:.0f}s") from e
+                    logging.warning(f"Binance respondió 429 en {nombre}. Reintento {intento + 1}/{REINTENTOS_429} tras {espera:.1f}s.")
+                finally:
+                    if self.al_llamar: self.al_llamar(nombre, coste, time.monotonic() - t0, ok)
+        return llamada
@@ -0,0 +1,99 @@
+# --- START OF FILE metricas.py ---
+
+# Métricas en proceso del bot: contadores e histogramas de latencia (reloj monotónico) con etiquetas.
+# exportar() da una instantánea serializable que viaja en el estado del bot (IPC/fichero) y
+# formato_prometheus() la convierte en texto de exposición de Prometheus para la ruta /bot/metrics de la web.
+
+import bisect
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+LIMITES_SEGUNDOS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+MUESTRAS_CUANTILES = 1024 # Últimas observaciones de cada histograma con las que se calculan p50/p99
+
+class Histograma:
+    def __init__(self, limites=LIMITES_SEGUNDOS):
+        self.limites = limites; self.cuentas = [0] * (len(limites) + 1) # La última es +Inf
+        self.suma = 0.0; self.total = 0; self.muestras = deque(maxlen=MUESTRAS_CUANTILES)
+
+    def observar(self, valor):
+        self.cuentas[bisect.bisect_left(self.limites, valor)] += 1
+        self.suma += valor; self.total += 1; self.muestras.append(valor)
+
+    def cuantil(self, q):
+        if not self.muestras: return None
+        ordenadas = sorted(self.muestras)
+        return ordenadas[min(len(ordenadas) - 1, int(q * len(ordenadas)))]
+
+    def exportar(self):
+        return {"limites": list(self.limites), "cuentas": list(self.cuentas), "suma": round(self.suma, 6), "total": self.total,
+                "p50": self.cuantil(0.5), "p99": self.cuantil(0.99)}
+
+class Metricas:
+    def __init__(self):
+        self.lock = threading.Lock(); self.contadores = {}; self.histogramas = {}; self.ayuda = {}
+
+    @staticmethod
+    def _clave(nombre, etiquetas):
+        return nombre, tuple(sorted((k, str(v)) for k, v in etiquetas.items()))
+
+    def describir(self, nombre, texto):
+        self.ayuda[nombre] = texto
+
+    def incrementar(self, nombre, valor=1, **etiquetas):
+        clave = self._clave(nombre, etiquetas)
+        with self.lock: self.contadores[clave] = self.contadores.get(clave, 0) + valor
+
+    def observar(self, nombre, segundos, **etiquetas):
+        clave = self._clave(nombre, etiquetas)
+        with self.lock:
+            histograma = self.histogramas.get(clave)
+            if histograma is None: histograma = self.histogramas[clave] = Histograma()
+            histograma.observar(segundos)
+
+    @contextmanager
+    def medir(self, nombre, **etiquetas):
+        t0 = time.monotonic()
+        try: yield
+        finally: self.observar(nombre, time.monotonic() - t0, **etiquetas)
+
+    def cuantil(self, nombre, q, **etiquetas):
+        with self.lock:
+            histograma = self.histogramas.get(self._clave(nombre, etiquetas))
+            return histograma.cuantil(q) if histograma else None
+
+    def exportar(self, medidores=()):
+        # medidores: [(nombre, {etiquetas}, valor)] calculados en el momento (tasa de aciertos, cupos, ...)
+        with self.lock:
+            return {"contadores": [{"nombre": n, "etiquetas": dict(e), "valor": v} for (n, e), v in self.contadores.items()],
+                    "histogramas": [dict(h.exportar(), nombre=n, etiquetas=dict(e)) for (n, e), h in self.histogramas.items()],
+                    "medidores": [{"nombre": n, "etiquetas": e, "valor": v} for n, e, v in medidores if v is not None],
+                    "ayuda": dict(self.ayuda)}
+
+def _etiquetas(etiquetas, extra=None):
+    pares = list(etiquetas.items()) + (list(extra.items()) if extra else [])
+    if not pares: return ""
+    escapar = lambda v: str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+    return "{" + ",".join(f'{k}="{escapar(v)}"' for k, v in pares) + "}"
+
+def formato_prometheus(exportado, prefijo="gemini_bot_"):
+    lineas = []; ayuda = exportado.get("ayuda", {}); cabeceras = set()
+    def cabecera(nombre, tipo):
+        if nombre in cabeceras: return
+        cabeceras.add(nombre)
+        if nombre in ayuda: lineas.append(f"# HELP {prefijo}{nombre} {ayuda[nombre]}")
+        lineas.append(f"# TYPE {prefijo}{nombre} {tipo}")
+    for c in sorted(exportado.get("contadores", []), key=lambda c: c["nombre"]):
+        cabecera(c["nombre"], "counter"); lineas.append(f"{prefijo}{c['nombre']}{_etiquetas(c['etiquetas'])} {c['valor']}")
+    for m in sorted(exportado.get("medidores", []), key=lambda m: m["nombre"]):
+        cabecera(m["nombre"], "gauge"); lineas.append(f"{prefijo}{m['nombre']}{_etiquetas(m['etiquetas'])} {m['valor']}")
+    for h in sorted(exportado.get("histogramas", []), key=lambda h: h["nombre"]):
+        cabecera(h["nombre"], "histogram"); acumulado = 0
+        for limite, cuenta in zip(h["limites"] + ["+Inf"], h["cuentas"]):
+            acumulado += cuenta
+            lineas.append(f"{prefijo}{h['nombre']}_bucket{_etiquetas(h['etiquetas'], {'le': limite})} {acumulado}")
+        lineas.append(f"{prefijo}{h['nombre']}_sum{_etiquetas(h['etiquetas'])} {h['suma']}")
+        lineas.append(f"{prefijo}{h['nombre']}_count{_etiquetas(h['etiquetas'])} {h['total']}")
+    return "\n".join(lineas) + "\n"
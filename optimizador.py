@@ -0,0 +1,204 @@
+# --- START OF FILE optimizador.py ---
+
+# Barrido de parámetros (y walk-forward) sobre backtest.py con un pool de procesos.
+# Las klines se copian una sola vez a memoria compartida; cada worker las mapea sin copia al arrancar y
+# solo viajan entre procesos los parámetros y las estadísticas. Los resultados se añaden a un JSONL según
+# llegan, así que un barrido interrumpido se reanuda saltándose las combinaciones ya evaluadas. La primera
+# línea del JSONL describe el barrido (klines, pliegues, modo IA): con otros datos no se reanuda sobre él.
+#
+#   python optimizador.py klines_btc_15m.json --resultados sweep.jsonl
+#   python optimizador.py klines_btc_15m.json --rejilla rejilla.json --walk-forward 4 --orden sharpe --procesos 8
+#
+# rejilla.json: {"tp_pct": [1.0, 2.0, 3.0], "sl_pct": [0.5, 1.0], ...} (claves de backtest.PARAMETROS_POR_DEFECTO)
+
+import argparse
+import csv
+import itertools
+import json
+import logging
+import os
+import sys
+import time
+from multiprocessing import Pool, shared_memory
+
+import numpy as np
+
+import backtest
+
+REJILLA_POR_DEFECTO = {
+    "tp_pct": [1.0, 1.5, 2.0, 2.5, 3.0, 4.0], "sl_pct": [0.5, 0.75, 1.0, 1.5, 2.0],
+    "rsi_umbral": [30, 35, 40, 45, 50, 55], "sma_cruce": [10, 20, 30, 50],
+    "descuento_entrada": [0.997, 0.998, 0.999, 1.0], "timeout_min": [15, 30, 60],
+}
+COLUMNAS = ("open_time", "open", "high", "low", "close")
+COMBINACIONES_POR_TAREA = 16 # Agrupa combinaciones por tarea para amortizar el ida y vuelta con el pool
+
+# --- Memoria compartida ---
+def publicar_klines(datos):
+    # Copia las columnas a un bloque compartido (5 x n float64; open_time en ms cabe exacto en un double)
+    n = len(datos["close"])
+    shm = shared_memory.SharedMemory(create=True, size=len(COLUMNAS) * n * 8)
+    matriz = np.ndarray((len(COLUMNAS), n), dtype=np.float64, buffer=shm.buf)
+    for fila, col in enumerate(COLUMNAS): matriz[fila] = datos[col]
+    return shm, n
+
+def _mapear_klines(nombre, n):
+    # Los workers del pool comparten el resource_tracker del padre, que es quien hace unlink al terminar
+    shm = shared_memory.SharedMemory(name=nombre, track=False) if sys.version_info >= (3, 13) else shared_memory.SharedMemory(name=nombre)
+    matriz = np.ndarray((len(COLUMNAS), n), dtype=np.float64, buffer=shm.buf)
+    datos = {col: matriz[fila] for fila, col in enumerate(COLUMNAS)}
+    datos["open_time"] = datos["open_time"].astype(np.int64) # Única copia: searchsorted/fechas trabajan en enteros
+    return shm, datos
+
+# --- Worker ---
+_worker = {}
+
+def _inicializar_worker(nombre, n, pliegues, ia_modo, ia_fichero, ia_prob, semilla):
+    shm, datos = _mapear_klines(nombre, n)
+    segmentos = [{k: v[a:b] for k, v in datos.items()} for a, b in pliegues] # Vistas, sin copia
+    _worker.update(shm=shm, segmentos=segmentos, caches=[{} for _ in segmentos], ia_modo=ia_modo, ia_prob=ia_prob, semilla=semilla,
+                   replays=[backtest.ia_replay(ia_fichero, seg) for seg in segmentos] if ia_modo == "replay" else None)
+
+def _ia_worker(i_seg):
+    if _worker["ia_modo"] == "replay": return _worker["replays"][i_seg]
+    if _worker["ia_modo"] == "stub": return backtest.ia_stub(_worker["ia_prob"], _worker["semilla"]) # Nueva por evaluación: reproducible
+    return backtest.ia_siempre_confirma()
+
+def _evaluar_lote(lote):
+    resultados = []
+    for params in lote:
+        por_pliegue = [backtest.ejecutar_backtest(seg, params, _ia_worker(i), cache=_worker["caches"][i])["estadisticas"]
+                       for i, seg in enumerate(_worker["segmentos"])]
+        resultados.append({"clave": clave_params(params), "params": params, "pliegues": por_pliegue})
+    return resultados
+
+# --- Rejilla y resultados ---
+def clave_params(params):
+    return json.dumps(params, sort_keys=True)
+
+def generar_combinaciones(rejilla):
+    nombres = list(rejilla)
+    for valores in itertools.product(*(rejilla[k] for k in nombres)):
+        yield dict(zip(nombres, valores))
+
+def _huella_fichero(path):
+    st = os.stat(path)
+    return {"fichero": os.path.abspath(path), "bytes": st.st_size, "mtime": int(st.st_mtime)}
+
+def contexto_barrido(args, pliegues):
+    # Lo que, además de los parámetros, determina las estadísticas de cada combinación
+    return {"klines": _huella_fichero(args.klines), "pliegues": [list(p) for p in pliegues], "ia": args.ia,
+            "ia_fichero": _huella_fichero(args.ia_fichero) if args.ia == "replay" else None,
+            "ia_prob": args.ia_prob if args.ia == "stub" else None, "semilla": args.semilla if args.ia == "stub" else None}
+
+def cargar_resultados(path):
+    # (cabecera, {clave: resultado}); cabecera None si el fichero no existe o es de antes de tenerla
+    cabecera = None; resultados = {}
+    if os.path.exists(path):
+        with open(path, "r") as f:
+            for linea in f:
+                try:
+                    r = json.loads(linea)
+                    if "cabecera" in r: cabecera = r["cabecera"]
+                    else: resultados[r["clave"]] = r
+                except (json.JSONDecodeError, KeyError): pass # Última línea a medias si se cortó escribiendo
+    return cabecera, resultados
+
+def comprobar_contexto(path, cabecera, resultados, contexto):
+    # Mezclar estadísticas de otro fichero de klines o de otro modo IA falsearía el ranking: mejor no reanudar
+    if not resultados: return
+    if cabecera is None: raise SystemExit(f"{path} no tiene cabecera de barrido: no se sabe con qué datos se generó. Usa otro --resultados.")
+    distintos = sorted(k for k in contexto if cabecera.get(k) != contexto[k])
+    if distintos: raise SystemExit(f"{path} es de otro barrido (cambia: {', '.join(distintos)}). Usa otro --resultados.")
+
+def dividir_pliegues(n, k):
+    limites = np.linspace(0, n, k + 1).astype(int)
+    return [(int(limites[i]), int(limites[i + 1])) for i in range(k)]
+
+def _metrica(r, orden, pliegues):
+    valores = [r["pliegues"][i][orden] for i in pliegues]
+    return float(np.mean(valores)) if valores else float("-inf")
+
+def escribir_ranking(resultados, path, orden, top):
+    filas = sorted(resultados, key=lambda r: _metrica(r, orden, range(len(r["pliegues"]))), reverse=True)
+    stats = list(filas[0]["pliegues"][0]) if filas else []
+    with open(path, "w", newline="") as f:
+        w = csv.writer(f); nombres = list(filas[0]["params"]) if filas else []
+        w.writerow(["rank"] + nombres + [f"{orden}_medio"] + [f"{s}_p{i}" for i in range(len(filas[0]["pliegues"]) if filas else 0) for s in stats])
+        for rank, r in enumerate(filas, 1):
+            w.writerow([rank] + [r["params"][k] for k in nombres] + [round(_metrica(r, orden, range(len(r["pliegues"]))), 6)] +
+                       [p[s] for p in r["pliegues"] for s in stats])
+    logging.info(f"Ranking ({len(filas)} combinaciones, por {orden}) en {path}. Mejores:")
+    for rank, r in enumerate(filas[:top], 1):
+        logging.info(f"  #{rank} {orden}={_metrica(r, orden, range(len(r['pliegues']))):.4f} {r['params']}")
+
+def walk_forward(resultados, orden, k):
+    # Ventana anclada: para el pliegue i se elige la mejor combinación en los pliegues 0..i-1 y se mide en el i
+    informe = []
+    for i in range(1, k):
+        mejor = max(resultados, key=lambda r: _metrica(r, orden, range(i)))
+        informe.append({"pliegue": i, "params": mejor["params"], f"{orden}_entrenamiento": _metrica(mejor, orden, range(i)),
+                        "fuera_de_muestra": mejor["pliegues"][i]})
+        logging.info(f"Walk-forward pliegue {i}: {orden} entrenamiento={_metrica(mejor, orden, range(i)):.4f}, "
+                     f"fuera de muestra={mejor['pliegues'][i][orden]:.4f}, rentabilidad={mejor['pliegues'][i]['rentabilidad_pct']:.2f}% {mejor['params']}")
+    return informe
+
+def ejecutar_barrido(args):
+    rejilla = REJILLA_POR_DEFECTO
+    if args.rejilla:
+        with open(args.rejilla, "r") as f: rejilla = json.load(f)
+    desconocidos = set(rejilla) - set(backtest.PARAMETROS_POR_DEFECTO)
+    if desconocidos: raise SystemExit(f"Parámetros desconocidos en la rejilla: {sorted(desconocidos)}")
+
+    datos = backtest.cargar_klines(args.klines); n = len(datos["close"])
+    pliegues = dividir_pliegues(n, args.walk_forward or 1)
+    contexto = contexto_barrido(args, pliegues)
+    cabecera, hechos = cargar_resultados(args.resultados)
+    comprobar_contexto(args.resultados, cabecera, hechos, contexto)
+    combinaciones = list(generar_combinaciones(rejilla))
+    pendientes = [p for p in combinaciones if clave_params(p) not in hechos]
+    logging.info(f"{n} velas, {len(pliegues)} pliegue(s), {len(combinaciones)} combinaciones ({len(combinaciones) - len(pendientes)} ya evaluadas), {args.procesos} procesos.")
+
+    if pendientes:
+        shm, _ = publicar_klines(datos)
+        lotes = [pendientes[i:i + COMBINACIONES_POR_TAREA] for i in range(0, len(pendientes), COMBINACIONES_POR_TAREA)]
+        t0 = time.perf_counter(); hechas = 0
+        try:
+            with Pool(args.procesos, initializer=_inicializar_worker,
+                      initargs=(shm.name, n, pliegues, args.ia, args.ia_fichero, args.ia_prob, args.semilla)) as pool, \
+                 open(args.resultados, "a+") as f:
+                f.seek(0, os.SEEK_END)
+                if f.tell() > 0:
+                    f.seek(f.tell() - 1); f.write("" if f.read(1) == "\n" else "\n") # Cierra una línea que quedó a medias
+                if cabecera is None: f.write(json.dumps({"cabecera": contexto}) + "\n")
+                for lote in pool.imap_unordered(_evaluar_lote, lotes):
+                    for r in lote: f.write(json.dumps(r) + "\n"); hechos[r["clave"]] = r
+                    f.flush(); hechas += len(lote)
+                    if hechas % (COMBINACIONES_POR_TAREA * 50) < len(lote) or hechas == len(pendientes):
+                        dt = time.perf_counter() - t0
+                        logging.info(f"{hechas}/{len(pendientes)} combinaciones ({hechas / dt:.1f}/s)")
+        finally:
+            shm.close(); shm.unlink()
+
+    claves = {clave_params(p) for p in combinaciones}
+    resultados = [r for c, r in hechos.items() if c in claves and len(r["pliegues"]) == len(pliegues)]
+    if not resultados: logging.warning("Sin resultados que ordenar."); return
+    escribir_ranking(resultados, args.ranking or os.path.splitext(args.resultados)[0] + "_ranking.csv", args.orden, args.top)
+    if len(pliegues) > 1:
+        informe = walk_forward(resultados, args.orden, len(pliegues))
+        with open(os.path.splitext(args.resultados)[0] + "_walk_forward.json", "w") as f: json.dump(informe, f, indent=2)
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - Optimizador - %(message)s')
+    parser = argparse.ArgumentParser(description="Barrido de parámetros paralelo y walk-forward sobre backtest.py.")
+    parser.add_argument("klines", help="Fichero de klines (JSON o CSV, como backtest.py)")
+    parser.add_argument("--rejilla", help="JSON {parametro: [valores]}; por defecto REJILLA_POR_DEFECTO")
+    parser.add_argument("--resultados", default="sweep.jsonl", help="JSONL incremental; si existe, se reanuda")
+    parser.add_argument("--ranking", help="CSV del ranking (por defecto <resultados>_ranking.csv)")
+    parser.add_argument("--orden", default="rentabilidad_pct", help="Estadística por la que ordenar (media entre pliegues)")
+    parser.add_argument("--walk-forward", type=int, default=0, help="Nº de pliegues para walk-forward anclado (0 = sin)")
+    parser.add_argument("--procesos", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--top", type=int, default=10)
+    parser.add_argument("--ia", choices=("siempre", "stub", "replay"), default="siempre")
+    parser.add_argument("--ia-fichero"); parser.add_argument("--ia-prob", type=float, default=0.5); parser.add_argument("--semilla", type=int, default=0)
+    ejecutar_barrido(parser.parse_args())
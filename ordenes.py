@@ -0,0 +1,68 @@
+# --- START OF FILE ordenes.py ---
+
+# Seguimiento de órdenes propias alimentado por los executionReport del user-data stream. Las cantidades
+# ejecutadas se toman de los acumulados del evento (z/Z), así que los fills parciales se suman bien aunque
+# un evento llegue repetido. Sin stream (o tras reconectar) se reconcilia con un único get_open_orders.
+
+import decimal
+import logging
+import threading
+import time
+
+ORDER_RECONCILE_MAX_AGE = 5.0 # Segundos que vale una reconciliación REST cuando no hay stream
+ESTADOS_FINALES = ("FILLED", "CANCELED", "EXPIRED", "REJECTED", "EXPIRED_IN_MATCH")
+
+class SeguidorOrdenes:
+    def __init__(self, al_cambiar=None):
+        self.al_cambiar = al_cambiar # al_cambiar(symbol, orden) tras cada cambio de estado o fill
+        self.lock = threading.Lock(); self.lock_reconciliar = threading.Lock()
+        self.ordenes = {} # orderId -> dict con el formato de get_order (status, executedQty, cummulativeQuoteQty, ...)
+        self.stream_activo = False; self.ultima_reconciliacion = 0.0
+
+    def registrar(self, resp):
+        # Respuesta de create_order (o get_order): punto de partida hasta que lleguen eventos
+        if not resp or 'orderId' not in resp: return
+        with self.lock:
+            previa = self.ordenes.get(resp['orderId'])
+            if previa and decimal.Decimal(previa['executedQty']) > decimal.Decimal(resp.get('executedQty', '0')): return # El stream ya fue más allá
+            self.ordenes[resp['orderId']] = {k: resp.get(k) for k in ('symbol', 'orderId', 'side', 'price', 'origQty', 'executedQty', 'cummulativeQuoteQty', 'status')}
+            self.ordenes[resp['orderId']]['updateTime'] = resp.get('updateTime') or resp.get('transactTime') or 0
+
+    def aplicar_execution_report(self, ev):
+        orden = {"symbol": ev['s'], "orderId": ev['i'], "side": ev['S'], "price": ev['p'], "origQty": ev['q'],
+                 "executedQty": ev['z'], "cummulativeQuoteQty": ev['Z'], "status": ev['X'], "updateTime": ev.get('T') or ev.get('E', 0)}
+        with self.lock:
+            previa = self.ordenes.get(ev['i'])
+            if previa is not None and (decimal.Decimal(previa['executedQty']), previa['updateTime'] or 0) > (decimal.Decimal(ev['z']), orden['updateTime']):
+                return # Evento antiguo o repetido
+            self.ordenes[ev['i']] = orden
+        if ev.get('x') == "TRADE":
+            logging.info(f"Fill {ev['S']} {ev['s']} orden {ev['i']}: {ev['l']} a {ev['L']} (acumulado {ev['z']}/{ev['q']}, {ev['X']})")
+        if self.al_cambiar: self.al_cambiar(ev['s'], orden)
+
+    def estado(self, order_id):
+        with self.lock:
+            orden = self.ordenes.get(order_id)
+            return dict(orden) if orden else None
+
+    def olvidar(self, order_id):
+        with self.lock: self.ordenes.pop(order_id, None)
+
+    def necesita_reconciliar(self):
+        return not self.stream_activo and time.time() - self.ultima_reconciliacion > ORDER_RECONCILE_MAX_AGE
+
+    def reconciliar(self, obtener_abiertas, obtener_orden, forzar=False):
+        # Una llamada get_open_orders para todas; solo las que ya no están abiertas se consultan una a una
+        with self.lock_reconciliar:
+            if not forzar and time.time() - self.ultima_reconciliacion <= ORDER_RECONCILE_MAX_AGE: return
+            with self.lock: pendientes = {oid: o['symbol'] for oid, o in self.ordenes.items() if o['status'] not in ESTADOS_FINALES}
+            if not pendientes: self.ultima_reconciliacion = time.time(); return
+            try:
+                abiertas = {o['orderId']: o for o in obtener_abiertas()}
+                for oid, symbol in pendientes.items():
+                    resp = abiertas.get(oid) or obtener_orden(symbol, oid)
+                    antes = self.estado(oid); self.registrar(resp); despues = self.estado(oid)
+                    if self.al_cambiar and despues and (antes is None or (antes['status'], antes['executedQty']) != (despues['status'], despues['executedQty'])):
+                        self.al_cambiar(symbol, despues)
+                self.ultima_reconciliacion = time.time()
+            except Exception as e: logging.error(f"Error reconciliando órdenes abiertas: {e}")
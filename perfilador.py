@@ -0,0 +1,110 @@
+# --- START OF FILE perfilador.py ---
+
+# Perfilado por muestreo de los ciclos en vivo, activable sin reiniciar (comando PROFILE o señal SIGUSR1).
+# Un hilo toma la pila de los hilos que están ejecutando un ciclo (y de los de IA y BD cuando trabajan)
+# cada PROFILE_INTERVALO segundos durante los N ciclos siguientes. Cuenta cada pasada del planificador por un
+# símbolo, sea un ciclo completo (cierre de vela) o un tick ligero de precio; así N ciclos son segundos y no N
+# cierres de vela, y se muestrea también el camino de los ticks. Al terminar escribe:
+#   perfil_<fecha>.collapsed  pilas plegadas ("hilo;modulo:funcion;... muestras"), para flamegraph.pl o speedscope
+#   perfil_<fecha>_top.txt    funciones con más muestras propias e inclusivas
+# cProfile no sirve aquí: es exclusivo por proceso y los ciclos corren a la vez en varios hilos del pool.
+
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+
+PROFILE_INTERVALO = 0.005 # Segundos entre muestras
+PROFILE_CICLOS_POR_DEFECTO = 5
+PROFILE_TOP = 30
+HILOS_AUXILIARES = ("ia", "db-writer") # Prefijos de hilos que también se muestrean si no están esperando
+_MODULOS_ESPERA = ("threading.py", "queue.py", "selectors.py") # Muestra de un hilo auxiliar ocioso: se descarta
+
+def _pila(frame):
+    marcos = []
+    while frame is not None:
+        modulo = frame.f_globals.get("__name__") or os.path.basename(frame.f_code.co_filename)
+        marcos.append(f"{modulo}:{frame.f_code.co_name}")
+        frame = frame.f_back
+    marcos.reverse()
+    return marcos
+
+class Perfilador:
+    def __init__(self, directorio="perfiles", intervalo=PROFILE_INTERVALO):
+        self.directorio = directorio; self.intervalo = intervalo
+        self.lock = threading.Lock(); self.activo = False; self.ciclos_restantes = 0
+        self.hilos_en_ciclo = {} # ident -> etiqueta (símbolo)
+        self.pilas = Counter(); self.muestras = 0; self.inicio = 0.0; self.ultimo_informe = None; self.hilo = None
+
+    def iniciar(self, ciclos=PROFILE_CICLOS_POR_DEFECTO):
+        # Devuelve (ok, mensaje) como los comandos web
+        with self.lock:
+            if self.activo: return False, f"Perfilado ya en curso ({self.ciclos_restantes} ciclos restantes)"
+            self.activo = True; self.ciclos_restantes = max(1, int(ciclos)); self.pilas = Counter(); self.muestras = 0
+            self.inicio = time.monotonic()
+        self.hilo = threading.Thread(target=self._muestrear, name="perfilador", daemon=True); self.hilo.start()
+        logging.info(f"Perfilado por muestreo activado para los próximos {self.ciclos_restantes} ciclos.")
+        return True, f"Perfilando {self.ciclos_restantes} ciclos"
+
+    def inicio_ciclo(self, etiqueta):
+        if not self.activo: return False
+        with self.lock: self.hilos_en_ciclo[threading.get_ident()] = etiqueta
+        return True
+
+    def fin_ciclo(self, registrado):
+        if not registrado: return
+        terminar = False
+        with self.lock:
+            self.hilos_en_ciclo.pop(threading.get_ident(), None)
+            if self.activo:
+                self.ciclos_restantes -= 1
+                if self.ciclos_restantes <= 0: self.activo = False; terminar = True
+        if terminar: self._escribir_informe()
+
+    def _muestrear(self):
+        propio = threading.get_ident()
+        while self.activo:
+            t0 = time.perf_counter()
+            nombres = {t.ident: t.name for t in threading.enumerate()}
+            with self.lock: en_ciclo = dict(self.hilos_en_ciclo)
+            for ident, frame in sys._current_frames().items():
+                if ident == propio: continue
+                if ident in en_ciclo: hilo = f"ciclo-{en_ciclo[ident]}"
+                else:
+                    nombre = nombres.get(ident, "")
+                    if not nombre.startswith(HILOS_AUXILIARES): continue
+                    if os.path.basename(frame.f_code.co_filename) in _MODULOS_ESPERA: continue
+                    hilo = nombre.rstrip("_0123456789")
+                self.pilas[";".join([hilo] + _pila(frame))] += 1; self.muestras += 1
+            time.sleep(max(0.0, self.intervalo - (time.perf_counter() - t0)))
+
+    def _escribir_informe(self):
+        self.hilo.join() # Termina la muestra en curso antes de leer las pilas
+        duracion = time.monotonic() - self.inicio; pilas = self.pilas
+        propias = Counter(); inclusivas = Counter()
+        for pila, n in pilas.items():
+            marcos = pila.split(";")[1:]
+            if marcos: propias[marcos[-1]] += n
+            for marco in set(marcos): inclusivas[marco] += n
+        total = sum(pilas.values()) or 1
+        base = os.path.join(self.directorio, f"perfil_{datetime.now().strftime('%Y%m%d_%H%M%S')}")
+        try:
+            os.makedirs(self.directorio, exist_ok=True)
+            with open(f"{base}.collapsed", "w") as f:
+                for pila, n in pilas.most_common(): f.write(f"{pila} {n}\n")
+            lineas = [f"Perfil por muestreo: {total} muestras cada {self.intervalo * 1000:.1f} ms en {duracion:.1f}s", ""]
+            for titulo, contador in (("Tiempo propio", propias), ("Tiempo inclusivo", inclusivas)):
+                lineas += [f"{titulo}:", f"{'muestras':>9} {'%':>6} {'~ms':>8}  función"]
+                lineas += [f"{n:>9} {100 * n / total:>6.1f} {n * self.intervalo * 1000:>8.0f}  {marco}" for marco, n in contador.most_common(PROFILE_TOP)]
+                lineas.append("")
+            with open(f"{base}_top.txt", "w") as f: f.write("\n".join(lineas))
+        except OSError as e: logging.error(f"No se pudo escribir el perfil en {self.directorio}: {e}"); return
+        self.ultimo_informe = f"{base}_top.txt"
+        logging.info(f"Perfil guardado en {base}.collapsed y {base}_top.txt. Más tiempo propio: " +
+                     ", ".join(f"{marco} {100 * n / total:.0f}%" for marco, n in propias.most_common(5)))
+
+    def estado(self):
+        return {"activo": self.activo, "ciclos_restantes": self.ciclos_restantes if self.activo else 0, "ultimo_informe": self.ultimo_informe}
@@ -0,0 +1,113 @@
+# --- START OF FILE reglas_simbolo.py ---
+
+# Reglas de trading de un par compiladas una sola vez a partir de su exchange info: stepSize, tickSize,
+# minQty/maxQty y minNotional ya como Decimal, redondeo hacia abajo con quantize cuando el paso es potencia
+# de 10 (el caso habitual en Binance) y validación de una orden en una sola pasada.
+# La exchange info se guarda en disco con TTL para no descargarla en cada arranque.
+
+import decimal
+import json
+import logging
+import os
+import threading
+import time
+
+EXCHANGE_INFO_TTL = 24 * 3600 # Segundos que vale la exchange info guardada en disco
+
+def _filtro(filtros, tipo, campo):
+    valor = filtros.get(tipo, {}).get(campo)
+    return decimal.Decimal(str(valor)) if valor is not None else None
+
+def _exponente_potencia_10(paso):
+    # Decimal('0.00100000') -> Decimal('0.001'); None si el paso no es 10^k
+    if not paso or paso <= 0: return None
+    normalizado = paso.normalize()
+    return decimal.Decimal(1).scaleb(normalizado.as_tuple().exponent) if normalizado.as_tuple().digits == (1,) else None
+
+class SymbolRules:
+    def __init__(self, si):
+        self.symbol = si.get('symbol'); self.si = si
+        filtros = {f['filterType']: f for f in si.get('filters', [])}
+        self.step = _filtro(filtros, 'LOT_SIZE', 'stepSize'); self.min_qty = _filtro(filtros, 'LOT_SIZE', 'minQty')
+        self.max_qty = _filtro(filtros, 'LOT_SIZE', 'maxQty')
+        self.tick = _filtro(filtros, 'PRICE_FILTER', 'tickSize')
+        # NOTIONAL en la API actual; MIN_NOTIONAL en pares/entornos antiguos
+        self.min_notional = _filtro(filtros, 'NOTIONAL', 'minNotional') or _filtro(filtros, 'MIN_NOTIONAL', 'minNotional')
+        if self.max_qty is not None and self.max_qty <= 0: self.max_qty = None
+        self._q_step = _exponente_potencia_10(self.step); self._q_tick = _exponente_potencia_10(self.tick)
+
+    @staticmethod
+    def _redondear(valor, paso, exponente):
+        valor = valor if isinstance(valor, decimal.Decimal) else decimal.Decimal(str(valor))
+        if exponente is not None: return valor.quantize(exponente, rounding=decimal.ROUND_DOWN)
+        return (valor // paso) * paso if paso and paso > 0 else valor
+
+    def cuantizar_cantidad(self, q):
+        return self._redondear(q, self.step, self._q_step)
+
+    def cuantizar_precio(self, p):
+        return self._redondear(p, self.tick, self._q_tick)
+
+    def cumple_min_notional(self, q, p):
+        return self.min_notional is None or q * p >= self.min_notional
+
+    def validar_orden(self, q, p, limit=True):
+        # Una pasada: cantidad y precio redondeados y comprobados contra todos los filtros.
+        # Devuelve (cantidad, precio, None) o (cantidad, precio, motivo del rechazo). En MARKET p es el precio actual.
+        qty = self.cuantizar_cantidad(q)
+        precio = self.cuantizar_precio(p) if limit else (p if isinstance(p, decimal.Decimal) else decimal.Decimal(str(p)))
+        if qty <= 0: return qty, precio, f"Qty <=0 ({qty})."
+        if self.min_qty and qty < self.min_qty: return qty, precio, f"Qty {qty} < minQty ({self.min_qty})."
+        if self.max_qty and qty > self.max_qty: return qty, precio, f"Qty {qty} > maxQty ({self.max_qty})."
+        if limit and precio <= 0: return qty, precio, f"Precio <=0 ({precio})."
+        if not self.cumple_min_notional(qty, precio): return qty, precio, f"Orden no cumple MIN_NOTIONAL ({self.min_notional}). Nocional: {qty * precio}"
+        return qty, precio, None
+
+class CacheExchangeInfo:
+    # symbol -> (exchange info del par, instante de descarga), persistida en JSON
+    def __init__(self, fichero=None, ttl=EXCHANGE_INFO_TTL):
+        self.fichero = fichero; self.ttl = ttl; self.lock = threading.Lock(); self.entradas = {}
+        if fichero: self._cargar()
+
+    def obtener(self, symbol):
+        with self.lock:
+            entrada = self.entradas.get(symbol)
+            return entrada[0] if entrada and time.time() - entrada[1] <= self.ttl else None
+
+    def precargar(self, symbols, descargar_exchange_info):
+        # Los pares que falten o hayan caducado salen de una única descarga de exchange info
+        faltan = [s for s in symbols if self.obtener(s) is None]
+        if not faltan: return
+        ahora = time.time()
+        por_simbolo = {item['symbol']: item for item in descargar_exchange_info().get('symbols', [])}
+        with self.lock:
+            for s in faltan:
+                if s in por_simbolo: self.entradas[s] = (por_simbolo[s], ahora)
+        logging.info(f"Exchange info descargada para {', '.join(s for s in faltan if s in por_simbolo) or 'ningún par'}.")
+        self._persistir()
+
+    def guardar(self, symbol, info):
+        with self.lock: self.entradas[symbol] = (info, time.time())
+        self._persistir()
+
+    def invalidar(self, symbol):
+        # Tras un rechazo por filtros (-1013) los filtros pueden haber cambiado: se vuelven a descargar
+        with self.lock: eliminada = self.entradas.pop(symbol, None)
+        if eliminada: self._persistir()
+
+    def _cargar(self):
+        try:
+            with open(self.fichero, "r") as f: datos = json.load(f)
+            self.entradas = {s: (info, instante) for s, (info, instante) in datos.items()}
+        except FileNotFoundError: pass
+        except (OSError, ValueError) as e: logging.warning(f"No se pudo cargar la exchange info de {self.fichero}: {e}")
+
+    def _persistir(self):
+        if not self.fichero: return
+        with self.lock:
+            datos = {s: [info, instante] for s, (info, instante) in self.entradas.items()}
+            try:
+                tmp = f"{self.fichero}.tmp"
+                with open(tmp, "w") as f: json.dump(datos, f)
+                os.replace(tmp, self.fichero)
+            except OSError as e: logging.warning(f"No se pudo guardar la exchange info: {e}")
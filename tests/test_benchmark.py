@@ -0,0 +1,49 @@
+# Puerta de regresión de rendimiento de benchmark.py para CI. Las medidas dependen de la máquina, así que la
+# comparación con una base solo se hace si se indica con BENCH_BASE (JSON guardado con --guardar-base en la
+# misma máquina de CI); BENCH_UMBRAL cambia el umbral. Sin BENCH_BASE solo se comprueba que todo funciona.
+
+import json
+import os
+
+import pytest
+
+import benchmark
+
+pytest.importorskip("numpy")
+
+def _args(tmp_path, *extra):
+    return benchmark.crear_parser().parse_args(["ejecutar", "--fixtures", str(tmp_path / "fixtures"), *extra])
+
+def test_comparar_marca_solo_lo_que_supera_el_umbral():
+    base = {"resultados": {"a": {"mediana_us": 100.0}, "b": {"mediana_us": 100.0}, "c": {"mediana_us": 0.0}}}
+    resultados = {"a": {"mediana_us": 129.0}, "b": {"mediana_us": 131.0}, "c": {"mediana_us": 5.0}, "nuevo": {"mediana_us": 1.0}}
+    assert benchmark.comparar(resultados, base, 1.3) == [("b", pytest.approx(1.31))]
+    assert resultados["a"]["ratio_base"] == 1.29 and "ratio_base" not in resultados["nuevo"]
+
+def test_ejecutar_guarda_base_y_sale_con_1_si_hay_regresion(tmp_path):
+    base = tmp_path / "base.json"
+    rapidos = ["--solo", "format_price", "format_quantity", "--rondas", "1", "--segundos-ronda", "0.01"]
+    assert benchmark.ejecutar(_args(tmp_path, *rapidos, "--guardar-base", str(base))) == 0
+    informe = json.loads(base.read_text())
+    assert set(informe["resultados"]) == {"format_price", "format_quantity"}
+    for r in informe["resultados"].values(): r["mediana_us"] /= 1000 # Base artificialmente rápida: todo es regresión
+    base.write_text(json.dumps(informe))
+    assert benchmark.ejecutar(_args(tmp_path, *rapidos, "--base", str(base))) == 1
+
+def test_base_inexistente_no_aprueba(tmp_path):
+    assert benchmark.ejecutar(_args(tmp_path, "--solo", "format_price", "--base", str(tmp_path / "no_existe.json"))) != 0
+
+def test_ejecutar_deja_el_bot_y_el_log_como_estaban(tmp_path):
+    import logging
+    import gemini_bot
+    nombres = ("binance_client", "DATABASE_URL", "iniciar_db_writer", "almacen_velas", "symbol_states", "kline_cache", "exchange_info_cache", "ai_executor")
+    antes = {n: getattr(gemini_bot, n) for n in nombres}; nivel = logging.getLogger().level
+    benchmark.ejecutar(_args(tmp_path, "--solo", "format_price", "--rondas", "1", "--segundos-ronda", "0.01"))
+    assert all(getattr(gemini_bot, n) is antes[n] for n in nombres) and logging.getLogger().level == nivel
+
+@pytest.mark.skipif(not os.environ.get("BENCH_BASE"), reason="Sin BENCH_BASE no hay base con la que comparar")
+def test_sin_regresiones_respecto_a_la_base(tmp_path):
+    umbral = os.environ.get("BENCH_UMBRAL", str(benchmark.UMBRAL_POR_DEFECTO))
+    fixtures = os.environ.get("BENCH_FIXTURES") or str(tmp_path / "fixtures") # Sin grabadas: sintéticas (deterministas)
+    args = benchmark.crear_parser().parse_args(["ejecutar", "--fixtures", fixtures, "--base", os.environ["BENCH_BASE"], "--umbral", umbral])
+    assert benchmark.ejecutar(args) == 0, f"Regresión de rendimiento respecto a {os.environ['BENCH_BASE']} (umbral x{umbral})"
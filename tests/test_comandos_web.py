@@ -0,0 +1,41 @@
+# Los comandos web llegan por el hilo IPC mientras el ciclo del mismo símbolo puede estar en marcha: se encolan y
+# el ciclo los recoge al empezar, así que uno recibido durante un ciclo no lo borra el final de ese ciclo.
+
+import decimal
+
+import pytest
+
+gemini_bot = pytest.importorskip("gemini_bot")
+
+@pytest.fixture
+def st(monkeypatch):
+    st = gemini_bot.SymbolState("BTCUSDT", {"baseAsset": "BTC", "quoteAsset": "USDT"}, decimal.Decimal("0.001"))
+    monkeypatch.setattr(gemini_bot, "symbol_states", {"BTCUSDT": st})
+    return st
+
+def test_comando_recibido_durante_el_ciclo_no_se_pierde(st):
+    assert gemini_bot.aplicar_comando_web("FORCE_BUY")[0]
+    st.recoger_comandos(); assert st.current_forced_action == "FORCE_BUY"
+    assert gemini_bot.aplicar_comando_web("FORCE_SELL", "btcusdt")[0] # Llega mientras el ciclo ejecuta la compra
+    st.current_forced_action = None # Fin de la rama forzada del ciclo en curso
+    st.proximo_ciclo = st.proxima_vela = float("inf") # Sin ciclo por tiempo: solo el comando lo dispara
+    assert st.necesita_ciclo_completo() and st.debe_ejecutar(0)
+    st.recoger_comandos(); assert st.current_forced_action == "FORCE_SELL"
+
+def test_el_ultimo_comando_sustituye_al_pendiente(st):
+    st.current_forced_action = "FORCE_SELL" # Pendiente: sin posición no se puede vender aún
+    gemini_bot.aplicar_comando_web("CLEAR_FORCED_ACTION"); st.recoger_comandos()
+    assert st.current_forced_action == "CLEAR_FORCED_ACTION" and st.comandos.empty()
+
+def test_comando_desconocido_no_se_encola(st):
+    assert not gemini_bot.aplicar_comando_web("VENDELO_TODO")[0] and st.comandos.empty()
+
+def test_profile_lleva_los_ciclos_en_el_comando(st, monkeypatch, tmp_path):
+    pedidos = []
+    monkeypatch.setattr(gemini_bot.perfilador, "iniciar", lambda ciclos: (pedidos.append(ciclos), (True, "ok"))[1])
+    assert gemini_bot.aplicar_comando_web("PROFILE 3")[0] and gemini_bot.aplicar_comando_web("profile")[0]
+    assert gemini_bot.aplicar_comando_web("PROFILE", "7")[0] # El símbolo no se toma como nº de ciclos: perfila los de por defecto
+    assert not gemini_bot.aplicar_comando_web("PROFILE BTCUSDT")[0]
+    fichero = tmp_path / "cmd.txt"; monkeypatch.setattr(gemini_bot, "COMMAND_FILE", str(fichero))
+    fichero.write_text("profile 2\n"); gemini_bot.check_for_web_command()
+    assert pedidos == [3, gemini_bot.PROFILE_CICLOS_POR_DEFECTO, gemini_bot.PROFILE_CICLOS_POR_DEFECTO, 2] and not fichero.exists()
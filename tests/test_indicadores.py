@@ -0,0 +1,73 @@
+# Los indicadores incrementales (EstadoIndicadores) y los vectorizados del backtest deben dar lo mismo que
+# pandas_ta: RSI = rma (ewm alpha=1/length, min_periods=length) de subidas y bajadas; SMA = rolling(n).mean().
+# Las fórmulas de referencia se escriben aquí con pandas para no depender de pandas_ta.
+
+import numpy as np
+import pytest
+
+from indicadores import EstadoIndicadores, RSI_LENGTH, SMA_LENGTHS, RESYNC_SUMAS_CADA, rsi_vectorizado, sma_vectorizada
+
+pd = pytest.importorskip("pandas")
+
+N_VELAS = 3 * RESYNC_SUMAS_CADA + 137 # Cruza varios recálculos exactos de las sumas
+TOLERANCIA = dict(rtol=1e-9, atol=1e-7)
+
+def _cierres(n=N_VELAS, semilla=11):
+    rng = np.random.default_rng(semilla)
+    return 50000.0 * np.exp(np.cumsum(rng.normal(0, 0.004, n)))
+
+def rsi_pandas_ta(close, length=RSI_LENGTH):
+    d = pd.Series(close).diff()
+    pos = d.clip(lower=0); neg = (-d).clip(lower=0)
+    rma = lambda x: x.ewm(alpha=1.0 / length, min_periods=length).mean()
+    return (100.0 * rma(pos) / (rma(pos) + rma(neg))).to_numpy()
+
+def sma_pandas(close, n):
+    return pd.Series(close).rolling(n).mean().to_numpy()
+
+def _como_array(valores, clave):
+    return np.array([np.nan if v[clave] is None else v[clave] for v in valores])
+
+@pytest.fixture(scope="module")
+def cierres():
+    return _cierres()
+
+@pytest.fixture(scope="module")
+def incrementales(cierres):
+    # Valores de cada vela al recibir su cierre definitivo, con ticks intermedios de la vela abierta antes
+    estado = EstadoIndicadores(); valores = []; previos = []; anteriores = []
+    for i, c in enumerate(cierres):
+        estado.actualizar(i * 60_000, c * 1.01).actualizar(i * 60_000, c * 0.99) # Ticks que no deben dejar rastro
+        estado.actualizar(i * 60_000, c)
+        valores.append(estado.valores()); previos.append(estado.previo); anteriores.append(estado.anterior)
+    return valores, previos, anteriores
+
+def test_rsi_vectorizado_igual_a_pandas_ta(cierres):
+    np.testing.assert_allclose(rsi_vectorizado(cierres), rsi_pandas_ta(cierres), equal_nan=True, **TOLERANCIA)
+
+@pytest.mark.parametrize("n", SMA_LENGTHS)
+def test_sma_vectorizada_igual_a_pandas(cierres, n):
+    np.testing.assert_allclose(sma_vectorizada(cierres, n), sma_pandas(cierres, n), equal_nan=True, **TOLERANCIA)
+
+def test_rsi_incremental_igual_a_pandas_ta(cierres, incrementales):
+    np.testing.assert_allclose(_como_array(incrementales[0], f"RSI_{RSI_LENGTH}"), rsi_pandas_ta(cierres), equal_nan=True, **TOLERANCIA)
+
+@pytest.mark.parametrize("n", SMA_LENGTHS)
+def test_sma_incremental_igual_a_pandas(cierres, incrementales, n):
+    np.testing.assert_allclose(_como_array(incrementales[0], f"SMA_{n}"), sma_pandas(cierres, n), equal_nan=True, **TOLERANCIA)
+
+def test_calentamiento(cierres, incrementales):
+    # Primer valor en la misma vela que pandas_ta (RSI en la vela length, SMA_n en la n-1) y ninguno antes
+    rsi = _como_array(incrementales[0], f"RSI_{RSI_LENGTH}"); referencia = rsi_pandas_ta(cierres)
+    assert np.isnan(rsi[:RSI_LENGTH]).all() and np.isnan(rsi_vectorizado(cierres)[:RSI_LENGTH]).all()
+    assert not np.isnan(rsi[RSI_LENGTH]) and not np.isnan(referencia[RSI_LENGTH])
+    for n in SMA_LENGTHS:
+        sma = _como_array(incrementales[0], f"SMA_{n}")
+        assert np.isnan(sma[:n - 1]).all() and np.isnan(sma_vectorizada(cierres, n)[:n - 1]).all()
+        assert not np.isnan(sma[n - 1])
+
+def test_previo_y_anterior_son_las_velas_cerradas(incrementales):
+    # gemini_bot evalúa el pre-filtro con estas dos filas (velas -2 y -3)
+    valores, previos, anteriores = incrementales
+    for i in range(2, len(valores)):
+        assert previos[i] == valores[i - 1] and anteriores[i] == valores[i - 2]
@@ -0,0 +1,35 @@
+# Reanudar un barrido solo sobre resultados generados con las mismas klines, pliegues y modo IA
+
+import argparse
+
+import pytest
+
+optimizador = pytest.importorskip("optimizador")
+
+def _contexto(tmp_path, **cambios):
+    klines = tmp_path / "klines.json"
+    if not klines.exists(): klines.write_text("[]")
+    args = argparse.Namespace(**{"klines": str(klines), "ia": "siempre", "ia_fichero": None, "ia_prob": 0.5, "semilla": 0, **cambios})
+    return optimizador.contexto_barrido(args, [(0, 100)])
+
+def test_mismo_barrido_se_reanuda(tmp_path):
+    contexto = _contexto(tmp_path)
+    optimizador.comprobar_contexto("s.jsonl", contexto, {"c": {}}, _contexto(tmp_path))
+
+def test_fichero_vacio_o_nuevo_no_se_comprueba(tmp_path):
+    optimizador.comprobar_contexto("s.jsonl", None, {}, _contexto(tmp_path))
+
+@pytest.mark.parametrize("cambios", [{"ia": "stub"}, {"ia": "stub", "semilla": 1}])
+def test_otro_modo_ia_no_se_reanuda(tmp_path, cambios):
+    base = _contexto(tmp_path, ia="stub") if cambios.get("semilla") else _contexto(tmp_path)
+    with pytest.raises(SystemExit, match="otro barrido"):
+        optimizador.comprobar_contexto("s.jsonl", base, {"c": {}}, _contexto(tmp_path, **cambios))
+
+def test_otras_klines_no_se_reanuda(tmp_path):
+    base = _contexto(tmp_path); (tmp_path / "klines.json").write_text("[[1, 2]]")
+    with pytest.raises(SystemExit, match="klines"):
+        optimizador.comprobar_contexto("s.jsonl", base, {"c": {}}, _contexto(tmp_path))
+
+def test_resultados_sin_cabecera_no_se_reanudan(tmp_path):
+    with pytest.raises(SystemExit, match="sin cabecera|no tiene cabecera"):
+        optimizador.comprobar_contexto("s.jsonl", None, {"c": {}}, _contexto(tmp_path))
@@ -0,0 +1,72 @@
+# --- START OF FILE velas.py ---
+
+# Decodificación de klines de Binance a un array estructurado de NumPy (open/close time en ms como int64,
+# OHLCV como float64 y las columnas de indicadores), sin DataFrame ni objetos por fila en el bucle principal.
+# BufferVelas guarda las velas ya decodificadas de un par/intervalo en un array preasignado y en cada ciclo
+# solo decodifica la vela que estaba abierta y las nuevas; las cerradas no cambian y no se vuelven a parsear.
+# como_dataframe() da la vista de pandas para quien la necesite (análisis, notebooks).
+
+import time
+
+import numpy as np
+
+COLUMNAS_INDICADORES = ('RSI_14', 'SMA_20', 'SMA_50')
+DTYPE_VELA = np.dtype([('open_time', 'i8'), ('open', 'f8'), ('high', 'f8'), ('low', 'f8'), ('close', 'f8'), ('volume', 'f8'),
+                       ('close_time', 'i8')] + [(c, 'f8') for c in COLUMNAS_INDICADORES])
+_CAMPOS_OHLCV = ('open', 'high', 'low', 'close', 'volume')
+
+def decodificar_klines(klines, salida=None):
+    # Filas de get_klines ([open_time, "open", "high", "low", "close", "volume", close_time, ...]) -> array DTYPE_VELA.
+    # Con salida (array DTYPE_VELA de la misma longitud) se escribe ahí en vez de reservar uno nuevo.
+    n = len(klines)
+    velas = np.empty(n, dtype=DTYPE_VELA) if salida is None else salida
+    if n == 0: return velas
+    ohlcv = np.fromiter((v for k in klines for v in k[1:6]), dtype=np.float64, count=n * 5).reshape(n, 5) # float() de cada str en C
+    for i, campo in enumerate(_CAMPOS_OHLCV): velas[campo] = ohlcv[:, i]
+    velas['open_time'] = np.fromiter((k[0] for k in klines), dtype=np.int64, count=n)
+    velas['close_time'] = np.fromiter((k[6] for k in klines), dtype=np.int64, count=n)
+    for c in COLUMNAS_INDICADORES: velas[c] = np.nan
+    return velas
+
+class BufferVelas:
+    def __init__(self, capacidad):
+        self.datos = np.empty(2 * capacidad, dtype=DTYPE_VELA) # Holgura para añadir sin mover en cada vela
+        self.inicio = 0; self.fin = 0
+
+    def sincronizar(self, klines):
+        # Deja en el buffer las mismas velas que klines (lista cruda ordenada por open time) y devuelve la vista.
+        # Busca desde el final la última vela decodificada: de ahí en adelante se redecodifica, lo anterior se conserva.
+        n = len(klines); j = 0 # klines[:j] ya están decodificadas al final del buffer
+        if n and self.fin > self.inicio:
+            ultima = int(self.datos['open_time'][self.fin - 1]); j = n
+            while j > 0 and klines[j - 1][0] > ultima: j -= 1
+            if j > 0 and klines[j - 1][0] == ultima and self.fin - self.inicio >= j: j -= 1; self.fin -= 1 # La que estaba abierta se redecodifica
+            else: j = 0 # Caché resembrada: todo de nuevo
+        if j == 0: self.fin = 0
+        nuevas = n - j
+        if self.fin + nuevas > len(self.datos): # Sin sitio al final: las j que siguen valiendo pasan al principio
+            destino = self.datos if n <= len(self.datos) else np.empty(2 * n, dtype=DTYPE_VELA)
+            destino[:j] = self.datos[self.fin - j:self.fin]; self.datos = destino; self.fin = j
+        decodificar_klines(klines[j:], self.datos[self.fin:self.fin + nuevas]); self.fin += nuevas
+        self.inicio = self.fin - n
+        return self.datos[self.inicio:self.fin]
+
+def fila(velas, pos=-1):
+    # Vela como dict de valores de Python; los indicadores sin calcular (NaN) salen como None
+    v = velas[pos]
+    return {c: (None if isinstance(x, float) and x != x else x) for c, x in zip(DTYPE_VELA.names, v.tolist())}
+
+def puntos_grafico(velas, n):
+    # [{"time": segundos, "open", "high", "low", "close"}] de las n últimas velas, para el gráfico de la web.
+    # velas puede ser un array DTYPE_VELA o un dict de columnas (almacen_velas.leer)
+    t, o, h, l, c = ((velas[col][-n:] // 1000 if col == 'open_time' else velas[col][-n:]).tolist() for col in ('open_time', 'open', 'high', 'low', 'close'))
+    return [{"time": ti, "open": oi, "high": hi, "low": li, "close": ci} for ti, oi, hi, li, ci in zip(t, o, h, l, c)]
+
+def hora_utc(open_time_ms, formato='%H:%M'):
+    return time.strftime(formato, time.gmtime(open_time_ms / 1000))
+
+def como_dataframe(velas):
+    import pandas as pd # Diferido: el bucle principal no lo usa
+    df = pd.DataFrame(velas)
+    df.insert(0, 'timestamp', pd.to_datetime(df['open_time'], unit='ms'))
+    return df
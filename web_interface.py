@@ -5,12 +5,20 @@ from flask import Flask, render_template_string, request, redirect, url_for, Res
 import os
 import json
 import time
+import select
+import threading
 import psycopg2 
 import psycopg2.extras
+import psycopg2.extensions
 from datetime import datetime
-import decimal
 from dotenv import load_dotenv
 
+import bot_ipc
+from bot_ipc import chart_delta_events
+from metricas import formato_prometheus
+from almacen_velas import AlmacenVelas, INTERVALOS_MS
+from velas import puntos_grafico
+
 load_dotenv() 
 app = Flask(__name__) # Definir la app principal
 
@@ -23,6 +31,29 @@ BASE_ASSET_UI = "BTC"
 QUOTE_ASSET_UI = "USDT"
 DEFAULT_CHECK_INTERVAL_FOR_TEMPLATE = 60 
 HISTORY_LIMIT = 10
+HISTORY_NOTIFY_CHANNEL = "trading_log_nuevo" # Mismo canal que DB_NOTIFY_CHANNEL en gemini_bot.py
+HISTORY_POLL_SECONDS = 10 # Respaldo: el poller relee el historial aunque no llegue ningún NOTIFY
+HISTORY_PAGE_DEFAULT = 50; HISTORY_PAGE_MAX = 500 # Filas por página de /history
+PNL_TABLE = "trading_pnl_diario" # Rollup diario que mantiene el bot (DB_PNL_TABLE en gemini_bot.py)
+PNL_PERIODS = {"dia": "day", "semana": "week", "mes": "month"} # ?periodo= de /history/pnl -> date_trunc
+PNL_PERIODS_DEFAULT = 30
+USE_IPC_CHANNEL = os.environ.get("BOT_IPC", "true").strip().lower() in ("1", "true", "si", "yes") # Mismo interruptor que el bot
+IPC_COMMAND_TIMEOUT = 2.0 # Segundos esperando el ack de un comando antes de recurrir al fichero
+KLINE_STORE_DIR = os.environ.get("BOT_KLINE_STORE", "almacen_velas") # Mismo almacén de velas que escribe el bot
+CHART_HISTORY_MAX = 5000 # Velas máximas por petición a /chart_history
+
+# --- HISTORIAL COMPARTIDO ---
+# Un único hilo mantiene en memoria la última instantánea del historial (LISTEN/NOTIFY + sondeo de respaldo)
+# y todos los clientes SSE la leen de aquí: la carga en la BD no depende del número de pestañas abiertas.
+history_snapshot = {"version": 0, "data": []}
+history_cond = threading.Condition() # También avisa de estado/gráfico nuevos recibidos por el canal IPC
+history_poller_thread = None
+
+# --- CANAL IPC CON EL BOT ---
+# Con el bot en marcha, estado, gráfico y acks de comandos llegan por el socket de bot_ipc; sin él se usan los ficheros JSON.
+ipc_client = None
+ipc_updates = {"version": 0}
+last_command_ack = {"text": None}
 
 # --- BLUEPRINT ---
 # Crear un Blueprint SIN prefijo de URL. Nginx se encargará del prefijo.
@@ -71,6 +102,7 @@ HTML_TEMPLATE = """
         <form method="POST" action="{{ url_for('bot_api.send_command') }}"><input type="hidden" name="command" value="FORCE_SELL"><button type="submit" class="btn btn-sell">Forzar VENTA</button></form>
         <form method="POST" action="{{ url_for('bot_api.send_command') }}"><input type="hidden" name="command" value="FORCE_IA_CONSULT"><button type="submit" class="btn btn-ia">Forzar CONSULTA IA</button></form>
         <form method="POST" action="{{ url_for('bot_api.send_command') }}"><input type="hidden" name="command" value="CLEAR_FORCED_ACTION"><button type="submit" class="btn btn-clear">Limpiar Acción</button></form>
+        <form method="POST" action="{{ url_for('bot_api.send_command') }}"><input type="hidden" name="command" value="PROFILE"><button type="submit" class="btn btn-clear">Perfilar 5 ciclos/ticks</button></form>
     </div>
     <div class="main-content">
         <div class="chart-container"><div id="tvchart"></div></div>
@@ -91,7 +123,8 @@ HTML_TEMPLATE = """
             <p><strong>Última Acción Bot:</strong> <span id="status_last_action">N/A</span></p>
             <p><strong>Actualizado:</strong> <span id="status_timestamp">N/A</span></p>
             <p><strong>Próx. Ciclo en:</strong> <span id="status_next_cycle_countdown">Calculando...</span></p>
-            <div class="command-status"><strong>Archivo Comando:</strong><br><span id="command_file_display">No hay comando.</span></div>
+            <p><strong>Ciclo p50 / p99:</strong> <span id="status_cycle_latency">N/A</span></p>
+            <div class="command-status"><strong>Último Comando:</strong><br><span id="command_file_display">No hay comando.</span></div>
             <div class="history-log">
                 <h3>Historial (Últimas {{ HISTORY_LIMIT }})</h3>
                 <table>
@@ -99,6 +132,13 @@ HTML_TEMPLATE = """
                     <tbody id="history_table_body"></tbody>
                 </table>
             </div>
+            <div class="history-log">
+                <h3>P&L por <select id="pnl_period"><option value="dia">día</option><option value="semana">semana</option><option value="mes">mes</option></select></h3>
+                <table>
+                    <thead><tr><th class="col-time">Periodo</th><th class="col-qty">Ops.</th><th class="col-qty">Acierto</th><th class="col-price">P&L</th><th class="col-price">Acum.</th></tr></thead>
+                    <tbody id="pnl_table_body"></tbody>
+                </table>
+            </div>
         </div>
     </div>
 <script>
@@ -109,6 +149,10 @@ HTML_TEMPLATE = """
     let countdownIntervalId = null;
     let currentCheckInterval = {{ DEFAULT_CHECK_INTERVAL }}; 
     let timeRemainingForNextCycle = currentCheckInterval;
+    const historyLimit = {{ HISTORY_LIMIT }};
+    let historyRows = [];
+    let sseCombined = null; let streamVersion = 0;
+    let liveCandles = []; let olderCandles = []; let loadingOlder = false; let noMoreOlder = false; // olderCandles: del almacén de velas
 
     function formatTime(totalSeconds) {
         if (totalSeconds < 0) return "0s";
@@ -137,15 +181,47 @@ HTML_TEMPLATE = """
     
     function updateChartData(ohlcData) {
         if (!candlestickSeries) { /* console.warn("updateChartData: candlestickSeries no inicializada."); */ return; }
-        if (ohlcData && ohlcData.length > 0) {
-            const formattedOhlcData = ohlcData.map(d => ({
-                time: d.time, open: parseFloat(d.open), high: parseFloat(d.high),
-                low: parseFloat(d.low), close: parseFloat(d.close)
-            }));
-            candlestickSeries.setData(formattedOhlcData);
-        } else {
-            candlestickSeries.setData([]);
-        }
+        liveCandles = (ohlcData && ohlcData.length > 0) ? ohlcData.map(formatCandle) : [];
+        renderCandles();
+    }
+
+    function renderCandles() {
+        const firstLive = liveCandles.length ? liveCandles[0].time : Infinity;
+        candlestickSeries.setData(olderCandles.filter(c => c.time < firstLive).concat(liveCandles));
+    }
+
+    // Deltas SSE: liveCandles sigue la misma ventana que el servidor, así un setData posterior no pierde velas
+    function applyLiveCandle(d) {
+        const c = formatCandle(d); const last = liveCandles[liveCandles.length - 1];
+        if (last && last.time === c.time) liveCandles[liveCandles.length - 1] = c;
+        else if (!last || c.time > last.time) {
+            const largo = liveCandles.length; liveCandles.push(c);
+            if (largo) { // Mismo tamaño de ventana que bot_ipc; lo que sale pasa a las anteriores si ya se cargaron
+                const fuera = liveCandles.splice(0, liveCandles.length - largo);
+                if (olderCandles.length) olderCandles = olderCandles.concat(fuera);
+            }
+        } else return;
+        if (candlestickSeries) candlestickSeries.update(c);
+    }
+
+    // Al desplazar el gráfico hasta el principio se piden al almacén de velas las anteriores a la primera visible
+    function loadOlderCandles() {
+        if (loadingOlder || noMoreOlder || !candlestickSeries) return;
+        const first = olderCandles.length ? olderCandles[0].time : (liveCandles.length ? liveCandles[0].time : null);
+        if (first === null) return;
+        loadingOlder = true;
+        fetch(`{{ url_for('bot_api.chart_history') }}?hasta=${first}&limite=500`)
+            .then(r => r.ok ? r.json() : [])
+            .then(data => {
+                if (!data.length) { noMoreOlder = true; return; }
+                olderCandles = data.map(formatCandle).concat(olderCandles); renderCandles();
+            })
+            .catch(e => console.error("Error cargando velas anteriores:", e))
+            .finally(() => { loadingOlder = false; });
+    }
+
+    function formatCandle(d) {
+        return { time: d.time, open: parseFloat(d.open), high: parseFloat(d.high), low: parseFloat(d.low), close: parseFloat(d.close) };
     }
 
     function updateStatusPanel(statusData) {
@@ -166,8 +242,11 @@ HTML_TEMPLATE = """
         document.getElementById('status_bal_base').textContent = (statusData.base_asset_balance !== null && statusData.base_asset_balance !== undefined) ? parseFloat(statusData.base_asset_balance).toFixed(8) : na;
         document.getElementById('status_bal_quote').textContent = (statusData.quote_asset_balance !== null && statusData.quote_asset_balance !== undefined) ? parseFloat(statusData.quote_asset_balance).toFixed(4) : na;
         document.getElementById('status_last_action').textContent = statusData.last_bot_action || na;
+        document.getElementById('status_cycle_latency').textContent = (statusData.cycle_p50_ms !== null && statusData.cycle_p50_ms !== undefined) ? `${statusData.cycle_p50_ms} ms / ${statusData.cycle_p99_ms} ms` : na;
         document.getElementById('status_timestamp').textContent = statusData.timestamp ? new Date(statusData.timestamp).toLocaleTimeString([], { hour: '2-digit', minute: '2-digit', second: '2-digit' }) : na;
-        if (statusData.check_interval_seconds && parseInt(statusData.check_interval_seconds, 10) > 0) {
+        if (statusData.next_cycle_seconds !== null && statusData.next_cycle_seconds !== undefined) { // Ciclo completo al cierre de vela
+            currentCheckInterval = parseInt(statusData.next_cycle_seconds, 10);
+        } else if (statusData.check_interval_seconds && parseInt(statusData.check_interval_seconds, 10) > 0) {
             currentCheckInterval = parseInt(statusData.check_interval_seconds, 10);
         }
         startCycleCountdown(); 
@@ -219,6 +298,77 @@ HTML_TEMPLATE = """
         }
     }
     
+    // G/P por periodo desde el rollup de la BD; se recarga al cambiar de periodo y cuando llega una operación cerrada
+    function loadPnl() {
+        const period = document.getElementById('pnl_period').value;
+        fetch(`{{ url_for('bot_api.history_pnl') }}?periodo=${period}&limite=14`)
+            .then(r => r.ok ? r.json() : [])
+            .then(rows => {
+                const tableBody = document.getElementById('pnl_table_body'); tableBody.innerHTML = '';
+                if (!rows.length) {
+                    const cell = tableBody.insertRow().insertCell(); cell.colSpan = 5; cell.textContent = 'Sin operaciones cerradas.'; cell.style.textAlign = 'center'; return;
+                }
+                rows.forEach(p => {
+                    const row = tableBody.insertRow();
+                    row.insertCell().textContent = p.periodo;
+                    row.insertCell().textContent = p.operaciones;
+                    row.insertCell().textContent = p.win_rate !== null ? (p.win_rate * 100).toFixed(0) + '%' : '-';
+                    [p.pnl_usdt, p.pnl_acumulado_usdt].forEach(v => {
+                        const cell = row.insertCell(); cell.textContent = v.toFixed(2);
+                        if (v > 0) cell.className = 'pnl-positive'; else if (v < 0) cell.className = 'pnl-negative';
+                    });
+                });
+            })
+            .catch(e => console.error("Error cargando P&L:", e));
+    }
+
+    // Eventos SSE versionados: cada uno trae v = anterior + 1. Un salto de versión implica que se perdió algo:
+    // se reabre el stream y el servidor empieza con un snapshot completo.
+    function acceptVersion(msg) {
+        if (msg.v !== streamVersion + 1) { console.warn(`Versión SSE inesperada (${msg.v}, esperaba ${streamVersion + 1}). Resincronizando...`); openStream(); return false; }
+        streamVersion = msg.v; return true;
+    }
+
+    function applyStatus(msg) {
+        if (msg.bot_status && Object.keys(msg.bot_status).length) updateStatusPanel(msg.bot_status);
+        document.getElementById('command_file_display').textContent = msg.command_file_status || "No hay comando.";
+    }
+
+    function openStream() {
+        if (sseCombined) sseCombined.close();
+        streamVersion = 0;
+        sseCombined = new EventSource("{{ url_for('bot_api.stream_all_data') }}");
+        sseCombined.addEventListener('snapshot', function(event) {
+            try {
+                const msg = JSON.parse(event.data); streamVersion = msg.v;
+                updateChartData(msg.chart_data);
+                applyStatus(msg);
+                historyRows = msg.history_data || []; updateHistoryTable(historyRows);
+                if (chart) handleResize();
+            } catch (e) { console.error("Error aplicando snapshot SSE:", e, event.data); }
+        });
+        sseCombined.addEventListener('candle-update', function(event) {
+            const msg = JSON.parse(event.data);
+            if (acceptVersion(msg)) applyLiveCandle(msg.candle);
+        });
+        sseCombined.addEventListener('candle-append', function(event) {
+            const msg = JSON.parse(event.data);
+            if (acceptVersion(msg)) msg.candles.forEach(applyLiveCandle);
+        });
+        sseCombined.addEventListener('status', function(event) {
+            const msg = JSON.parse(event.data);
+            if (acceptVersion(msg)) applyStatus(msg);
+        });
+        sseCombined.addEventListener('history-append', function(event) {
+            const msg = JSON.parse(event.data);
+            if (!acceptVersion(msg)) return;
+            historyRows = msg.rows.concat(historyRows).slice(0, historyLimit); updateHistoryTable(historyRows);
+            if (msg.rows.some(r => r.ganancia_perdida_operacion_usdt !== null)) loadPnl();
+        });
+        // EventSource reconecta solo; el servidor abre cada conexión nueva con un snapshot
+        sseCombined.onerror = function(err) { console.error("SSE Combined failed:", err); };
+    }
+
     function handleResize() { if (chart && chartDiv) chart.resize(chartDiv.clientWidth, chartDiv.clientHeight); }
 
     document.addEventListener('DOMContentLoaded', function() {
@@ -289,6 +439,7 @@ HTML_TEMPLATE = """
                 { time: Math.floor(Date.now() / 1000), open: 16100, high: 16200, low: 16080, close: 16180 }, 
             ]);
             console.log("Datos de ejemplo añadidos a la serie.");
+            chart.timeScale().subscribeVisibleLogicalRangeChange(range => { if (range && range.from < 10) loadOlderCandles(); });
         } else {
             console.warn("candlestickSeries no se pudo inicializar.");
         }
@@ -296,30 +447,10 @@ HTML_TEMPLATE = """
         window.addEventListener('resize', handleResize);
         handleResize(); 
 
-        fetch("{{ url_for('bot_api.get_initial_data') }}")
-            .then(response => response.json())
-            .then(data => {
-                console.log("Initial data fetched:", data); // LOG PARA VER DATOS INICIALES
-                if (data.chart_data) { updateChartData(data.chart_data); }
-                if (data.bot_status) { updateStatusPanel(data.bot_status); } 
-                else { startCycleCountdown(); }
-                if (data.history_data) { updateHistoryTable(data.history_data); } // Cargar historial
-                if (chart) handleResize();
-            })
-            .catch(err => { console.error("Error fetching initial data:", err); startCycleCountdown(); });
-
-        const sseCombined = new EventSource("{{ url_for('bot_api.stream_all_data') }}");
-        sseCombined.onmessage = function(event) {
-            try {
-                const combinedData = JSON.parse(event.data);
-                // console.log("SSE data received:", combinedData); // LOG PARA VER DATOS SSE
-                if (combinedData.chart_data) { updateChartData(combinedData.chart_data); }
-                if (combinedData.bot_status) { updateStatusPanel(combinedData.bot_status); }
-                if (combinedData.history_data) { updateHistoryTable(combinedData.history_data); }
-                document.getElementById('command_file_display').textContent = combinedData.command_file_status || "No hay comando.";
-            } catch (e) { console.error("Error parsing SSE data:", e, "Received data:", event.data); }
-        };
-        sseCombined.onerror = function(err) { console.error("SSE Combined failed:", err); };
+        startCycleCountdown();
+        openStream();
+        document.getElementById('pnl_period').addEventListener('change', loadPnl);
+        loadPnl();
     });
 </script>
 </body>
@@ -338,38 +469,151 @@ def get_db_connection_web():
         logging.error(f"Error conectando a BD desde la web: {e}")
         return None
 
-def fetch_history_from_db(limit=HISTORY_LIMIT):
+def query_history_page(conn, limit, before_id=None, actions=None, symbol=None, since=None, until=None):
+    # Página del historial por cursor (id < before_id, id descendente). PostgreSQL devuelve ya el JSON
+    # {"rows": [...], "next_cursor": id|null} como texto: ni Decimal ni datetime pasan por Python.
+    conditions = []; params = []
+    if before_id is not None: conditions.append("id < %s"); params.append(before_id)
+    if actions: conditions.append("accion_bot = ANY(%s)"); params.append(list(actions))
+    if symbol: conditions.append("simbolo = %s"); params.append(symbol)
+    if since is not None: conditions.append("timestamp >= %s"); params.append(since)
+    if until is not None: conditions.append("timestamp < %s"); params.append(until)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    with conn.cursor() as cur:
+        cur.execute(f"""
+            SELECT json_build_object(
+                'rows', COALESCE(json_agg(t ORDER BY t.id DESC), '[]'::json),
+                'next_cursor', CASE WHEN count(*) = %s THEN min(t.id) END)::text
+            FROM (
+                SELECT
+                    id, timestamp, accion_bot, simbolo,
+                    precio_ejecutado::float8 AS precio_ejecutado, cantidad_base_ejecutada::float8 AS cantidad_base_ejecutada,
+                    costo_total_usdt::float8 AS costo_total_usdt, tipo_orden_ia,
+                    ganancia_perdida_operacion_usdt::float8 AS ganancia_perdida_operacion_usdt, orderid_abierta
+                FROM trading_log {where}
+                ORDER BY id DESC
+                LIMIT %s
+            ) t
+        """, [limit] + params + [limit])
+        return cur.fetchone()[0]
+
+def query_pnl_rollup(conn, period, symbol=None, since=None, until=None, limit=PNL_PERIODS_DEFAULT):
+    # G/P y tasa de acierto por día/semana/mes desde el rollup diario (sin recorrer trading_log), JSON en texto
+    conditions = []; params = [PNL_PERIODS[period]]
+    if symbol: conditions.append("simbolo = %s"); params.append(symbol)
+    if since is not None: conditions.append("dia >= %s::date"); params.append(since)
+    if until is not None: conditions.append("dia < %s::date"); params.append(until)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    with conn.cursor() as cur:
+        cur.execute(f"""
+            SELECT COALESCE(json_agg(p ORDER BY p.periodo DESC), '[]'::json)::text
+            FROM (
+                SELECT g.periodo, g.operaciones, g.ganadoras, g.perdedoras,
+                       round(g.ganadoras::numeric / NULLIF(g.operaciones, 0), 4)::float8 AS win_rate,
+                       g.pnl_usdt::float8 AS pnl_usdt, g.mejor_usdt::float8 AS mejor_usdt, g.peor_usdt::float8 AS peor_usdt,
+                       (sum(g.pnl_usdt) OVER (ORDER BY g.periodo))::float8 AS pnl_acumulado_usdt
+                FROM (
+                    SELECT date_trunc(%s, dia)::date AS periodo, sum(operaciones) AS operaciones, sum(ganadoras) AS ganadoras,
+                           sum(perdedoras) AS perdedoras, sum(pnl_usdt) AS pnl_usdt, max(mejor_usdt) AS mejor_usdt, min(peor_usdt) AS peor_usdt
+                    FROM {PNL_TABLE} {where}
+                    GROUP BY 1
+                ) g
+                ORDER BY g.periodo DESC
+                LIMIT %s
+            ) p
+        """, params + [limit])
+        return cur.fetchone()[0]
+
+def fetch_history_from_db(limit=HISTORY_LIMIT, conn=None):
     history = []
-    conn = get_db_connection_web()
+    conexion_propia = conn is None
+    if conexion_propia: conn = get_db_connection_web()
     if conn:
-        try:
-            with conn.cursor(cursor_factory=psycopg2.extras.DictCursor) as cur:
-                cur.execute(f"""
-                    SELECT 
-                        timestamp, accion_bot, simbolo, 
-                        precio_ejecutado, cantidad_base_ejecutada, costo_total_usdt, 
-                        tipo_orden_ia, ganancia_perdida_operacion_usdt, orderid_abierta
-                    FROM trading_log 
-                    ORDER BY id DESC 
-                    LIMIT %s
-                """, (limit,))
-                rows = cur.fetchall()
-                for row_data in rows:
-                    processed_row = {}
-                    for key, value in dict(row_data).items():
-                        if isinstance(value, decimal.Decimal):
-                            processed_row[key] = float(value)
-                        elif isinstance(value, datetime):
-                             processed_row[key] = value.isoformat()
-                        else:
-                            processed_row[key] = value
-                    history.append(processed_row)
+        try: history = json.loads(query_history_page(conn, limit))["rows"]
         except Exception as e:
             logging.error(f"Error obteniendo historial de BD: {e}")
+            if not conexion_propia: raise # El poller reconecta
         finally:
-            conn.close()
+            if conexion_propia: conn.close()
     return history
 
+def publish_history(history):
+    with history_cond:
+        if history_snapshot["version"] == 0 or history != history_snapshot["data"]:
+            history_snapshot["data"] = history; history_snapshot["version"] += 1
+            history_cond.notify_all()
+
+def _history_poller_loop():
+    conn = None
+    while True:
+        try:
+            if conn is None or conn.closed:
+                conn = get_db_connection_web()
+                if conn is None: publish_history([]); time.sleep(HISTORY_POLL_SECONDS); continue
+                conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+                with conn.cursor() as cur: cur.execute(f"LISTEN {HISTORY_NOTIFY_CHANNEL};")
+                logging.info(f"Poller de historial escuchando '{HISTORY_NOTIFY_CHANNEL}'.")
+            publish_history(fetch_history_from_db(conn=conn))
+            if select.select([conn], [], [], HISTORY_POLL_SECONDS) != ([], [], []):
+                conn.poll(); conn.notifies.clear() # Varios NOTIFY seguidos -> una sola relectura
+        except Exception as e:
+            logging.error(f"Error en el poller de historial: {e}")
+            try: conn.close()
+            except Exception: pass
+            conn = None; time.sleep(HISTORY_POLL_SECONDS)
+
+def ensure_history_poller():
+    global history_poller_thread
+    with history_cond:
+        if history_poller_thread is None or not history_poller_thread.is_alive():
+            history_poller_thread = threading.Thread(target=_history_poller_loop, name="history-poller", daemon=True)
+            history_poller_thread.start()
+
+def get_history_snapshot(wait_for_first=2.0):
+    ensure_history_poller()
+    with history_cond:
+        if history_snapshot["version"] == 0: history_cond.wait(timeout=wait_for_first)
+        return history_snapshot["version"], history_snapshot["data"]
+
+def _notify_ipc_update():
+    with history_cond:
+        ipc_updates["version"] += 1; history_cond.notify_all()
+
+def ensure_ipc_client():
+    global ipc_client
+    if not USE_IPC_CHANNEL: return None
+    with history_cond:
+        if ipc_client is None:
+            try: ipc_client = bot_ipc.IpcClient(on_update=_notify_ipc_update).start()
+            except AttributeError as e: logging.warning(f"Canal IPC no soportado en esta plataforma ({e}).")
+    return ipc_client
+
+def status_for_ui(bot_status):
+    # Las métricas completas solo se sirven en /bot/metrics; el panel usa cycle_p50_ms/cycle_p99_ms
+    return {k: v for k, v in bot_status.items() if k != "metrics"} if isinstance(bot_status, dict) else bot_status
+
+def read_bot_data():
+    # (chart_data, bot_status) del canal IPC si está conectado; si no, de los ficheros que escribe el bot
+    client = ensure_ipc_client()
+    status, chart = client.get_principal() if client else (None, None)
+    if status is None: return read_json_file(CHART_DATA_FILE, []) or [], read_json_file(BOT_STATUS_FILE, {}) or {}
+    return chart, status
+
+def send_command_ipc(command_str):
+    client = ensure_ipc_client()
+    if client is None: return False
+    t0 = time.monotonic()
+    ack = client.send_command(command_str.strip().upper(), timeout=IPC_COMMAND_TIMEOUT)
+    if ack is None: return False
+    last_command_ack["text"] = f"{ack.get('message')} ({'ok' if ack.get('ok') else 'rechazado'}, {(time.monotonic() - t0) * 1000:.0f} ms)"
+    logging.info(f"Comando '{command_str}' enviado por IPC: {last_command_ack['text']}")
+    _notify_ipc_update()
+    return True
+
+def get_command_status():
+    if ipc_client is not None and ipc_client.connected and last_command_ack["text"]: return last_command_ack["text"]
+    return get_command_file_status()
+
 def write_command(command_str):
     try:
         with open(COMMAND_FILE, 'w') as f: f.write(command_str.strip().upper())
@@ -409,54 +653,116 @@ def index():
 @bot_api.route('/command', methods=['POST'])
 def send_command():
     command_from_form = request.form.get('command')
-    if command_from_form: write_command(command_from_form)
+    if command_from_form and not send_command_ipc(command_from_form): write_command(command_from_form)
     return redirect(url_for('bot_api.index'))
 
+@bot_api.route('/metrics')
+def bot_metrics():
+    # Exposición Prometheus de las métricas que el bot publica con el estado del símbolo principal
+    _, bot_status = read_bot_data()
+    metrics = bot_status.get("metrics") if isinstance(bot_status, dict) else None
+    if not metrics: return Response("# Sin métricas del bot todavía\n", status=503, mimetype="text/plain")
+    return Response(formato_prometheus(metrics), mimetype="text/plain; version=0.0.4; charset=utf-8")
+
+def _date_arg(name):
+    value = request.args.get(name)
+    if not value: return None
+    try: return datetime.fromisoformat(value)
+    except ValueError: raise ValueError(f"'{name}' no es una fecha ISO: {value}")
+
+def _json_from_db(query, *args, **kwargs):
+    # Ejecuta una consulta que devuelve JSON ya serializado por PostgreSQL y lo sirve tal cual
+    conn = get_db_connection_web()
+    if conn is None: return jsonify({"error": "Sin conexión a la BD"}), 503
+    try: return Response(query(conn, *args, **kwargs), mimetype="application/json")
+    except Exception as e: logging.error(f"Error consultando la BD: {e}"); return jsonify({"error": "Error consultando la BD"}), 500
+    finally: conn.close()
+
+@bot_api.route('/history')
+def history_page():
+    # ?antes_de=<id del next_cursor anterior>&limite=&accion=A,B&simbolo=&desde=&hasta= (fechas ISO)
+    try:
+        limit = max(1, min(request.args.get('limite', HISTORY_PAGE_DEFAULT, type=int), HISTORY_PAGE_MAX))
+        actions = [a.strip() for value in request.args.getlist('accion') for a in value.split(',') if a.strip()]
+        since = _date_arg('desde'); until = _date_arg('hasta')
+    except ValueError as e: return jsonify({"error": str(e)}), 400
+    return _json_from_db(query_history_page, limit, request.args.get('antes_de', type=int), actions,
+                         (request.args.get('simbolo') or "").upper() or None, since, until)
+
+@bot_api.route('/history/pnl')
+def history_pnl():
+    # ?periodo=dia|semana|mes&simbolo=&desde=&hasta=&limite= ; G/P, operaciones, tasa de acierto y acumulado por periodo
+    period = request.args.get('periodo', 'dia')
+    if period not in PNL_PERIODS: return jsonify({"error": f"periodo debe ser uno de {', '.join(PNL_PERIODS)}"}), 400
+    try: since = _date_arg('desde'); until = _date_arg('hasta')
+    except ValueError as e: return jsonify({"error": str(e)}), 400
+    limit = max(1, min(request.args.get('limite', PNL_PERIODS_DEFAULT, type=int), HISTORY_PAGE_MAX))
+    return _json_from_db(query_pnl_rollup, period, (request.args.get('simbolo') or "").upper() or None, since, until, limit)
+
+@bot_api.route('/chart_history')
+def chart_history():
+    # Velas anteriores a 'hasta' (segundos) del almacén de velas del bot, para ampliar el gráfico hacia atrás
+    if not KLINE_STORE_DIR: return jsonify([])
+    _, bot_status = read_bot_data(); bot_status = bot_status if isinstance(bot_status, dict) else {}
+    symbol = (request.args.get('symbol') or bot_status.get('symbol') or f"{BASE_ASSET_UI}{QUOTE_ASSET_UI}").upper()
+    interval = request.args.get('interval') or bot_status.get('kline_interval') or "15m"
+    if not symbol.isalnum() or interval not in INTERVALOS_MS: return jsonify({"error": "symbol/interval no válidos"}), 400
+    hasta = request.args.get('hasta', type=int); limite = max(1, min(request.args.get('limite', 500, type=int), CHART_HISTORY_MAX))
+    velas = AlmacenVelas(KLINE_STORE_DIR).leer(symbol, interval, hasta=hasta * 1000 if hasta else None, limite=limite)
+    return jsonify(puntos_grafico(velas, limite))
+
 @bot_api.route('/get_initial_data')
 def get_initial_data():
-    chart_data = read_json_file(CHART_DATA_FILE, [])
-    bot_status = read_json_file(BOT_STATUS_FILE, {})
-    history_data = fetch_history_from_db() 
+    chart_data, bot_status = read_bot_data()
+    _, history_data = get_history_snapshot()
     logging.info(f"Initial data request: {len(history_data)} history items")
     return jsonify({
         "chart_data": chart_data, 
-        "bot_status": bot_status,
+        "bot_status": status_for_ui(bot_status),
         "history_data": history_data 
     })
 
+def history_append_rows(prev_history, new_history):
+    # Filas nuevas (id mayor que el último conocido) o None si el historial no es una continuación del anterior.
+    if not prev_history: return new_history if not new_history else None
+    max_id = max(row.get("id") or 0 for row in prev_history)
+    nuevas = [row for row in new_history if (row.get("id") or 0) > max_id]
+    antiguas = [row for row in new_history if (row.get("id") or 0) <= max_id]
+    return nuevas if antiguas == prev_history[:len(antiguas)] else None
+
+def sse_event(event_type, version, payload):
+    payload["v"] = version
+    return f"event: {event_type}\nid: {version}\ndata: {json.dumps(payload)}\n\n"
+
 @bot_api.route('/stream_all_data')
 def stream_all_data():
+    # Eventos SSE versionados: snapshot (al conectar o si un delta no encaja), candle-append, candle-update,
+    # status e history-append. Cada evento lleva v = anterior + 1; si el cliente detecta un salto, reconecta
+    # y recibe un snapshot nuevo.
     def event_stream():
-        last_chart_data_str = ""; last_bot_status_str = ""; last_command_file_status = ""; last_history_str = ""
+        version = 0; last_chart = None; last_status = None; last_history = None; history_version = -1
         while True:
-            chart_data = read_json_file(CHART_DATA_FILE, [])
-            bot_status = read_json_file(BOT_STATUS_FILE, {})
-            command_status = get_command_file_status() 
-            history_data = fetch_history_from_db() 
-
-            current_chart_data_str = json.dumps(chart_data if chart_data else [])
-            current_bot_status_str = json.dumps(bot_status if bot_status else {})
-            current_command_status_str = command_status or "No hay comando."
-            current_history_str = json.dumps(history_data if history_data else [])
-
-            if (current_chart_data_str != last_chart_data_str or
-                current_bot_status_str != last_bot_status_str or
-                current_command_status_str != last_command_file_status or
-                current_history_str != last_history_str ): 
-                
-                payload = {
-                    "chart_data": chart_data, "bot_status": bot_status,
-                    "command_file_status": current_command_status_str,
-                    "history_data": history_data 
-                }
-                yield f"data: {json.dumps(payload)}\n\n" 
-                
-                last_chart_data_str = current_chart_data_str
-                last_bot_status_str = current_bot_status_str
-                last_command_file_status = current_command_status_str
-                last_history_str = current_history_str
-            
-            time.sleep(2)
+            ipc_version = ipc_updates["version"]
+            chart_data, bot_status = read_bot_data()
+            status_payload = {"bot_status": status_for_ui(bot_status), "command_file_status": get_command_status() or "No hay comando."}
+            history_version, history_data = get_history_snapshot()
+
+            chart_events = chart_delta_events(last_chart, chart_data) if last_chart is not None else None
+            new_history = history_append_rows(last_history, history_data) if last_history is not None else None
+            if chart_events is None or new_history is None:
+                version += 1
+                yield sse_event("snapshot", version, dict(status_payload, chart_data=chart_data, history_data=history_data))
+            else:
+                for event_type, payload in chart_events:
+                    version += 1; yield sse_event(event_type, version, payload)
+                if status_payload != last_status:
+                    version += 1; yield sse_event("status", version, dict(status_payload))
+                if new_history:
+                    version += 1; yield sse_event("history-append", version, {"rows": new_history})
+            last_chart = chart_data; last_status = status_payload; last_history = history_data
+
+            with history_cond: # Despierta antes si llega historial nuevo o datos del bot por IPC
+                if history_snapshot["version"] == history_version and ipc_updates["version"] == ipc_version: history_cond.wait(timeout=2)
     return Response(event_stream(), mimetype="text/event-stream")
 
 # --- REGISTRO DEL BLUEPRINT Y EJECUCIÓN ---